@@ -0,0 +1,852 @@
+# LPBench.py — mesures de performance du LedPanelManager
+# -----------------------------------------------------------------------------
+#   python LPBench.py idle    [--seconds 10] [--legacy] [--backend pygame]
+#   python LPBench.py latency [--presses 200] [--legacy] [--backend pygame|evdev|synthetic]
+#   python LPBench.py lip     [--system atari2600] [--game NAME] [--rate 30] [--seconds 5]
+#                             [--noise] [--systems-dir DIR] [--config INI] [--layout NAME] [--binary]
+#   python LPBench.py proto   [--systems-dir DIR] [--config INI]
+#   python LPBench.py rmp     [--players 4] [--rounds 200] [--systems-dir DIR]
+#   python LPBench.py pico    [--commands 200] [--text] [--pace] [--i2c-khz N] [--fade 500]
+#   python LPBench.py esinput [--devices 8] [--events 500]
+#   python LPBench.py mamecfg [--players 2] [--rounds 3] [--systems-dir DIR] [--config INI]
+#   python LPBench.py extract [--roms 48] [--jobs 8] [--startup 0.25] [--timeout 2]
+#
+# idle    : CPU consommé par joystick_listener quand personne ne touche au panel
+# latency : délai entre un event joystick injecté et l’écriture série
+#           correspondante (port série factice, pas de Pico), + RSS max du process
+#             pygame    : event posté dans la file pygame (joystick réel requis)
+#             evdev     : manette virtuelle /dev/uinput (Linux, droits d’écriture requis)
+#             synthetic : event injecté directement dans le backend
+#
+# lip     : rejoue un .lip réel (macros compilées par _load_lip) sous martelage :
+#           chaque bouton qui a une macro est pressé/relâché `rate` fois par seconde
+#           via le backend synthétique, events horodatés à l’injection ; la sortie
+#           série est capturée par le port factice → p50/p95/p99 + débit.
+#           --noise intercale des events hat/axis entre les appuis.
+#
+# proto   : taille des SetPanelColors de chaque layout de systems/*.xml, texte vs trame
+#           binaire (LPProtocol), et coût d’encodage côté hôte.
+# rmp     : vérifie que render_rmp_template rend, octet pour octet, ce que donnait l’ancienne
+#           copie ligne à ligne, pour chaque .rmp de systems/ (n64-CDirect.rmp compris) et des
+#           cas limites (plusieurs <p> par ligne, pas de saut de ligne final), 0..players joueurs ;
+#           code de sortie 1 au premier écart. Puis temps par rendu : copie vs template en cache.
+# pico    : layouts envoyés au Pico virtuel (rp2040/virtualpico.py, pty, Linux/macOS)
+#           via SerialReader/SerialWriter → layouts/s, transactions et temps I2C modélisé
+#           par layout, puis durée réelle d’un FadePanel d’après le journal des registres.
+# esinput : load_es_input (LPInputsPush) par sélection de jeu MAME, sur un es_input.cfg
+#           généré : analyse complète à chaque fois vs provider en cache (mtime/taille).
+# mamecfg : section <input> de chaque jeu de systems/mame (LPInputsPush.build_input) sur des
+#           <game>_inputs.cfg générés : plan recompilé à chaque jeu vs plan en cache, + digest
+#           des sections produites (même digest = même sortie, pour comparer deux versions).
+# extract : LPExtractInputs sur un romset factice et un émulateur factice (script qui attend
+#           `startup` s comme un démarrage MAME puis écrit un dump_inputs.txt préparé ; certaines
+#           ROMs bloquent ou échouent) : 1 job vs --jobs, puis relance (tout est à jour) et
+#           vérification des <port> écrits via LPInputsPush.load_port_index.
+# --binary (lip) : macros compilées en trames binaires, comme avec un firmware proto=1.
+#
+# Les écritures passent par LPEvents.SerialWriter comme en production ;
+# --direct (latency, lip) écrit sur le port factice depuis le thread joystick.
+#           Par défaut : config.ini / systems/ du plugin, sinon ceux de dist/.
+#
+# --legacy rejoue l’ancienne boucle active (pygame.event.get sans attente)
+#          pour comparer avant / après (backend pygame uniquement).
+# Lancer un process par backend pour que le RSS reste comparable.
+# -----------------------------------------------------------------------------
+
+import os
+import sys
+import time
+import struct
+import threading
+import argparse
+
+import LPEvents
+from LPInputBackends import create_input_backend
+from LPProtocol import encode_command, iter_commands
+
+
+class FakeSerial:
+    """Port série factice : horodate chaque write() au lieu de l’envoyer."""
+
+    def __init__(self):
+        self.writes  = []                 # [(perf_counter, bytes), …]
+        self.written = threading.Event()
+        self.in_waiting  = 0
+        self.out_waiting = 0
+
+    def write(self, data):
+        self.writes.append((time.perf_counter(), bytes(data)))
+        self.written.set()
+        return len(data)
+
+    def read(self, n=1):
+        return b''
+
+    def close(self):
+        pass
+
+
+class UinputPad:
+    """Manette virtuelle via /dev/uinput (Linux) : un bouton BTN_SOUTH, sans dépendance."""
+
+    EV_SYN, EV_KEY, SYN_REPORT = 0x00, 0x01, 0
+    BTN_SOUTH = 0x130
+    BUS_USB   = 0x03
+
+    @staticmethod
+    def _iow(nr, size):
+        return (1 << 30) | (size << 16) | (ord('U') << 8) | nr
+
+    def __init__(self, name='LPBench Pad'):
+        import fcntl
+        self.fd = os.open('/dev/uinput', os.O_WRONLY | os.O_NONBLOCK)
+        fcntl.ioctl(self.fd, self._iow(100, 4), self.EV_KEY)                 # UI_SET_EVBIT
+        fcntl.ioctl(self.fd, self._iow(101, 4), self.BTN_SOUTH)              # UI_SET_KEYBIT
+        setup = struct.pack('<HHHH80sI', self.BUS_USB, 0x1209, 0x1ed5, 1, name.encode(), 0)
+        fcntl.ioctl(self.fd, self._iow(3, len(setup)), setup)                # UI_DEV_SETUP
+        fcntl.ioctl(self.fd, (ord('U') << 8) | 1)                            # UI_DEV_CREATE
+
+    def press(self, pressed):
+        os.write(self.fd, struct.pack('llHHi', 0, 0, self.EV_KEY, self.BTN_SOUTH, int(pressed))
+                        + struct.pack('llHHi', 0, 0, self.EV_SYN, self.SYN_REPORT, 0))
+
+    def close(self):
+        import fcntl
+        fcntl.ioctl(self.fd, (ord('U') << 8) | 2)                            # UI_DEV_DESTROY
+        os.close(self.fd)
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = min(len(values) - 1, max(0, int(round(q / 100.0 * (len(values) - 1)))))
+    return values[idx]
+
+
+def max_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None     # Windows
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else rss / 1024.0
+
+
+def _busy_wait(timeout=0):
+    # Ancien comportement : on boucle sur la file sans jamais dormir
+    import pygame
+    while True:
+        ev = pygame.event.poll()
+        if ev.type != pygame.NOEVENT:
+            return ev
+
+
+def make_handler(direct=False):
+    # Par défaut on passe par le SerialWriter comme en production (file + thread d’écriture)
+    fake    = FakeSerial()
+    handler = LPEvents.LedEventHandler(fake if direct else LPEvents.SerialWriter(fake), 1)
+    handler.fake_serial = fake
+    handler.listening = True
+    handler.in_game   = True
+    handler.lip_dispatch = {1: {
+        (0, 'press'):   (b"SetButton=1,B1,YELLOW\n",),
+        (0, 'release'): (b"SetButton=1,B1,BLACK\n",),
+    }}
+    return handler
+
+
+def start_listener(handler, backend, legacy=False):
+    if legacy:
+        import pygame
+        pygame.event.wait = _busy_wait
+    router = LPEvents.InputRouter(1)
+    threading.Thread(target=LPEvents.joystick_listener, args=(handler, router, backend),
+                     daemon=True).start()
+    time.sleep(1.0)   # laisse le backend s’initialiser et énumérer les joysticks
+    return router
+
+
+def bench_idle(seconds, legacy, backend_name):
+    handler = make_handler()
+    backend = create_input_backend(backend_name)
+    start_listener(handler, backend, legacy)
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    time.sleep(seconds)
+    cpu  = time.process_time() - cpu0
+    wall = time.perf_counter() - wall0
+    mode = 'legacy poll' if legacy else backend.name
+    print(f"[idle] {mode}: {cpu:.3f} s CPU over {wall:.1f} s → {100.0 * cpu / wall:.1f} % of one core")
+
+
+def _injector(backend, router):
+    """Renvoie inject(pressed) pour le backend donné, ou None si impossible ici."""
+    if backend.name == 'synthetic':
+        iid = backend.add_device('LPBench Pad', buttons=16)
+        time.sleep(0.1)
+        return lambda pressed: backend.press(iid, 0, pressed)
+
+    if backend.name == 'evdev':
+        try:
+            pad = UinputPad()
+        except OSError as e:
+            print(f"[latency] cannot create a uinput device: {e}")
+            return None
+        # Attendre le prochain rescan du backend pour que la manette soit routée
+        deadline = time.perf_counter() + backend.RESCAN_INTERVAL + 2.0
+        while not router.assigned and time.perf_counter() < deadline:
+            time.sleep(0.05)
+        if not router.assigned:
+            print("[latency] uinput device not picked up by the evdev backend")
+            return None
+        return pad.press
+
+    import pygame
+    if pygame.joystick.get_count() == 0:
+        print("[latency] no joystick connected: the listener only tracks real devices")
+        return None
+    iid = pygame.joystick.Joystick(0).get_instance_id()
+    def inject(pressed):
+        etype = pygame.JOYBUTTONDOWN if pressed else pygame.JOYBUTTONUP
+        pygame.event.post(pygame.event.Event(etype, instance_id=iid, joy=0, button=0))
+    return inject
+
+
+def bench_latency(presses, legacy, backend_name, direct=False):
+    handler = make_handler(direct)
+    backend = create_input_backend(backend_name)
+    router  = start_listener(handler, backend, legacy)
+    inject  = _injector(backend, router)
+    if inject is None:
+        return
+    ser = handler.fake_serial
+
+    samples = []
+    for i in range(presses):
+        for pressed in (True, False):
+            ser.written.clear()
+            n  = len(ser.writes)
+            t0 = time.perf_counter()
+            inject(pressed)
+            if not ser.written.wait(1.0):
+                print("[latency] timeout waiting for the serial write")
+                return
+            samples.append((ser.writes[n][0] - t0) * 1000)
+            time.sleep(0.005)
+
+    mode = 'legacy poll' if legacy else backend.name
+    rss  = max_rss_mb()
+    print(f"[latency] {mode}: n={len(samples)} "
+          f"p50={percentile(samples, 50):.3f} ms "
+          f"p95={percentile(samples, 95):.3f} ms "
+          f"p99={percentile(samples, 99):.3f} ms "
+          f"max={max(samples):.3f} ms"
+          + (f" maxrss={rss:.1f} MB" if rss is not None else ""))
+
+
+def _use_plugin_files(systems_dir, config_ini):
+    """Pointe LPEvents vers les systems/ et config.ini voulus (dist/ par défaut hors install)."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    if systems_dir is None and not os.path.isdir(LPEvents.SYSTEMS_DIR):
+        systems_dir = os.path.join(here, 'dist', 'systems')
+    if config_ini is None and not os.path.exists(LPEvents.PANEL_CONFIG_INI):
+        config_ini = os.path.join(here, 'dist', 'config.ini')
+    if systems_dir:
+        LPEvents.SYSTEMS_DIR = systems_dir
+    if config_ini:
+        LPEvents.PANEL_CONFIG_INI = config_ini
+    LPEvents._read_panel_cfg(force_reload=True)
+
+
+def _load_lip_table(handler, system, game, layout):
+    """Charge le .lip comme au game-start ; essaie chaque layout système si aucun n’est imposé."""
+    handler.last_system = system
+    handler._load_system_layouts(system)
+    candidates = range(len(handler.system_layouts))
+    if layout:
+        candidates = [i for i, l in enumerate(handler.system_layouts) if l['name'] == layout]
+    for idx in candidates:
+        handler.current_layout_idx = idx
+        handler._load_lip(system, game)
+        if handler.lip_dispatch.get(1):
+            return handler.system_layouts[idx]['name']
+    return None
+
+
+def _mash_schedule(table, rate, seconds, noise):
+    """
+    [(t relatif, kind, index, value, nb de commandes attendues)] : chaque bouton du .lip est pressé `rate` fois
+    par seconde (relâché à mi-période), les boutons décalés entre eux pour ne pas tomber pile ensemble.
+    """
+    buttons = sorted({button for button, _ in table})
+    lines   = {key: sum(len(list(iter_commands(c))) for c in cmds) for key, cmds in table.items()}
+    period  = 1.0 / rate
+    sched   = []
+    for n, button in enumerate(buttons):
+        offset = period * n / len(buttons)
+        for k in range(int(seconds * rate)):
+            t = offset + k * period
+            sched.append((t,              'button', button, True,  lines.get((button, 'press'), 0)))
+            sched.append((t + period / 2, 'button', button, False, lines.get((button, 'release'), 0)))
+            if noise:
+                sched.append((t + period / 4, 'hat',  0, (0, 1 if k % 2 else 0), 0))
+                sched.append((t + period / 4, 'axis', 1, 0.25 if k % 2 else -0.25, 0))
+    sched.sort(key=lambda e: e[0])
+    return sched
+
+
+def bench_lip(system, game, rate, seconds, noise, systems_dir, config_ini, layout, direct=False,
+              binary=False):
+    _use_plugin_files(systems_dir, config_ini)
+    LPEvents.SERIAL_PROTO = 1 if binary else 0
+    handler = make_handler(direct)
+    handler.lip_dispatch = {}
+    chosen = _load_lip_table(handler, system, game or system, layout)
+    if chosen is None:
+        print(f"[lip] no .lip macros for '{system}/{game or system}' on panel 1 "
+              f"(systems={LPEvents.SYSTEMS_DIR}, config={LPEvents.PANEL_CONFIG_INI})")
+        return
+    table = handler.lip_dispatch[1]
+
+    backend = create_input_backend('synthetic')
+    start_listener(handler, backend)
+    iid = backend.add_device('LPBench Pad', buttons=32)
+    time.sleep(0.1)
+
+    sched    = _mash_schedule(table, rate, seconds, noise)
+    expected = []                       # (instant d’injection, nb de commandes) des events qui écrivent
+    ser = handler.fake_serial
+    ser.writes.clear()
+
+    t_start = time.perf_counter()
+    for t, kind, index, value, nlines in sched:
+        target = t_start + t
+        delay  = target - time.perf_counter()
+        if delay > 0.002:
+            time.sleep(delay - 0.001)
+        while time.perf_counter() < target:
+            pass
+        now = time.perf_counter()
+        if kind == 'button':
+            backend.press(iid, index, value, ts=now)
+        elif kind == 'hat':
+            backend.hat(iid, value, hat=index, ts=now)
+        else:
+            backend.axis(iid, index, value, ts=now)
+        if nlines:
+            expected.append((now, nlines))
+
+    total    = sum(n for _, n in expected)
+    deadline = time.perf_counter() + 2.0
+    while (sum(len(list(iter_commands(data))) for _, data in ser.writes) < total
+           and time.perf_counter() < deadline):
+        time.sleep(0.01)
+    t_end = ser.writes[-1][0] if ser.writes else time.perf_counter()
+
+    # Listener et SerialWriter gardent l’ordre (une seule priorité ici) : on aligne les
+    # commandes écrites sur les events attendus ; un event est servi quand sa dernière
+    # commande est partie (un write() peut en regrouper plusieurs).
+    samples, i, left = [], 0, expected[0][1] if expected else 0
+    for t_write, data in ser.writes:
+        n = len(list(iter_commands(data)))
+        while n and i < len(expected):
+            used = min(n, left)
+            n, left = n - used, left - used
+            if left == 0:
+                samples.append((t_write - expected[i][0]) * 1000)
+                i += 1
+                left = expected[i][1] if i < len(expected) else 0
+    done = len(samples)
+    if not samples:
+        print("[lip] no serial write captured")
+        return
+    lines   = sum(len(list(iter_commands(data))) for _, data in ser.writes)
+    nbytes  = sum(len(data) for _, data in ser.writes)
+    elapsed = max(t_end - t_start, 1e-9)
+    print(f"[lip] {os.path.basename(system)} ({'binary' if binary else 'text'}) layout '{chosen}': {len(table)} triggers, "
+          f"{len({b for b, _ in table})} buttons @ {rate:g} presses/s each, "
+          f"{len(sched)} events in {seconds:g} s{' (+hat/axis noise)' if noise else ''}")
+    print(f"[lip] latency n={len(samples)} "
+          f"p50={percentile(samples, 50):.3f} ms "
+          f"p95={percentile(samples, 95):.3f} ms "
+          f"p99={percentile(samples, 99):.3f} ms "
+          f"max={max(samples):.3f} ms"
+          + (f" missing={len(expected) - done}" if done < len(expected) else ""))
+    print(f"[lip] throughput {len(ser.writes) / elapsed:.1f} writes/s, "
+          f"{lines / elapsed:.1f} commands/s, {nbytes / elapsed / 1024:.1f} KiB/s "
+          f"(115200 baud ≈ 11.2 KiB/s)")
+
+
+def _layout_commands(handler):
+    """SetPanelColors (default=yes) de chaque layout de systems/*.xml, comme au changement de layout."""
+    cfg     = LPEvents._read_panel_cfg()
+    targets = '|'.join(str(i) for i in range(1, cfg.getint('Panel', 'players_count', fallback=1) + 1))
+    cmds = []
+    for fname in sorted(os.listdir(LPEvents.SYSTEMS_DIR)):
+        if fname.endswith('.xml'):
+            for entry in handler._load_layouts_from_xml(os.path.join(LPEvents.SYSTEMS_DIR, fname)):
+                mapping = ';'.join(f"{lbl}:{clr}" for lbl, clr in entry['buttons'])
+                cmds.append(f"SetPanelColors={targets},{mapping},default=yes\n")
+    return cmds
+
+
+def bench_proto(systems_dir, config_ini):
+    _use_plugin_files(systems_dir, config_ini)
+    handler = make_handler(direct=True)
+    cmds = _layout_commands(handler)
+    if not cmds:
+        print(f"[proto] no layouts found in {LPEvents.SYSTEMS_DIR}")
+        return
+    text   = [len(encode_command(c, 0)) for c in cmds]
+    binary = [len(encode_command(c, 1)) for c in cmds]
+    t0 = time.perf_counter()
+    for c in cmds:
+        encode_command(c, 1)
+    enc_us = (time.perf_counter() - t0) / len(cmds) * 1e6
+    print(f"[proto] {len(cmds)} layout switches (SetPanelColors, default=yes)")
+    print(f"[proto] text   : mean {sum(text) / len(text):.1f} B, max {max(text)} B")
+    print(f"[proto] binary : mean {sum(binary) / len(binary):.1f} B, max {max(binary)} B "
+          f"→ {sum(text) / sum(binary):.1f}x smaller, host encode {enc_us:.1f} µs/command")
+
+
+def _rmp_line_copy(path, players):
+    """Ancienne génération du .rmp : copie ligne à ligne, lignes '<p>' répétées par joueur."""
+    out = []
+    with open(path, 'r', encoding='utf-8') as src:
+        for line in src:
+            if '<p>' in line:
+                for p in range(1, players + 1):
+                    out.append(line.replace('<p>', str(p)))
+            else:
+                out.append(line)
+    return ''.join(out)
+
+
+RMP_EDGE_CASES = {
+    'multi.rmp':    'input_player<p>_btn_a = "<p>"\ninput_libretro_device_p<p> = "<p><p>"\n',
+    'no_eol.rmp':   'input_remap_ports = "1"\n\ninput_player<p>_analog_dpad_mode = "0"',
+    'static.rmp':   'input_libretro_device_p1 = "1"\r\n# aucun <P> joueur\n',
+    'empty.rmp':    '',
+}
+
+
+def bench_rmp(players, rounds, systems_dir):
+    """Self-check .rmp : template compilé == ancienne copie ligne à ligne, puis coût de chaque rendu."""
+    import glob
+    import tempfile
+    _use_plugin_files(systems_dir, None)
+    paths = sorted(glob.glob(os.path.join(LPEvents.SYSTEMS_DIR, '**', '*.rmp'), recursive=True))
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, text in RMP_EDGE_CASES.items():
+            with open(os.path.join(tmp, name), 'w', encoding='utf-8', newline='') as fh:
+                fh.write(text)
+            paths.append(os.path.join(tmp, name))
+
+        checked = 0
+        for path in paths:
+            template = LPEvents.load_rmp_template(path)
+            for n in range(players + 1):
+                old = _rmp_line_copy(path, n)
+                new = LPEvents.render_rmp_template(template, n)
+                if old != new:
+                    print(f"[rmp] MISMATCH {path} players={n}: {len(old)} vs {len(new)} chars")
+                    sys.exit(1)
+                checked += 1
+        print(f"[rmp] {len(paths)} template(s) × 0..{players} players : {checked} renders byte-identical "
+              f"({', '.join(os.path.basename(p) for p in paths)})")
+
+        for path in paths[:-len(RMP_EDGE_CASES)] or paths:
+            t0 = time.perf_counter()
+            for _ in range(rounds):
+                _rmp_line_copy(path, players)
+            copy_us = (time.perf_counter() - t0) / rounds * 1e6
+            t0 = time.perf_counter()
+            for _ in range(rounds):
+                LPEvents.render_rmp_template(LPEvents.load_rmp_template(path), players)
+            cached_us = (time.perf_counter() - t0) / rounds * 1e6
+            print(f"[rmp] {os.path.basename(path):24} line copy {copy_us:8.1f} µs  "
+                  f"cached template {cached_us:8.1f} µs")
+
+
+def bench_pico(commands, text, pace, i2c_khz, fade_ms, systems_dir, config_ini):
+    """Layouts envoyés au Pico virtuel (rp2040/virtualpico.py) par le vrai chemin série."""
+    from rp2040.virtualpico import VirtualPico
+    import serial
+
+    _use_plugin_files(systems_dir, config_ini)
+    layouts = _layout_commands(make_handler(direct=True))
+    if not layouts:
+        print(f"[pico] no layouts found in {LPEvents.SYSTEMS_DIR}")
+        return
+    pico = VirtualPico(i2c_khz=i2c_khz, pace=pace).start()
+    ser  = serial.Serial(pico.port, LPEvents.BAUDRATE, timeout=1, write_timeout=0)
+    reader = LPEvents.SerialReader(ser).start()
+    if text:
+        LPEvents.SERIAL_PROTO = 0
+    else:
+        LPEvents.negotiate_protocol(ser, reader)
+    writer = LPEvents.SerialWriter(ser)
+    reader.tracker = writer.tracker
+    proto  = LPEvents.SERIAL_PROTO
+
+    def applied():
+        # proto ≥ 2 : accusés « OK #N » ; sinon « OK: SetPanelColors … » (seules réponses OK ici)
+        if proto >= 2:
+            return sum(c['acked'] for c in writer.tracker.counts.values())
+        return reader.stats['ok']
+
+    base = applied()
+    i2c0 = dict(pico.stats)
+    t0   = time.perf_counter()
+    for i in range(commands):
+        while writer.pending >= LPEvents.SERIAL_QUEUE_MAX // 2:
+            time.sleep(0.0005)
+        writer.submit(layouts[i % len(layouts)], LPEvents.PRIO_LAYOUT, label="layout")
+    deadline = time.perf_counter() + 10 + commands * 0.05
+    while applied() - base < commands and time.perf_counter() < deadline:
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - t0
+    done    = applied() - base
+    txns    = pico.stats['i2c_transactions'] - i2c0['i2c_transactions']
+    bus_ms  = (pico.stats['i2c_time_s'] - i2c0['i2c_time_s']) * 1000
+
+    print(f"[pico] {done}/{commands} layouts applied in {elapsed * 1000:.0f} ms "
+          f"({done / elapsed:.1f} layouts/s, {'binary v' + str(proto) if proto else 'text'}"
+          f"{', I2C paced' if pace else ''})")
+    print(f"[pico] I2C per layout: {txns / max(done, 1):.0f} transactions, "
+          f"{bus_ms / max(done, 1):.2f} ms bus time")
+    if proto >= 2:
+        print(f"[pico] acks: {writer.tracker.summary()}")
+
+    if fade_ms:
+        t = time.perf_counter()
+        writer.submit(f"FadePanel=1,RED,BLUE,{fade_ms}\n", LPEvents.PRIO_LAYOUT, label="fade")
+        time.sleep(fade_ms / 1000 + 0.5)
+        writes = pico.writes_since(t)
+        if writes:
+            span = (writes[-1][0] - writes[0][0]) * 1000
+            print(f"[pico] FadePanel {fade_ms} ms: {len(writes)} register writes over {span:.0f} ms "
+                  f"(start after {(writes[0][0] - t) * 1000:.1f} ms)")
+    writer.close()
+    reader.stop()
+    ser.close()
+    pico.stop()
+    print(f"[pico] {pico.summary()}")
+
+
+ES_INPUT_NAMES = [('a', 'button'), ('b', 'button'), ('x', 'button'), ('y', 'button'),
+                  ('leftshoulder', 'button'), ('rightshoulder', 'button'),
+                  ('lefttrigger', 'axis'), ('righttrigger', 'axis'),
+                  ('select', 'button'), ('start', 'button'), ('hotkey', 'button'),
+                  ('up', 'hat'), ('down', 'hat'), ('left', 'hat'), ('right', 'hat'),
+                  ('joystick1up', 'axis'), ('joystick1left', 'axis'),
+                  ('joystick2up', 'axis'), ('joystick2left', 'axis'),
+                  ('leftthumb', 'button'), ('rightthumb', 'button')]
+
+
+def _write_es_input(path, devices):
+    """es_input.cfg façon ES : `devices` manettes + le clavier."""
+    with open(path, 'w', encoding='utf-8') as fh:
+        fh.write('<?xml version="1.0"?>\n<inputList>\n')
+        fh.write('  <inputConfig type="keyboard" deviceName="Keyboard" deviceGUID="-1">\n'
+                 '    <input name="a" type="key" id="13" value="1" />\n  </inputConfig>\n')
+        for d in range(devices):
+            fh.write(f'  <inputConfig type="joystick" deviceName="Pad {d}" '
+                     f'deviceGUID="03000000{d:024x}">\n')
+            for i, (name, kind) in enumerate(ES_INPUT_NAMES):
+                fh.write(f'    <input name="{name}" type="{kind}" id="{i % 16}" value="1" />\n')
+            fh.write('  </inputConfig>\n')
+        fh.write('</inputList>\n')
+
+
+def bench_esinput(devices, events):
+    """Coût par sélection de jeu MAME de load_es_input : analyse à chaque fois vs provider en cache."""
+    import tempfile
+    import LPInputsPush
+    LPInputsPush.logger.setLevel('INFO')
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'es_input.cfg')
+        _write_es_input(path, devices)
+        size = os.path.getsize(path)
+
+        t0 = time.perf_counter()
+        for _ in range(events):
+            LPInputsPush._parse_es_input(path)
+        parse_us = (time.perf_counter() - t0) / events * 1e6
+
+        provider = LPInputsPush.es_input_provider(path)
+        first = provider.get()
+        t0 = time.perf_counter()
+        for _ in range(events):
+            maps = LPInputsPush.load_es_input(path)
+        cached_us = (time.perf_counter() - t0) / events * 1e6
+        assert maps is first and maps == LPInputsPush._parse_es_input(path)
+
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+        t0 = time.perf_counter()
+        provider.get()
+        reparse_us = (time.perf_counter() - t0) * 1e6
+
+    print(f"[esinput] {devices} joysticks, {size / 1024:.1f} KiB, {events} MAME selections")
+    print(f"[esinput] parse every event : {parse_us:8.1f} µs/event")
+    print(f"[esinput] cached provider   : {cached_us:8.1f} µs/event (stat only) "
+          f"→ {parse_us / max(cached_us, 1e-9):.0f}x, {parse_us - cached_us:.1f} µs saved per event")
+    print(f"[esinput] after file change : {reparse_us:8.1f} µs (one re-parse) | {provider.stats}")
+
+
+MAME_PORT_STYLES = ('BUTTON_n', 'actions', 'BUTTONn', 'mixed')
+
+
+def _write_mame_inputs(path, game, rnd, players, actions):
+    """<game>_inputs.cfg synthétique : directions, ports boutons d’un style tiré au sort, START/COIN."""
+    lines = []
+    for p in range(1, players + 1):
+        types = [f'P{p}_{d}' for d in ('UP', 'DOWN', 'LEFT', 'RIGHT')]
+        n = rnd.choice((2, 3, 4, 6, 8))
+        style = rnd.choice(MAME_PORT_STYLES)
+        if style == 'BUTTON_n':
+            types += [f'P{p}_BUTTON_{i}' for i in range(1, n + 1)]
+        elif style == 'BUTTONn':
+            types += [f'P{p}_BUTTON{i}' for i in range(1, n + 1)]
+        else:
+            types += [f'P{p}_{a}' for a in rnd.sample(actions, min(n, 6))]
+            if style == 'mixed':
+                types += [f'P{p}_BUTTON_{i}' for i in (1, 2)]
+        types += [rnd.choice((f'{p}_PLAYER_START', f'START_{p}')), f'COIN_{p}']
+        lines += [f'<port tag=":IN{len(lines) // 8}" type="{t}" mask="{rnd.choice((1, 2, 4, 8, 16, 32, 64, 128))}" '
+                  f'defvalue="{rnd.choice((0, 1))}" />' for t in types]
+    with open(path, 'w', encoding='utf-8') as fh:
+        fh.write(f'<mameconfig version="10"><system name="{game}"><input>\n' + '\n'.join(lines)
+                 + '\n</input></system></mameconfig>\n')
+
+
+def bench_mamecfg(players, rounds, systems_dir, config_ini):
+    """Coût de build_input par jeu MAME : plan (famille + layout + ports) recompilé vs en cache."""
+    import random
+    import hashlib
+    import tempfile
+    import configparser
+    from collections import Counter
+    import LPInputsPush
+    LPInputsPush.logger.setLevel('CRITICAL')
+    _use_plugin_files(systems_dir, config_ini)
+    layouts_dir = os.path.join(LPEvents.SYSTEMS_DIR, 'mame')
+    games = sorted(f[:-4] for f in os.listdir(layouts_dir) if f.endswith('.xml'))
+    # tout le romset tient dans les caches : on mesure le moteur, pas la relecture des XML
+    LPInputsPush.PARSE_CACHE_SIZE = LPInputsPush.PLAN_CACHE_SIZE = 4 * len(games)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cfg = configparser.ConfigParser()
+        cfg.read(LPEvents.PANEL_CONFIG_INI)
+        cfg.set('Panel', 'players_count', str(players))
+        with open(os.path.join(tmp, 'config.ini'), 'w', encoding='utf-8') as fh:
+            cfg.write(fh)
+        _write_es_input(os.path.join(tmp, 'es_input.cfg'), players)
+        LPInputsPush.MAME_CFG_DIR, LPInputsPush.ARCADE_XML_DIR = tmp, layouts_dir
+        LPInputsPush.PANEL_CONFIG_INI = os.path.join(tmp, 'config.ini')
+        rnd = random.Random(1202)
+        actions = sorted(LPInputsPush.ACTION_TO_BUTTON)
+        for game in games:
+            _write_mame_inputs(os.path.join(tmp, f"{game}_inputs.cfg"), game, rnd, players, actions)
+
+        es_maps = LPInputsPush.load_es_input(os.path.join(tmp, 'es_input.cfg'))
+        rules = LPInputsPush.load_mapping_rules()
+        count = min(rules.players_count, len(es_maps))
+        t0 = time.perf_counter()
+        ports = {g: LPInputsPush.load_port_index(os.path.join(tmp, f"{g}_inputs.cfg")) for g in games}
+        for game in games:
+            try:
+                LPInputsPush.load_layout(game, 0)
+            except (FileNotFoundError, ValueError):
+                pass
+        parse_ms = (time.perf_counter() - t0) * 1000
+
+        compiled, cached = [], []
+        families, slots = Counter(), 0
+        digest = hashlib.sha1()
+        for r in range(rounds):
+            t0 = time.perf_counter()
+            for game in games:
+                plan = LPInputsPush.compile_plan(game, rules, ports[game], count)
+                inp = LPInputsPush.emit_input(plan, es_maps)
+                if r == 0:
+                    families[plan.family] += 1
+                    slots += len(plan.slots)
+                    digest.update(LPInputsPush.ET.tostring(inp))
+            compiled.append((time.perf_counter() - t0) / len(games) * 1e6)
+            t0 = time.perf_counter()
+            for game in games:
+                LPInputsPush.build_input(game, es_maps, ports[game])
+            cached.append((time.perf_counter() - t0) / len(games) * 1e6)
+        check = hashlib.sha1()
+        for game in games:
+            check.update(LPInputsPush.ET.tostring(LPInputsPush.build_input(game, es_maps, ports[game])))
+        assert check.hexdigest() == digest.hexdigest()
+
+    best_c, best_k = min(compiled), min(cached)
+    print(f"[mamecfg] {len(games)} games, {players} player(s), {slots} ports, families {dict(families)}")
+    print(f"[mamecfg] parse inputs + layouts (once) : {parse_ms:8.0f} ms")
+    print(f"[mamecfg] compile plan + emit           : {best_c:8.1f} µs/game")
+    print(f"[mamecfg] cached plan, emit only        : {best_k:8.1f} µs/game → {best_c / max(best_k, 1e-9):.1f}x")
+    print(f"[mamecfg] <input> digest {digest.hexdigest()}")
+
+
+STUB_EMULATOR = r'''
+import os, sys, time
+game, startup = sys.argv[1], float(os.environ.get('LP_STUB_STARTUP', '0'))
+if 'lua' not in ' '.join(sys.argv) or '-autoboot_script' not in sys.argv:
+    sys.exit(2)
+time.sleep(startup)
+if game.startswith('hang'):
+    time.sleep(3600)
+if game.startswith('broken'):
+    sys.stderr.write(f"Required files are missing, the machine cannot be run.\n")
+    sys.exit(1)
+lines = []
+for p in (1, 2):
+    port = f":IN{p - 1}"
+    lines.append(f"PORT:{port}")
+    names = [f"P{p} {d}" for d in ('Up', 'Down', 'Left', 'Right')] + [f"P{p} Button {i}" for i in range(1, 7)]
+    names += [f"{p} Player Start", f"Coin {p}"]
+    for i, name in enumerate(names):
+        extra = '' if game.startswith('old') else f"|{1 << (i % 16)}"
+        lines.append(f"FIELD:{name}|{i + 1}|{port}|{1 << (i % 16)}{extra}")
+with open('dump_inputs.txt', 'w', encoding='utf-8') as f:
+    f.write('\n'.join(lines) + '\n')
+'''
+
+
+def bench_extract(roms, jobs, startup, timeout):
+    """Ordonnanceur d’extraction : temps total 1 job vs N jobs, délais, sauts à la relance."""
+    import tempfile
+    import LPInputsPush
+    import LPExtractInputs
+    LPInputsPush.logger.setLevel('CRITICAL')
+    LPExtractInputs.logger.setLevel('CRITICAL')
+    os.environ['LP_STUB_STARTUP'] = str(startup)
+    with tempfile.TemporaryDirectory() as tmp:
+        roms_dir, cfg_dir = os.path.join(tmp, 'roms'), os.path.join(tmp, 'cfg')
+        os.makedirs(roms_dir)
+        stub = os.path.join(tmp, 'stub_mame.py')
+        with open(stub, 'w', encoding='utf-8') as fh:
+            fh.write(STUB_EMULATOR)
+        names = [f"game{i:03d}" for i in range(roms - 4)] + ['hang1', 'broken1', 'broken2', 'old1']
+        for name in names:
+            with open(os.path.join(roms_dir, f"{name}.zip"), 'wb') as fh:
+                fh.write(b'PK')
+        LPInputsPush.MAME_CFG_DIR = cfg_dir
+        LPInputsPush.PANEL_CONFIG_INI = os.path.join(tmp, 'config.ini')
+        emulator = [sys.executable, stub]
+
+        def run(n, **kw):
+            stats = LPExtractInputs.extract_all(n, timeout, emulator=emulator, roms_dir=roms_dir, **kw)
+            print(f"[extract] jobs={n:<2} {kw or ''} {stats['ms']:7d} ms : {stats['extracted']} extracted, "
+                  f"{stats['up-to-date']} up to date, {stats['failed-before']} failed before, "
+                  f"{stats['failed']} failed, {stats['timeout']} timeout, {stats['empty']} empty")
+            return stats
+
+        run(1)
+        run(jobs, force=True)
+        run(jobs)
+        rom = os.path.join(roms_dir, 'game000.zip')
+        os.utime(rom)       # ROM remplacée : plus récente que son _inputs.cfg
+        run(jobs)
+        run(jobs, retry_failed=True)
+
+        ports = LPInputsPush.load_port_index(os.path.join(cfg_dir, 'game000_inputs.cfg'))
+        old = LPInputsPush.load_port_index(os.path.join(cfg_dir, 'old1_inputs.cfg'))
+        assert {'P1_UP', 'P1_BUTTON_1', '1_PLAYER_START', 'COIN_2'} <= set(ports.by_type)
+        assert len(ports.buttons(1)) == 6 and old.by_type['P1_BUTTON_1'].get('defvalue') == '16'
+        print(f"[extract] game000_inputs.cfg : {len(ports.ports)} ports, P1 buttons "
+              f"{[p.get('type') for p in ports.buttons(1)]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LedPanelManager benchmarks")
+    sub = parser.add_subparsers(dest='bench', required=True)
+    p_idle = sub.add_parser('idle')
+    p_idle.add_argument('--seconds', type=float, default=10.0)
+    p_idle.add_argument('--legacy', action='store_true')
+    p_idle.add_argument('--backend', default='pygame',
+                        choices=['auto', 'pygame', 'evdev', 'synthetic'])
+    p_lat = sub.add_parser('latency')
+    p_lat.add_argument('--presses', type=int, default=200)
+    p_lat.add_argument('--legacy', action='store_true')
+    p_lat.add_argument('--direct', action='store_true', help="écriture série directe, sans SerialWriter")
+    p_lat.add_argument('--backend', default='pygame',
+                       choices=['auto', 'pygame', 'evdev', 'synthetic'])
+    p_lip = sub.add_parser('lip')
+    p_lip.add_argument('--system', default='atari2600')
+    p_lip.add_argument('--game', default=None, help="jeu (défaut : .lip du système)")
+    p_lip.add_argument('--layout', default=None, help="layout système imposé (nom)")
+    p_lip.add_argument('--rate', type=float, default=30.0, help="appuis par seconde et par bouton")
+    p_lip.add_argument('--seconds', type=float, default=5.0)
+    p_lip.add_argument('--noise', action='store_true', help="intercale des events hat/axis")
+    p_lip.add_argument('--direct', action='store_true', help="écriture série directe, sans SerialWriter")
+    p_lip.add_argument('--systems-dir', default=None)
+    p_lip.add_argument('--config', default=None)
+    p_lip.add_argument('--binary', action='store_true', help="macros en trames binaires (proto=1)")
+    p_proto = sub.add_parser('proto')
+    p_proto.add_argument('--systems-dir', default=None)
+    p_proto.add_argument('--config', default=None)
+    p_pico = sub.add_parser('pico')
+    p_pico.add_argument('--commands', type=int, default=200)
+    p_pico.add_argument('--text', action='store_true', help="protocole texte (pas de PING=2)")
+    p_pico.add_argument('--pace', action='store_true', help="le Pico virtuel attend le temps I2C modélisé")
+    p_pico.add_argument('--i2c-khz', type=float, default=None)
+    p_pico.add_argument('--fade', type=int, default=500, help="durée du FadePanel mesuré (0 : aucun)")
+    p_pico.add_argument('--systems-dir', default=None)
+    p_pico.add_argument('--config', default=None)
+    p_esi = sub.add_parser('esinput')
+    p_esi.add_argument('--devices', type=int, default=8, help="manettes dans l’es_input.cfg généré")
+    p_esi.add_argument('--events', type=int, default=500)
+    p_mame = sub.add_parser('mamecfg')
+    p_mame.add_argument('--players', type=int, default=2)
+    p_mame.add_argument('--rounds', type=int, default=3)
+    p_mame.add_argument('--systems-dir', default=None)
+    p_mame.add_argument('--config', default=None)
+    p_ext = sub.add_parser('extract')
+    p_ext.add_argument('--roms', type=int, default=48)
+    p_ext.add_argument('--jobs', type=int, default=8)
+    p_ext.add_argument('--startup', type=float, default=0.25)
+    p_ext.add_argument('--timeout', type=float, default=2.0)
+    p_rmp = sub.add_parser('rmp')
+    p_rmp.add_argument('--players', type=int, default=4)
+    p_rmp.add_argument('--rounds', type=int, default=200)
+    p_rmp.add_argument('--systems-dir', default=None)
+    args = parser.parse_args()
+    if args.bench == 'rmp':
+        bench_rmp(args.players, args.rounds, args.systems_dir)
+        return
+    if args.bench == 'extract':
+        bench_extract(args.roms, args.jobs, args.startup, args.timeout)
+        return
+    if args.bench == 'mamecfg':
+        bench_mamecfg(args.players, args.rounds, args.systems_dir, args.config)
+        return
+    if args.bench == 'esinput':
+        bench_esinput(args.devices, args.events)
+        return
+    if args.bench == 'pico':
+        bench_pico(args.commands, args.text, args.pace, args.i2c_khz, args.fade,
+                   args.systems_dir, args.config)
+        return
+    if args.bench == 'lip':
+        bench_lip(args.system, args.game, args.rate, args.seconds, args.noise,
+                  args.systems_dir, args.config, args.layout, args.direct, args.binary)
+        return
+    if args.bench == 'proto':
+        bench_proto(args.systems_dir, args.config)
+        return
+    if args.legacy and args.backend != 'pygame':
+        parser.error("--legacy only applies to the pygame backend")
+
+    if args.bench == 'idle':
+        bench_idle(args.seconds, args.legacy, args.backend)
+    else:
+        bench_latency(args.presses, args.legacy, args.backend, args.direct)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+# LPEventBus.py — ESEvent.arg : un seul watcher, un seul décodage, diffusion aux abonnés
+# -----------------------------------------------------------------------------
+# Les .bat EmulationStation (emulationstation/<event>/ESEventPushLedPanel.bat)
+# écrivent event=…&param1="…"&param2="…" dans ESEvent.arg. Le bus surveille ce
+# fichier avec un seul Observer watchdog, le lit et le décode une fois par
+# écriture, puis remet le même EsEvent à chaque abonné (LEDs / .rmp / .lip de
+# LPEvents, cfg MAME de LPInputsPush).
+# Un thread et une file par abonné : un abonné lent (écriture d’un cfg MAME) ne
+# retarde pas les autres (layout, accusé game-start), et chaque abonné reçoit
+# les événements dans l’ordre. Temps par abonné dans EventBus.summary().
+# -----------------------------------------------------------------------------
+
+import os
+import time
+import queue
+import logging
+import threading
+from types import MappingProxyType
+from typing import Callable, Dict, Iterable, List, Mapping, NamedTuple, Optional
+from urllib.parse import unquote
+
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
+
+logger = logging.getLogger(__name__)
+
+OBSERVER_TIMEOUT = 0.1      # s, comme l’Observer de LPEvents (1 s par défaut)
+BUS_SLOW_MS      = 100      # au-delà, le temps d’un abonné est signalé en warning
+
+
+def escape_arg_value(s: str) -> str:
+    """
+    Remplace dans la chaîne s toutes les séquences d’échappement
+    par leur caractère d’origine pour le batch .arg,
+    en incluant désormais la séquence '|' → '!'.
+    """
+    # d’abord les séquences à deux caractères :
+    repl2 = {
+        '""': '"',   # guillemet    → double-guillemet
+        '|A': '&',   # esperluette  → |A
+        '|v': ',',   # virgule      → |v
+        '|p': '+',   # plus         → |p
+        '|%': '!',   # point d’excl.→ |%
+        '||': '|',   # pipe         → ||
+        '%%': '%',   # pourcent     → %%
+    }
+    # puis la séquence à un caractère :
+    repl1 = {
+        '|': '!'
+    }
+
+    result = []
+    i = 0
+    while i < len(s):
+        # 1) on essaie la séquence de longueur 2
+        if i + 1 < len(s) and s[i:i+2] in repl2:
+            result.append(repl2[s[i:i+2]])
+            i += 2
+        # 2) sinon on regarde si le caractère seul est à remplacer
+        elif s[i] in repl1:
+            result.append(repl1[s[i]])
+            i += 1
+        # 3) sinon on le reprend tel quel
+        else:
+            result.append(s[i])
+            i += 1
+
+    return ''.join(result)
+
+
+class EsEvent(NamedTuple):
+    kind: str                   # 'system-selected' | 'game-selected' | 'game-start' | 'game-end' | 'exit'
+    system: str                 # param1 désechappé, en minuscules
+    param2: str                 # param2 désechappé (chemin de la rom ou du dossier)
+    game: str                   # nom du jeu résolu depuis param2 ('' si absent)
+    params: Mapping[str, str]   # tous les paramètres, bruts
+    mtime: float                # mtime de ESEvent.arg (s)
+    seq: int                    # numéro d’événement attribué par le bus
+
+
+def resolve_game(param2: str) -> str:
+    """Nom du jeu : fichier → nom sans extension, dossier → nom du dossier."""
+    if not param2:
+        return ''
+    formatted = os.path.normpath(unquote(param2))
+    if os.path.isfile(formatted):
+        return os.path.splitext(os.path.basename(formatted))[0]
+    if os.path.isdir(formatted):
+        return os.path.basename(formatted)
+    return os.path.splitext(os.path.basename(param2))[0]
+
+
+def decode_text(data: bytes) -> str:
+    """Le .bat écrit dans la page de code de la console : UTF-8 si chcp 65001, sinon ANSI (cp1252)."""
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode('cp1252', errors='replace')
+
+
+def parse_es_text(text: str, mtime: float = 0.0, seq: int = 0) -> Optional[EsEvent]:
+    data = text.replace('\r', '').replace('\n', '').strip()
+    params = dict(p.split('=', 1) for p in data.split('&') if '=' in p)
+    kind = params.get('event', '').strip('"').strip().lower()
+    if not kind:
+        return None
+    system = escape_arg_value(params.get('param1', '').strip('"').strip()).lower()
+    param2 = escape_arg_value(params.get('param2', '').strip('"').strip())
+    return EsEvent(kind, system, param2, resolve_game(param2), MappingProxyType(params), mtime, seq)
+
+
+def decode_es_event(path: str, seq: int = 0) -> Optional[EsEvent]:
+    """Lit et décode ESEvent.arg ; None s’il est vide (le .bat est en train de l’écrire)."""
+    with open(path, 'rb') as f:
+        data = f.read()
+        mtime = os.fstat(f.fileno()).st_mtime
+    return parse_es_text(decode_text(data), mtime, seq)
+
+
+class _Subscriber:
+    def __init__(self, name: str, callback: Callable[[EsEvent], None], kinds: Optional[Iterable[str]]):
+        self.name     = name
+        self.callback = callback
+        self.kinds    = frozenset(kinds) if kinds else None
+        self.queue: "queue.Queue" = queue.Queue()       # (EsEvent, instant de dépôt) | None = arrêt
+        self.stats    = {'events': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'last_ms': 0.0,
+                         'max_lag_ms': 0.0}
+        self.thread   = threading.Thread(target=self._run, name=f"Bus-{name}", daemon=True)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            event, queued = item
+            t0 = time.perf_counter()
+            try:
+                self.callback(event)
+            except Exception:
+                self.stats['errors'] += 1
+                logger.exception(f"[BUS] {self.name}: erreur sur {event.kind}")
+            dt = (time.perf_counter() - t0) * 1000
+            st = self.stats
+            st['events']    += 1
+            st['total_ms']  += dt
+            st['last_ms']    = dt
+            st['max_ms']     = max(st['max_ms'], dt)
+            st['max_lag_ms'] = max(st['max_lag_ms'], (t0 - queued) * 1000)
+            if dt > BUS_SLOW_MS:
+                logger.warning(f"[PROFILE] {self.name}: {event.kind} #{event.seq} took {dt:.1f} ms")
+            else:
+                logger.debug(f"[PROFILE] {self.name}: {event.kind} #{event.seq} took {dt:.1f} ms")
+
+
+class EventBus(FileSystemEventHandler):
+    """
+    Surveille ESEvent.arg et diffuse chaque événement décodé aux abonnés.
+    Les notifications en double de watchdog pour une même écriture (même
+    mtime, même contenu) ne sont décodées et diffusées qu’une fois.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path        = os.path.abspath(path)
+        self.subscribers: List[_Subscriber] = []
+        self.observer    = None
+        self.lock        = threading.Lock()
+        self.last_sig    = None
+        self.seq         = 0
+        self.stats       = {'notifications': 0, 'events': 0, 'duplicates': 0, 'empty': 0,
+                            'errors': 0, 'decode_ms': 0.0}
+
+    def subscribe(self, name: str, callback: Callable[[EsEvent], None],
+                  kinds: Optional[Iterable[str]] = None) -> None:
+        """callback(EsEvent) sur le thread de l’abonné ; kinds : types d’événements voulus (défaut : tous)."""
+        sub = _Subscriber(name, callback, kinds)
+        self.subscribers.append(sub)
+        if self.observer is not None:
+            sub.thread.start()
+
+    def publish(self, event: EsEvent) -> None:
+        queued = time.perf_counter()
+        for sub in self.subscribers:
+            if sub.kinds is None or event.kind in sub.kinds:
+                sub.queue.put((event, queued))
+
+    # — watchdog —
+    def on_modified(self, event):
+        self._notify(event.src_path, event.is_directory)
+
+    def on_created(self, event):
+        self._notify(event.src_path, event.is_directory)
+
+    def on_moved(self, event):
+        self._notify(event.dest_path, event.is_directory)
+
+    def _notify(self, src_path, is_directory):
+        if is_directory or os.path.abspath(src_path) != self.path:
+            return
+        with self.lock:
+            self.stats['notifications'] += 1
+            t0 = time.perf_counter()
+            try:
+                with open(self.path, 'rb') as f:
+                    data = f.read()
+                    st = os.fstat(f.fileno())
+            except OSError as e:
+                self.stats['errors'] += 1
+                logger.warning(f"[BUS] lecture {self.path} impossible: {e}")
+                return
+            sig = (st.st_mtime_ns, data)
+            if sig == self.last_sig:
+                self.stats['duplicates'] += 1
+                return
+            self.last_sig = sig
+            event = parse_es_text(decode_text(data), st.st_mtime, self.seq + 1)
+            self.stats['decode_ms'] += (time.perf_counter() - t0) * 1000
+            if event is None:
+                self.stats['empty'] += 1
+                return
+            self.seq += 1
+            self.stats['events'] += 1
+        logger.warning(f"[BUS] #{event.seq} {event.kind} {event.system} {event.game!r} "
+                       f"(file-modified → bus {(time.time() - event.mtime) * 1000:.1f} ms)")
+        self.publish(event)
+
+    # — cycle de vie —
+    def start(self) -> "EventBus":
+        for sub in self.subscribers:
+            sub.thread.start()
+        self.observer = Observer(timeout=OBSERVER_TIMEOUT)
+        self.observer.schedule(self, os.path.dirname(self.path), recursive=False)
+        self.observer.start()
+        logger.info(f"Event bus on {self.path}: {[s.name for s in self.subscribers]} "
+                    f"({type(self.observer).__name__})")
+        return self
+
+    def stop(self, timeout: float = 2.0) -> None:
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join(timeout)
+        for sub in self.subscribers:
+            sub.queue.put(None)
+        for sub in self.subscribers:
+            if sub.thread.is_alive():
+                sub.thread.join(timeout)
+
+    def summary(self) -> Dict[str, Dict]:
+        out = {'bus': dict(self.stats)}
+        for sub in self.subscribers:
+            st = dict(sub.stats)
+            st['avg_ms'] = st['total_ms'] / st['events'] if st['events'] else 0.0
+            st['backlog'] = sub.queue.qsize()
+            out[sub.name] = st
+        return out
@@ -1,16 +1,18 @@
 import os
 import sys
+import stat
 import time
+import heapq
+import itertools
+import queue
 import threading
 import logging
 import configparser
+from collections import deque, OrderedDict
 import serial
 import serial.tools.list_ports
 import xml.etree.ElementTree as ET
 
-from watchdog.observers import Observer
-from watchdog.events import PatternMatchingEventHandler
-import pygame
 
 import threading
 import tkinter as tk
@@ -18,6 +20,9 @@ import tkinter.font as tkfont
 import ctypes
 from PIL import Image, ImageDraw, ImageFont
 from typing import Dict, Tuple, Optional, List
+from LPEventBus import EventBus, EsEvent
+from LPPreview import layout_shapes, get_preview, render_all
+from LPProtocol import PROTO_VERSION, encode_command, parse_pong, parse_ack, stamp, command_kind, iter_commands
 
 # Logging
 logging.basicConfig(level=logging.WARNING, format='[%(asctime)s] %(levelname)s: %(message)s')
@@ -35,6 +40,12 @@ DEFAULT_COLOR    = 'WHITE'
 TEXT_COLOR       = '#FFFFFF'
 BG_COLOR         = '#2961b0'
 CONFIG_CACHE     = None
+SERIAL_PROTO     = 0        # version de protocole négociée avec le Pico (0 = texte)
+# Accusé écrit après le commit du remap sur game-start : le .bat game-start
+# l’attend au plus REMAP_COMMIT_TIMEOUT_MS avant de laisser ES lancer le jeu.
+ES_EVENT_ACK            = os.path.join(BASE_DIR, 'ESEvent.ack')
+REMAP_COMMIT_TIMEOUT_MS = 1000
+LISTENER_WAIT_MS        = 500   # timeout d’attente du backend d’entrées dans joystick_listener
 
 retrobat_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 
@@ -47,17 +58,20 @@ ES_FONT_PATH = os.path.join(
 )
 FR_PRIVATE = 0x10
 
-# 4) Vérifie qu’il existe
-if not os.path.exists(ES_FONT_PATH):
-    raise FileNotFoundError(f"Police non trouvée : {ES_FONT_PATH}")
-# charge la police en privé
-ctypes.windll.gdi32.AddFontResourceExW(ES_FONT_PATH, FR_PRIVATE, 0)
+# 4) Vérifie qu’il existe (Windows / RetroBat uniquement : sous Linux on garde la police Tk par défaut)
+if sys.platform == 'win32':
+    if not os.path.exists(ES_FONT_PATH):
+        raise FileNotFoundError(f"Police non trouvée : {ES_FONT_PATH}")
+    # charge la police en privé
+    ctypes.windll.gdi32.AddFontResourceExW(ES_FONT_PATH, FR_PRIVATE, 0)
 
 script_dir = os.path.dirname(os.path.realpath(__file__))
 # Ton plugin est dans …/plugins/LedPanelManager/
 ICON_PATH = os.path.join(script_dir, 'images', 'arcadepanel.png')
 if not os.path.exists(ICON_PATH):
-    raise FileNotFoundError(f"Icône introuvable : {ICON_PATH}")
+    if sys.platform == 'win32':
+        raise FileNotFoundError(f"Icône introuvable : {ICON_PATH}")
+    logger.warning(f"Icône introuvable : {ICON_PATH}")
 
 # —————————————————————————————————————————————————————————
 # Parsers XML globaux pour es_settings.cfg et es_systems.cfg
@@ -66,6 +80,7 @@ retrobat_root = os.path.dirname(os.path.dirname(BASE_DIR))
 es_home      = os.path.join(retrobat_root, "emulationstation", ".emulationstation")
 
 _SETTINGS_CFG = os.path.join(es_home, "es_settings.cfg")
+ES_INPUT_CFG  = os.path.join(es_home, "es_input.cfg")
 _SYSTEMS_CFG  = os.path.join(es_home, "es_systems.cfg")
 
 # Cache des arbres XML
@@ -135,7 +150,7 @@ if os.path.isdir(roms_root):
 else:
     logger.warning(f"Roms directory not found: {roms_root}")
 _GAME_INDEX = {}  # clé = (system.lower(), game_name) → (emu, core)
-for sys, root in _GAMELIST_CACHE.items():
+for sys_name, root in _GAMELIST_CACHE.items():
     for game in root.findall('game'):
         name = game.findtext('name','').strip()
         path = game.findtext('path','').strip()
@@ -143,7 +158,7 @@ for sys, root in _GAMELIST_CACHE.items():
         emu = game.findtext('emulator','').strip()
         cor = game.findtext('core','').strip()
         for key in (name, base):
-            _GAME_INDEX[(sys, key)] = (emu, cor)
+            _GAME_INDEX[(sys_name, key)] = (emu, cor)
 
 # —————————————————————————————————————————————————————————
 # 1. Préchargement de tous les XML *système*
@@ -183,104 +198,204 @@ for system, root in _SYSTEM_CFG_CACHE.items():
         except Exception as e:
             logger.warning(f"Cannot parse game XML '{system}/{fname}': {e}")
 
-def show_popup_tk(text, duration=600, font_size=24, alpha=0.9):
+# —————————————————————————————————————————————————————————
+# 3. Cache des templates .rmp compilés (clé = chemin, invalidé par mtime)
+# —————————————————————————————————————————————————————————
+_RMP_TEMPLATE_CACHE: Dict[str, Tuple[float, List[Tuple[bool, object]]]] = {}
+
+def load_rmp_template(path: str) -> Optional[List[Tuple[bool, object]]]:
     """
-    Affiche un petit OSD Tkinter centré, toujours topmost, frameless,
-    ferme après `duration` ms, puis remet le focus sur ES.
+    Renvoie le template .rmp compilé en segments (is_player, data) :
+      - is_player False → data = bloc de lignes statiques déjà concaténées
+      - is_player True  → data = la ligne découpée sur '<p>' (à joindre par n° de joueur)
+    Le fichier n’est relu que si son mtime change. None si le template n’existe pas.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    cached = _RMP_TEMPLATE_CACHE.get(path)
+    if cached is not None and cached[0] == st.st_mtime:
+        return cached[1]
+
+    segments = []
+    static = []
+    with open(path, 'r', encoding='utf-8') as src:
+        for line in src:
+            if '<p>' in line:
+                if static:
+                    segments.append((False, ''.join(static)))
+                    static = []
+                segments.append((True, line.split('<p>')))
+            else:
+                static.append(line)
+    if static:
+        segments.append((False, ''.join(static)))
+
+    _RMP_TEMPLATE_CACHE[path] = (st.st_mtime, segments)
+    logger.info(f"Compiled .rmp template '{os.path.basename(path)}' ({len(segments)} segments)")
+    return segments
+
+def render_rmp_template(segments, players: int) -> str:
+    """
+    Rend un template compilé pour `players` joueurs : chaque ligne '<p>' est
+    répétée pour 1..players, exactement comme la copie ligne à ligne d’origine.
     """
-    def _run():
-        # 1) Créer la fenêtre
-        root = tk.Tk()
+    nums = [str(p) for p in range(1, players + 1)]
+    out = []
+    for is_player, data in segments:
+        if is_player:
+            out.extend(n.join(data) for n in nums)
+        else:
+            out.append(data)
+    return ''.join(out)
+
+OSD_POLL_MS     = 25    # le thread Tk relève la file des messages à ce rythme
+OSD_IMAGE_CACHE = 32    # aperçus de layout gardés en PhotoImage (les plus récents)
+
+
+class PopupOsd:
+    """
+    Une seule fenêtre OSD Tkinter pour tout le process, possédée par un thread dédié :
+    créée cachée au premier message, icône chargée et réduite une seule fois.
+    Un nouveau message remplace le texte sur place (et relance le délai de fermeture)
+    au lieu d’empiler des interpréteurs Tk ; si plusieurs attendent, seul le dernier s’affiche.
+    Aperçu du layout (LPPreview) sous le texte : PNG pré-rendu, gardé en PhotoImage.
+    """
+
+    def __init__(self):
+        self.queue    = queue.Queue()
+        self.disabled = False
+        self.thread   = threading.Thread(target=self._run, name="OSD", daemon=True)
+        self.thread.start()
+
+    def show(self, text, duration, font_size, alpha, preview=None):
+        if not self.disabled:
+            self.queue.put((time.perf_counter(), text, duration, font_size, alpha, preview))
+
+    def _run(self):
+        try:
+            root = tk.Tk()
+        except tk.TclError as e:
+            self.disabled = True
+            logger.warning(f"OSD disabled: {e}")
+            with self.queue.mutex:
+                self.queue.queue.clear()
+            return
+        root.withdraw()
         root.overrideredirect(True)           # pas de bordure
         root.attributes("-topmost", True)     # topmost
-        root.attributes("-alpha", alpha)      # transparence
         root.configure(bg=BG_COLOR)
 
-        # 2) Le label
-        #202020 969696 334b7a 2961b0
-        icon = tk.PhotoImage(file=ICON_PATH, master=root)
-        icon = icon.subsample(2, 2)
-        #lbl = tk.Label(root, text=text, image=icon, font=("Cabin", font_size), bg="#2961b0", fg="white", padx=20, pady=20)
-        #lbl.image = icon  # garde une référence pour l’empêcher d’être garbage-collected
-        #lbl.pack()
-
         # Frame conteneur
         container = tk.Frame(root, bg=BG_COLOR)
         container.pack(padx=20, pady=10)
 
-        # Label icône
-        icon_lbl = tk.Label(container, image=icon, bg=BG_COLOR)
-        icon_lbl.image = icon
-        icon_lbl.pack(side="left")
-
-        # Label texte
-        text_lbl = tk.Label(
-            container, text="PANEL : "+text,
-            font=("Cabin", font_size), fg=TEXT_COLOR, bg=BG_COLOR
-        )
-        text_lbl.pack(side="left", padx=(10,0))
-
-        # 3) Centrer
-        root.update_idletasks()
-        w, h = root.winfo_width(), root.winfo_height()
-        ws, hs = root.winfo_screenwidth(), root.winfo_screenheight()
-        x, y = (ws-w)//2, (hs-h)//2
-        root.geometry(f"{w}x{h}+{x}+{y}")
-
-        # 4) Fermeture + refocus
-        def close_and_refocus():
-            root.destroy()
+        # Label icône (chargée une fois pour toutes)
+        if os.path.exists(ICON_PATH):
+            icon = tk.PhotoImage(file=ICON_PATH, master=root).subsample(2, 2)
+            icon_lbl = tk.Label(container, image=icon, bg=BG_COLOR)
+            icon_lbl.image = icon
+            icon_lbl.pack(side="left")
+
+        # Label texte, mis à jour sur place
+        text_lbl = tk.Label(container, text="", font=("Cabin", 24), fg=TEXT_COLOR, bg=BG_COLOR)
+        text_lbl.pack(side="left", padx=(10, 0))
+
+        # Aperçu du layout, sous le texte quand il y en a un
+        preview_lbl = tk.Label(root, bg=BG_COLOR)
+        images = OrderedDict()      # chemin PNG → PhotoImage
+        state = {'hide': None, 'font': 24, 'alpha': None, 'preview': None}
+
+        def preview_image(shapes):
+            path = get_preview(shapes) if shapes else None
+            if path is None:
+                return None
+            img = images.pop(path, None)
+            if img is None:
+                img = tk.PhotoImage(file=path, master=root)
+            images[path] = img
+            while len(images) > OSD_IMAGE_CACHE:
+                images.popitem(last=False)
+            return img
+
+        def hide():
+            state['hide'] = None
+            root.withdraw()
             # remet le focus sur ES
+            if sys.platform != 'win32':
+                return
             es = ctypes.windll.user32.FindWindowW(None, "EmulationStation")
             if es:
                 ctypes.windll.user32.SetForegroundWindow(es)
 
-        root.after(duration, close_and_refocus)
-        root.after(duration, close_and_refocus)
-        root.after(duration, close_and_refocus)
+        def display(t_post, text, duration, font_size, alpha, preview):
+            if font_size != state['font']:
+                text_lbl.configure(font=("Cabin", font_size))
+                state['font'] = font_size
+            if alpha != state['alpha']:
+                root.attributes("-alpha", alpha)      # transparence
+                state['alpha'] = alpha
+            text_lbl.configure(text="PANEL : " + text)
+            img = preview_image(preview)
+            if img is not None:
+                preview_lbl.configure(image=img)
+                if state['preview'] is None:
+                    preview_lbl.pack(pady=(0, 10))
+            elif state['preview'] is not None:
+                preview_lbl.pack_forget()
+            state['preview'] = img
+
+            # Centrer (taille demandée : la fenêtre peut être cachée)
+            root.update_idletasks()
+            w, h = root.winfo_reqwidth(), root.winfo_reqheight()
+            ws, hs = root.winfo_screenwidth(), root.winfo_screenheight()
+            root.geometry(f"{w}x{h}+{(ws - w) // 2}+{(hs - h) // 2}")
+            if state['hide'] is None:
+                root.deiconify()
+                root.lift()
+            else:
+                root.after_cancel(state['hide'])
+            state['hide'] = root.after(duration, hide)
+            logger.debug(f"[OSD] '{text}' shown {(time.perf_counter() - t_post) * 1000:.1f} ms after request")
+
+        def poll():
+            msg = None
+            try:
+                while True:
+                    msg = self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            if msg is not None:
+                try:
+                    display(*msg)
+                except tk.TclError as e:
+                    logger.warning(f"OSD error: {e}")
+            root.after(OSD_POLL_MS, poll)
+
+        poll()
         root.mainloop()
 
-    threading.Thread(target=_run, daemon=True).start()
+
+_OSD: Optional[PopupOsd] = None
+_OSD_LOCK = threading.Lock()
 
 
-def escape_arg_value(s: str) -> str:
+def show_popup_tk(text, duration=600, font_size=24, alpha=0.9, preview=None):
     """
-    Remplace dans la chaîne s toutes les séquences d’échappement
-    par leur caractère d’origine pour le batch .arg,
-    en incluant désormais la séquence '|' → '!'.
+    Affiche un petit OSD Tkinter centré, toujours topmost, frameless,
+    caché après `duration` ms, puis remet le focus sur ES.
+    preview : entry['shapes'] d’un layout → aperçu de ses couleurs sous le texte.
+    La fenêtre et son thread sont créés au premier appel puis réutilisés.
     """
-    # d’abord les séquences à deux caractères :
-    repl2 = {
-        '""': '"',   # guillemet    → double-guillemet
-        '|A': '&',   # esperluette  → |A
-        '|v': ',',   # virgule      → |v
-        '|p': '+',   # plus         → |p
-        '|%': '!',   # point d’excl.→ |%
-        '||': '|',   # pipe         → ||
-        '%%': '%',   # pourcent     → %%
-    }
-    # puis la séquence à un caractère :
-    repl1 = {
-        '|': '!'
-    }
-
-    result = []
-    i = 0
-    while i < len(s):
-        # 1) on essaie la séquence de longueur 2
-        if i + 1 < len(s) and s[i:i+2] in repl2:
-            result.append(repl2[s[i:i+2]])
-            i += 2
-        # 2) sinon on regarde si le caractère seul est à remplacer
-        elif s[i] in repl1:
-            result.append(repl1[s[i]])
-            i += 1
-        # 3) sinon on le reprend tel quel
-        else:
-            result.append(s[i])
-            i += 1
+    global _OSD
+    with _OSD_LOCK:
+        if _OSD is None:
+            _OSD = PopupOsd()
+    _OSD.show(text, duration, font_size, alpha, preview)
 
-    return ''.join(result)
 
 def get_system_emulator(system_name: str) -> (str, str):
     """
@@ -393,89 +508,799 @@ def load_layout_buttons(system: str) -> List[Dict]:
         logger.error(f"Error parsing XML for {system}: {e}")
     return []
 
-def parse_es_event(path):
-    with open(path, encoding='cp1252') as f:
-        raw = f.read().replace('\r','').replace('\n','')
-    data = raw.strip()
-    params = dict(p.split('=', 1) for p in data.split('&') if '=' in p)
-    ev     = params.get('event','').strip('"').lower()
-    system = params.get('param1','').strip('"').strip().lower()
-    raw2   = params.get('param2','').strip('"').strip()
-    # on renvoie raw2 pour qu’on puisse déterminer fichier vs dossier
-    return ev, system, raw2
-
-def safe_serial_write(ser, cmd, label=""):
+# —————————————————————————————————————————————————————————
+# Écriture série : un seul thread écrit sur le port, les autres déposent dans une file
+# —————————————————————————————————————————————————————————
+PRIO_MACRO  = 0     # retour visuel des macros .lip en jeu
+PRIO_LAYOUT = 1     # SetPanelColors (changement de layout / système)
+PRIO_DIAG   = 2     # ping, diagnostics
+SERIAL_QUEUE_MAX    = 64     # commandes en attente au-delà desquelles on jette la moins prioritaire
+SERIAL_COALESCE_MAX = 1024   # octets max regroupés dans un seul write()
+# Protocole ≥ 2 : commandes numérotées et acquittées (« OK #N »)
+ACK_WINDOW     = 16     # commandes en vol sans accusé au maximum
+ACK_TIMEOUT_MS = 300    # délai avant retransmission
+ACK_RETRIES    = 3      # envois max d’une même commande avant de la déclarer perdue
+RTT_SAMPLES    = 256    # échantillons RTT conservés par type de commande
+PRIO_RESYNC    = -1     # INIT + état rejoués après reconnexion, avant tout le reste
+
+
+class CommandTracker:
     """
-    Vide les buffers d’entrée et de sortie, puis envoie cmd immédiatement.
+    Fenêtre glissante des commandes numérotées en attente d’accusé.
+    Partage la Condition du SerialWriter : un accusé réveille le thread d’écriture.
+    RTT mesuré par type de commande, sans les commandes retransmises (Karn).
     """
-    try:
-        # Supprime toute donnée en attente côté Pico (input)…
-        #ser.reset_input_buffer()
-        # …et côté OS (output), si nécessaire
-        #ser.reset_output_buffer()
-        logger.error(f"afe_serial_write")
-    except Exception:
-        # Certains drivers n’ont pas ces méthodes, on ignore
-        pass
 
+    def __init__(self, cond: threading.Condition, window: int = ACK_WINDOW,
+                 timeout_ms: int = ACK_TIMEOUT_MS, retries: int = ACK_RETRIES):
+        self.cond     = cond
+        self.window   = window
+        self.timeout  = timeout_ms / 1000.0
+        self.retries  = retries
+        self.next_seq = 0
+        self.inflight: Dict[int, list] = {}     # seq → [données, type, t_envoi, nb_envois]
+        self.rtt:      Dict[str, deque] = {}    # type → RTT (ms) récents
+        self.counts:   Dict[str, Dict[str, int]] = {}
+
+    def _count(self, kind, what):
+        c = self.counts.setdefault(kind, {'sent': 0, 'acked': 0, 'errors': 0, 'retries': 0, 'lost': 0})
+        c[what] += 1
+
+    def free(self) -> int:
+        return self.window - len(self.inflight)
+
+    def allocate(self) -> int:
+        # appelé sous self.cond ; la fenêtre (≤ 255) garantit un n° libre
+        while self.next_seq in self.inflight:
+            self.next_seq = (self.next_seq + 1) & 0xFF
+        seq = self.next_seq
+        self.next_seq = (seq + 1) & 0xFF
+        return seq
+
+    def sent(self, seq: int, data: bytes, kind: str):
+        self.inflight[seq] = [data, kind, time.perf_counter(), 1]
+        self._count(kind, 'sent')
+
+    def ack(self, seq: int, ok: bool):
+        """Appelé par le lecteur série sur « OK #N » / « ERR #N »."""
+        with self.cond:
+            entry = self.inflight.pop(seq, None)
+            if entry is None:
+                return      # accusé tardif d’une commande déjà retransmise/perdue
+            data, kind, t_sent, tries = entry
+            if ok:
+                self._count(kind, 'acked')
+                if tries == 1:
+                    self.rtt.setdefault(kind, deque(maxlen=RTT_SAMPLES)).append(
+                        (time.perf_counter() - t_sent) * 1000)
+            else:
+                self._count(kind, 'errors')
+                logger.warning(f"[Serial] Pico rejected #{seq} ({kind})")
+            self.cond.notify_all()
+
+    def expired(self) -> List[bytes]:
+        """Sous self.cond : commandes à renvoyer (délai dépassé) ; abandonne celles à bout d’essais."""
+        now, out = time.perf_counter(), []
+        for seq, entry in list(self.inflight.items()):
+            data, kind, t_sent, tries = entry
+            if now - t_sent < self.timeout:
+                continue
+            if tries >= self.retries:
+                del self.inflight[seq]
+                self._count(kind, 'lost')
+                logger.error(f"[Serial] #{seq} ({kind}) lost after {tries} attempts")
+                continue
+            entry[2], entry[3] = now, tries + 1
+            self._count(kind, 'retries')
+            out.append(data)
+        return out
+
+    def next_deadline(self) -> Optional[float]:
+        """Secondes avant la prochaine échéance de retransmission (None si rien en vol)."""
+        if not self.inflight:
+            return None
+        oldest = min(e[2] for e in self.inflight.values())
+        return max(0.0, oldest + self.timeout - time.perf_counter())
+
+    def summary(self) -> str:
+        with self.cond:
+            parts = []
+            for kind, c in sorted(self.counts.items()):
+                samples = sorted(self.rtt.get(kind, ()))
+                if samples:
+                    p50 = samples[len(samples) // 2]
+                    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+                    rtt = f" rtt p50={p50:.1f}ms p95={p95:.1f}ms"
+                else:
+                    rtt = ""
+                parts.append(f"{kind}: sent={c['sent']} ok={c['acked']} err={c['errors']} "
+                             f"retry={c['retries']} lost={c['lost']}{rtt}")
+            return f"in flight={len(self.inflight)} | " + " | ".join(parts)
+
+
+class PanelStateMirror:
+    """
+    Copie côté hôte de l’état durable du Pico : dernier INIT= et, par panel,
+    dernier SetPanelColors=…,default=yes. Rejouée telle quelle après une reconnexion ;
+    taille bornée par le nombre de panels, quelle que soit la durée de la coupure.
+    """
+
+    def __init__(self):
+        self.lock   = threading.Lock()
+        self.init: Optional[str] = None
+        self.panels: Dict[int, Tuple[int, str]] = {}    # panel → (ordre, commande)
+        self.order  = itertools.count()
+
+    def record(self, text: str):
+        for line in text.splitlines():
+            line = line.strip()
+            head, _, rest = line.partition('=')
+            head = head.strip().upper()
+            if head == 'INIT':
+                with self.lock:
+                    self.init = line + '\n'
+            elif head == 'SETPANELCOLORS' and 'default=yes' in line.lower():
+                spec = rest.split(',', 1)[0].strip()
+                if spec.upper() == 'ALL':
+                    panels = [1]
+                else:
+                    panels = [int(p) for p in spec.split('|') if p.strip().isdigit()]
+                with self.lock:
+                    n = next(self.order)
+                    for panel in panels:
+                        self.panels[panel] = (n, line + '\n')
+
+    def replay(self) -> List[str]:
+        """INIT puis les layouts encore visibles, dans leur ordre d’envoi d’origine."""
+        with self.lock:
+            cmds = [self.init] if self.init else []
+            seen = set()
+            for n, cmd in sorted(self.panels.values()):
+                if n not in seen:
+                    seen.add(n)
+                    cmds.append(cmd)
+            return cmds
+
+
+class SerialWriter:
+    """
+    File à priorité bornée devant le port série, vidée par un thread dédié.
+    - submit(data, prio, key) ne bloque jamais l’appelant (watchdog, joystick…) ;
+    - une commande avec la même `key` qu’une commande encore en file la remplace ;
+    - file pleine : la commande la moins prioritaire (la plus récente à priorité égale) est jetée ;
+    - tout ce qui attend est envoyé en un seul write(), dans l’ordre des priorités puis d’arrivée ;
+    - protocole ≥ 2 : chaque commande est numérotée à l’envoi, au plus ACK_WINDOW en vol,
+      retransmises (avant tout le reste) si l’accusé n’arrive pas ;
+    - lien perdu (go_offline) : file et fenêtre vidées, les commandes suivantes ne font que
+      mettre à jour le miroir d’état, rejoué par go_online sur le nouveau port.
+    """
+
+    def __init__(self, ser, maxsize: int = SERIAL_QUEUE_MAX):
+        self.ser     = ser
+        self.maxsize = maxsize
+        self.cond    = threading.Condition()
+        self.heap    = []       # [prio, seq, data, key, label, vivant]
+        self.keys    = {}       # key → entrée encore en file
+        self.pending = 0        # entrées vivantes dans heap
+        self.seq     = itertools.count()
+        self.stats   = {'queued': 0, 'writes': 0, 'bytes': 0, 'coalesced': 0,
+                        'superseded': 0, 'dropped': 0, 'errors': 0, 'offline': 0, 'outages': 0}
+        self.closed  = False
+        self.online  = True
+        self.on_offline = None      # callback(raison) du superviseur de connexion
+        self.mirror  = PanelStateMirror()
+        self.tracker = CommandTracker(self.cond)
+        self.thread  = threading.Thread(target=self._run, name="SerialWriter", daemon=True)
+        self.thread.start()
+
+    def submit(self, data, prio: int = PRIO_LAYOUT, key: Optional[str] = None, label: str = "") -> bool:
+        """
+        Met data en file ; renvoie False si la commande a été jetée.
+        str : encodée au moment du dépôt selon le protocole négocié ; bytes : envoyés tels quels.
+        Hors ligne, seul le miroir d’état est mis à jour (la commande n’est pas gardée).
+        """
+        if isinstance(data, str):
+            self.mirror.record(data)
+            if not self.online:
+                self.stats['offline'] += 1
+                return False
+            data = encode_command(data, SERIAL_PROTO)
+        elif not self.online:
+            self.stats['offline'] += 1
+            return False
+        return self._enqueue(data, prio, key, label)
+
+    def _enqueue(self, data: bytes, prio: int, key: Optional[str], label: str) -> bool:
+        entry = [prio, next(self.seq), data, key, label, True]
+        with self.cond:
+            if not self.online:
+                self.stats['offline'] += 1
+                return False
+            if key is not None:
+                old = self.keys.get(key)
+                if old is not None and old[5]:
+                    old[5] = False
+                    self.pending -= 1
+                    self.stats['superseded'] += 1
+                    logger.debug(f"[SerialWriter] '{old[4]}' superseded by '{label}'")
+                self.keys[key] = entry
+
+            if self.pending >= self.maxsize:
+                victim = max((e for e in self.heap if e[5]), key=lambda e: (e[0], e[1]))
+                if (victim[0], victim[1]) < (entry[0], entry[1]):
+                    victim = entry          # la nouvelle commande est la moins prioritaire
+                self.stats['dropped'] += 1
+                logger.warning(f"[SerialWriter] queue full, dropping '{victim[4] or victim[2][:40]!r}'")
+                if victim is entry:
+                    if key is not None:
+                        self.keys.pop(key, None)
+                    return False
+                victim[5] = False
+                self.pending -= 1
+                if victim[3] is not None and self.keys.get(victim[3]) is victim:
+                    del self.keys[victim[3]]
+
+            heapq.heappush(self.heap, entry)
+            self.pending += 1
+            self.stats['queued'] += 1
+            self.cond.notify()
+        return True
+
+    def write(self, data):
+        # Compatibilité avec l’API pyserial (appels directs ser.write)
+        self.submit(data, PRIO_LAYOUT)
+        return len(data)
+
+    def _take_batch(self, proto: int, chunks: List[bytes]) -> Tuple[bytes, List[str]]:
+        """Sous self.cond : complète chunks (retransmissions) avec la file, dans la limite de la fenêtre."""
+        labels, size = [], sum(len(c) for c in chunks)
+        acked = proto >= 2
+        while self.heap:
+            entry = self.heap[0]
+            if not entry[5]:
+                heapq.heappop(self.heap)
+                continue
+            if chunks and size + len(entry[2]) > SERIAL_COALESCE_MAX:
+                break
+            if acked:
+                cmds = list(iter_commands(entry[2]))
+                # une entrée plus grosse que la fenêtre passe seule quand plus rien n’est en vol
+                if len(cmds) > self.tracker.free() and self.tracker.inflight:
+                    break
+                data = []
+                for cmd in cmds:
+                    seq = self.tracker.allocate()
+                    cmd = stamp(cmd, seq, proto)
+                    self.tracker.sent(seq, cmd, command_kind(cmd, proto))
+                    data.append(cmd)
+                entry[2] = b''.join(data)
+            heapq.heappop(self.heap)
+            entry[5] = False
+            self.pending -= 1
+            if entry[3] is not None and self.keys.get(entry[3]) is entry:
+                del self.keys[entry[3]]
+            chunks.append(entry[2])
+            labels.append(entry[4])
+            size += len(entry[2])
+        return b''.join(chunks), labels
+
+    def _run(self):
+        tracker = self.tracker
+        while True:
+            with self.cond:
+                while True:
+                    if self.closed and (not self.online or (not self.pending and not tracker.inflight)):
+                        return
+                    if not self.online:
+                        self.cond.wait()
+                        continue
+                    proto  = SERIAL_PROTO
+                    resend = tracker.expired() if proto >= 2 else []
+                    room   = proto < 2 or tracker.free() > 0
+                    if resend or (self.pending and room):
+                        break
+                    self.cond.wait(tracker.next_deadline() if proto >= 2 else None)
+                retransmits = len(resend)   # _take_batch complète la liste resend
+                data, labels = self._take_batch(proto, resend)
+                if retransmits:
+                    labels.insert(0, f"{retransmits} retransmit(s)")
+                ser = self.ser
+            if not data:
+                continue
+            try:
+                ser.write(data)
+                self.stats['writes'] += 1
+                self.stats['bytes']  += len(data)
+                self.stats['coalesced'] += len(labels) - 1
+                logger.debug(f"[SerialWriter] {len(data)} bytes ({', '.join(l for l in labels if l)})")
+            except serial.SerialTimeoutException as e:
+                # write_timeout=0 : buffer de sortie plein, le port est toujours là
+                self.stats['errors'] += 1
+                logger.error(f"❌ Erreur série lors de l’envoi de '{', '.join(labels)}': {e}")
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"❌ Erreur série lors de l’envoi de '{', '.join(labels)}': {e}")
+                if ser is self.ser:
+                    self.go_offline(str(e))
+
+    def go_offline(self, reason: str) -> bool:
+        """Lien perdu : vide file et fenêtre (le miroir d’état suffit à resynchroniser)."""
+        with self.cond:
+            if not self.online:
+                return False
+            self.online = False
+            self.heap.clear()
+            self.keys.clear()
+            self.pending = 0
+            self.tracker.inflight.clear()
+            self.stats['outages'] += 1
+            self.cond.notify_all()
+        logger.warning(f"[SerialWriter] link lost ({reason}), holding panel state until reconnect")
+        if self.on_offline is not None:
+            self.on_offline(reason)
+        return True
+
+    def go_online(self, ser) -> int:
+        """Nouveau port : rejoue INIT + état miroir en tête de file ; renvoie le nombre de commandes."""
+        replay = self.mirror.replay()
+        with self.cond:
+            self.ser    = ser
+            self.online = True
+            for cmd in replay:
+                self._enqueue(encode_command(cmd, SERIAL_PROTO), PRIO_RESYNC, None,
+                              f"resync {cmd.split('=', 1)[0]}")
+            self.cond.notify_all()
+        return len(replay)
+
+    def close(self, timeout: float = 1.0):
+        """Vide la file puis arrête le thread."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join(timeout)
+        logger.info(f"[SerialWriter] stats: {self.stats}")
+        if SERIAL_PROTO >= 2:
+            logger.info(f"[SerialWriter] acks: {self.tracker.summary()}")
+
+
+def safe_serial_write(ser, cmd, label="", prio=PRIO_LAYOUT, key=None):
+    """
+    Envoie cmd (chaîne ou bytes déjà encodés, ex. macros .lip compilées).
+    Avec un SerialWriter, la commande passe par sa file (non bloquant) ;
+    sinon écriture directe sur le port.
+    """
+    if isinstance(ser, SerialWriter):
+        ser.submit(cmd, prio, key, label)
+        return
     try:
-        ser.write(cmd.encode('utf-8'))
-        #ser.flush()
+        ser.write(cmd if isinstance(cmd, bytes) else encode_command(cmd, SERIAL_PROTO))
     except Exception as e:
         logger.error(f"❌ Erreur série lors de l’envoi de '{label}': {e}")
 
-def monitor_serial_buffer(ser):
-    while True:
-        time.sleep(1)
+
+def negotiate_protocol(ser, reader=None, timeout: float = 1.0) -> int:
+    """
+    Envoie PING=<version> et lit la réponse : « PONG proto=N » → trames binaires
+    (N ≥ 2 : commandes numérotées et acquittées),
+    « PONG » (ancien firmware) ou rien → texte. [Serial] protocol = text force le texte.
+    Avec un SerialReader, la réponse est attendue via son dispatcher (il est seul à lire le port).
+    """
+    global SERIAL_PROTO
+    wanted = _read_panel_cfg().get('Serial', 'protocol', fallback='auto').strip().lower()
+    SERIAL_PROTO = 0
+    if wanted == 'text':
+        logger.info("Serial protocol forced to text")
+        return SERIAL_PROTO
+    try:
+        if reader is not None:
+            waiter = reader.expect('PONG')
+            ser.write(f"PING={PROTO_VERSION}\n".encode('ascii'))
+            line = waiter.wait(timeout)
+            lines = [line] if line is not None else []
+        else:
+            ser.reset_input_buffer()
+            ser.write(f"PING={PROTO_VERSION}\n".encode('ascii'))
+            deadline = time.perf_counter() + timeout
+            buf, lines = b'', []
+            while time.perf_counter() < deadline and not lines:
+                buf += ser.read(ser.in_waiting or 1)
+                *raw, buf = buf.split(b'\n')
+                lines = [l.decode('utf-8', 'ignore') for l in raw if parse_pong(l.decode('utf-8', 'ignore')) is not None]
+        for line in lines:
+            version = parse_pong(line)
+            if version is not None:
+                SERIAL_PROTO = min(version, PROTO_VERSION)
+                logger.info(f"Serial protocol negotiated: {'binary v' + str(SERIAL_PROTO) if SERIAL_PROTO else 'text'}")
+                return SERIAL_PROTO
+    except Exception as e:
+        logger.warning(f"Protocol negotiation failed, staying in text mode: {e}")
+        return SERIAL_PROTO
+    logger.warning("No PONG to PING, staying in text mode")
+    return SERIAL_PROTO
+
+
+class ReplyWaiter:
+    """Attente d’une réponse du Pico dont la ligne commence par `prefix`."""
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.event  = threading.Event()
+        self.line: Optional[str] = None
+
+    def wait(self, timeout: float) -> Optional[str]:
+        self.event.wait(timeout)
+        return self.line
+
+
+SERIAL_STATS_INTERVAL = 30      # secondes entre deux bilans du lecteur série
+
+
+class SerialReader:
+    """
+    Seul lecteur du port série : read() bloquant avec timeout, découpage incrémental
+    en lignes, puis routage de chaque réponse :
+      OK #N / ERR #N → tracker (CommandTracker) ;  PONG → attentes expect('PONG') ;
+      Error…        → compteur + warning ;        état (Panel … state, RAW …) → attentes ;
+      autres        → debug.
+    Occupation des buffers (in/out_waiting) relevée sans jamais lire à la place du parseur.
+    Les trames binaires éventuelles (octet MAGIC) sont sautées : le Pico ne répond qu’en texte.
+    """
+
+    MAX_LINE = 512
+
+    def __init__(self, ser):
+        self.ser       = ser
+        self.buf       = bytearray()
+        self.lock      = threading.Lock()
+        self.waiters: List[ReplyWaiter] = []
+        self.listeners = []             # callbacks (kind, line)
+        self.tracker   = None           # CommandTracker du SerialWriter (accusés)
+        self.alive     = True
+        self.stats     = {'bytes': 0, 'lines': 0, 'ok': 0, 'acks': 0, 'errors': 0, 'pong': 0,
+                          'state': 0, 'other': 0, 'overflow': 0,
+                          'in_waiting_max': 0, 'out_waiting_max': 0}
+        self.thread    = threading.Thread(target=self._run, name="SerialReader", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def expect(self, prefix: str) -> ReplyWaiter:
+        """À appeler *avant* d’envoyer la commande, pour ne pas rater une réponse rapide."""
+        waiter = ReplyWaiter(prefix)
+        with self.lock:
+            self.waiters.append(waiter)
+        return waiter
+
+    def subscribe(self, callback):
+        self.listeners.append(callback)
+
+    def _classify(self, line: str) -> str:
+        if parse_ack(line) is not None:
+            return 'ack'
+        head = line[:6].upper()
+        if head.startswith('PONG'):
+            return 'pong'
+        if head.startswith('OK'):
+            return 'ok'
+        if head.startswith('ERR') or head.startswith('UNKNOW'):
+            return 'error'
+        if line.startswith('Panel') or line.startswith('RAW') or line.startswith('Bus0'):
+            return 'state'
+        return 'other'
+
+    def _dispatch(self, line: str):
+        kind = self._classify(line)
+        self.stats['lines'] += 1
+        self.stats['acks' if kind == 'ack' else kind] += 1
+        if kind == 'ack':
+            if self.tracker is not None:
+                self.tracker.ack(*parse_ack(line))
+        elif kind == 'error':
+            logger.warning(f"[PICO] {line}")
+        else:
+            logger.debug(f"[PICO REPLY] {line}")
+
+        with self.lock:
+            for waiter in self.waiters:
+                if line.startswith(waiter.prefix):
+                    self.waiters.remove(waiter)
+                    waiter.line = line
+                    waiter.event.set()
+                    break
+        for callback in self.listeners:
+            try:
+                callback(kind, line)
+            except Exception as e:
+                logger.debug(f"[SerialReader] listener error: {e}")
+
+    def feed(self, data: bytes):
+        """Parseur incrémental : accumule les octets et découpe en lignes (fin LF ou CRLF)."""
+        self.stats['bytes'] += len(data)
+        buf = self.buf
+        buf += data
+        while True:
+            nl = buf.find(b'\n')
+            if nl < 0:
+                break
+            raw = bytes(buf[:nl]).rstrip(b'\r')
+            del buf[:nl + 1]
+            if raw[:1] == bytes((0xA5,)):
+                continue
+            line = raw.decode('utf-8', 'ignore').strip()
+            if line:
+                self._dispatch(line)
+        if len(buf) > self.MAX_LINE:
+            self.stats['overflow'] += 1
+            logger.warning(f"[SerialReader] {len(buf)} bytes without newline, discarded")
+            del buf[:]
+
+    def _sample_buffers(self):
         try:
-            in_buf = ser.in_waiting
-            out_buf = ser.out_waiting
-            logger.info(f"[Serial Buffer] IN={in_buf} | OUT={out_buf}")
-            dump = ser.read(ser.in_waiting)
-            logger.info(f"[SERIAL DUMP] <<< {dump}")
-        except Exception as e:
-            logger.warning(f"[Serial Monitor] Erreur lecture buffer : {e}")
-            break
+            self.stats['in_waiting_max']  = max(self.stats['in_waiting_max'],  self.ser.in_waiting)
+            self.stats['out_waiting_max'] = max(self.stats['out_waiting_max'], self.ser.out_waiting)
+        except Exception:
+            pass
 
-def read_serial_feedback(ser):
-    while True:
+    def _run(self):
+        last_report = time.monotonic()
+        while self.alive:
+            try:
+                # bloque jusqu’à 1 octet ou le timeout du port, puis prend tout ce qui attend
+                data = self.ser.read(1)
+                if data:
+                    self._sample_buffers()
+                    waiting = self.ser.in_waiting
+                    if waiting:
+                        data += self.ser.read(waiting)
+                    self.feed(data)
+            except Exception as e:
+                logger.warning(f"[SerialReader] lecture impossible : {e}")
+                self.alive = False
+                for callback in self.listeners:
+                    try:
+                        callback('disconnected', str(e))
+                    except Exception:
+                        pass
+                break
+            now = time.monotonic()
+            if now - last_report >= SERIAL_STATS_INTERVAL:
+                last_report = now
+                logger.info(f"[SerialReader] {self.stats} pending={len(self.buf)}B")
+                if self.tracker is not None and SERIAL_PROTO >= 2:
+                    logger.info(f"[Serial ACK] {self.tracker.summary()}")
+
+    def stop(self):
+        self.alive = False
+
+
+# —————————————————————————————————————————————————————————
+# Découverte du Pico : dernier port connu, puis ports RP2040 (VID), puis le reste, en parallèle
+# —————————————————————————————————————————————————————————
+PICO_PORT_CACHE  = os.path.join(BASE_DIR, 'pico.port')
+RP2040_VID       = 0x2E8A                     # Raspberry Pi
+RP2040_PIDS      = (0x0005, 0x000A, 0x000C)   # MicroPython, SDK CDC, CircuitPython/autres
+PROBE_TIMEOUT_MS = 300
+
+
+def _probe_port(device: str, timeout_ms: int = PROBE_TIMEOUT_MS) -> bool:
+    """Ouvre device, envoie PING et attend PONG au plus timeout_ms (pas de sleep fixe)."""
+    deadline = time.perf_counter() + timeout_ms / 1000.0
+    try:
+        with serial.Serial(device, BAUDRATE, timeout=0.02, write_timeout=timeout_ms / 1000.0) as s:
+            s.reset_input_buffer()
+            s.write(b"PING\n")
+            buf = b''
+            while time.perf_counter() < deadline:
+                buf += s.read(s.in_waiting or 1)
+                if b"pong" in buf.lower():
+                    return True
+    except Exception as e:
+        logger.debug(f"probe {device}: {e}")
+    return False
+
+
+def _probe_many(devices: List[str], timeout_ms: int = PROBE_TIMEOUT_MS) -> Optional[str]:
+    """Sonde les ports en parallèle ; renvoie le premier qui répond PONG."""
+    if not devices:
+        return None
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    pool = ThreadPoolExecutor(max_workers=min(8, len(devices)), thread_name_prefix="probe")
+    try:
+        futures = {pool.submit(_probe_port, d, timeout_ms): d for d in devices}
+        for fut in as_completed(futures, timeout=timeout_ms / 1000.0 + 1.0):
+            if fut.result():
+                return futures[fut]
+    except Exception as e:
+        logger.debug(f"probe pool: {e}")
+    finally:
+        # les sondes restantes se terminent seules à leur échéance
+        pool.shutdown(wait=False)
+    return None
+
+
+def find_pico(quiet: bool = False) -> Optional[str]:
+    """
+    1) port forcé ([Serial] port) ou dernier port valide (pico.port) ;
+    2) ports USB au VID/PID RP2040, sondés en parallèle ;
+    3) tous les autres ports (+ [Serial] extra_ports, ex. pty de test), en parallèle.
+    quiet : pas de log d’échec (tentatives répétées pendant une reconnexion).
+    """
+    t0  = time.perf_counter()
+    cfg = _read_panel_cfg()
+    if not quiet:
+        logger.info("🔍 Scanning serial ports for Pico...")
+
+    def found(device, how):
+        dt = (time.perf_counter() - t0) * 1000
+        logger.info(f"✅ Pico found on {device} ({how})")
+        logger.warning(f"[PROFILE] Pico discovery took {dt:.0f} ms ({how})")
         try:
-            if ser.in_waiting:
-                lines = ser.read(ser.in_waiting).decode(errors="ignore").splitlines()
-                for line in lines:
-                    logger.debug(f"[PICO REPLY] {line}")
-        except Exception as e:
-            logger.warning(f"[Feedback] Erreur lecture Pico : {e}")
-        time.sleep(0.1)
+            with open(PICO_PORT_CACHE, 'w', encoding='utf-8') as fh:
+                fh.write(device)
+        except OSError as e:
+            logger.debug(f"Cannot write {PICO_PORT_CACHE}: {e}")
+        return device
+
+    forced = cfg.get('Serial', 'port', fallback='auto').strip()
+    if forced and forced.lower() != 'auto':
+        if _probe_port(forced):
+            return found(forced, 'configured port')
+        logger.warning(f"Configured port {forced} did not answer, scanning")
+
+    cached = None
+    try:
+        with open(PICO_PORT_CACHE, encoding='utf-8') as fh:
+            cached = fh.read().strip() or None
+    except OSError:
+        pass
+    if cached and cached != forced and _probe_port(cached):
+        return found(cached, 'cached port')
+
+    ports  = serial.tools.list_ports.comports()
+    rp2040 = [p.device for p in ports
+              if p.vid == RP2040_VID and (p.pid in RP2040_PIDS or p.pid is None)]
+    device = _probe_many([d for d in rp2040 if d != cached])
+    if device:
+        return found(device, 'RP2040 VID/PID')
+
+    extra  = [e.strip() for e in cfg.get('Serial', 'extra_ports', fallback='').split(',') if e.strip()]
+    others = [p.device for p in ports if p.device not in rp2040] + extra
+    device = _probe_many([d for d in others if d != cached])
+    if device:
+        return found(device, 'full scan')
+
+    if not quiet:
+        logger.error(f"❌ No Pico detected ({(time.perf_counter() - t0) * 1000:.0f} ms).")
+    return None
+
+
+def connect_pico(quiet: bool = False):
+    """Découverte, ouverture du port, lecteur série et négociation ; (None, None) si aucun Pico."""
+    pico = find_pico(quiet)
+    if not pico:
+        return None, None
+    try:
+        ser = serial.Serial(pico, BAUDRATE, timeout=1, write_timeout=0)
+    except Exception as e:
+        logger.warning(f"Cannot open {pico}: {e}")
+        return None, None
+    logger.info(f"Connected to Pico on {pico} @ {BAUDRATE}")
 
-def find_pico():
-    logger.info("🔍 Scanning serial ports for Pico...")
-    for port in serial.tools.list_ports.comports():
+    # Un seul thread lit le port et route les réponses
+    reader = SerialReader(ser).start()
+
+    # Trames binaires si le firmware les connaît, texte sinon
+    negotiate_protocol(ser, reader)
+    return ser, reader
+
+
+# —————————————————————————————————————————————————————————
+# Reconnexion : Pico débranché / redémarré → redécouverte, INIT, état rejoué
+# —————————————————————————————————————————————————————————
+RECONNECT_DELAY_MIN = 0.5   # secondes avant la 1re tentative, doublées à chaque échec…
+RECONNECT_DELAY_MAX = 5.0   # … jusqu’à ce plafond
+
+
+class SerialSupervisor:
+    """
+    Surveille le lien : échec d’écriture (SerialWriter) ou de lecture (SerialReader)
+    → le writer passe hors ligne, ce thread ferme l’ancien port puis relance
+    connect_pico() avec un délai croissant plafonné. Une fois reconnecté, le writer
+    reprend sur le nouveau port en rejouant INIT + le miroir d’état.
+    Pico de retour → resynchronisé en moins de RECONNECT_DELAY_MAX + découverte + négociation.
+    """
+
+    def __init__(self, writer: SerialWriter, ser, reader: SerialReader):
+        self.writer = writer
+        self.ser    = ser
+        self.reader = None
+        self.lost   = threading.Event()
+        self.alive  = True
+        self.stats  = {'outages': 0, 'attempts': 0, 'last_outage_ms': 0}
+        # callback(ancien, nouveau) si le Pico revient avec une autre version de protocole
+        # (firmware reflashé) : ce qui a été encodé pour l’ancienne doit l’être à nouveau
+        self.on_protocol_change = None
+        writer.on_offline = lambda reason: self.lost.set()
+        self._attach(reader)
+        self.thread = threading.Thread(target=self._run, name="SerialSupervisor", daemon=True)
+        self.thread.start()
+
+    def _attach(self, reader: SerialReader):
+        reader.tracker = self.writer.tracker
+        # un ancien lecteur qui meurt en retard ne doit pas couper la nouvelle connexion
+        reader.subscribe(lambda kind, line, r=reader: self._on_reply(r, kind, line))
+        self.reader = reader
+
+    def _on_reply(self, reader, kind, line):
+        if kind == 'disconnected' and reader is self.reader:
+            self.writer.go_offline(line)
+
+    def _close_link(self):
+        if self.reader is not None:
+            self.reader.stop()
         try:
-            s = serial.Serial(port.device, BAUDRATE, timeout=1)
-            s.reset_input_buffer(); time.sleep(0.2)
-            s.write(b"ping\n"); time.sleep(0.2)
-            data = s.read_all().lower()
-            s.close()
-            if b"pong" in data:
-                logger.info(f"✅ Pico found on {port.device}")
-                return port.device
+            self.ser.close()
         except Exception:
-            continue
-    logger.error("❌ No Pico detected.")
-    return None
+            pass
+
+    def _run(self):
+        while True:
+            self.lost.wait()
+            if not self.alive:
+                return
+            t0 = time.perf_counter()
+            self.stats['outages'] += 1
+            proto_before = SERIAL_PROTO
+            self._close_link()
+            delay = RECONNECT_DELAY_MIN
+            while self.alive:
+                self.stats['attempts'] += 1
+                ser, reader = connect_pico(quiet=True)
+                if ser is not None:
+                    break
+                self.lost.clear()
+                self.lost.wait(delay)       # stop() réveille tout de suite
+                delay = min(delay * 2, RECONNECT_DELAY_MAX)
+            else:
+                return
+            self.lost.clear()
+            self.ser = ser
+            self._attach(reader)
+            if SERIAL_PROTO != proto_before and self.on_protocol_change is not None:
+                logger.warning(f"[Serial] protocol changed on reconnect: {proto_before} → {SERIAL_PROTO}")
+                try:
+                    self.on_protocol_change(proto_before, SERIAL_PROTO)
+                except Exception:
+                    logger.exception("[Serial] protocol change callback failed")
+            count = self.writer.go_online(ser)
+            dt = (time.perf_counter() - t0) * 1000
+            self.stats['last_outage_ms'] = round(dt)
+            logger.warning(f"[Serial] reconnected after {dt:.0f} ms, "
+                           f"{count} state command(s) replayed | {self.stats}")
+
+    def stop(self):
+        self.alive = False
+        self.lost.set()
+
+    def close(self):
+        self.stop()
+        self._close_link()
 
 
-class LedEventHandler(PatternMatchingEventHandler):
+class LedEventHandler:
+    """Abonné du bus d’événements ES (LPEventBus) : layouts LED, .rmp et macros .lip."""
+
     def __init__(self, ser, panel_id):
-        super().__init__(patterns=[ES_EVENT_FILE], ignore_directories=True)
         self.ser           = ser
         self.panel_id      = panel_id
         self.cfg = _read_panel_cfg()
         self.last_system   = None
         self.listening     = False
         self.last_es_event = (None, None, None)
-        self.lip_events    = []
+        self.lip_dispatch  = {}     # panel → {(bouton 0-based, 'press'|'release') → (commandes encodées, …)}
+        self.lip_game      = None   # (system, game) pour lequel lip_dispatch a été chargé
+        self.pending_remap = None   # (system, game, chemin .rmp, contenu) rendu au game-selected
         # ——————————————————————————————————————————————————
         #   LAYOUTS “SYSTÈME”
         # ——————————————————————————————————————————————————
@@ -625,7 +1450,7 @@ class LedEventHandler(PatternMatchingEventHandler):
                     c = btn.get('color', DEFAULT_COLOR).upper()
                     mapping.append((label, "OFF" if c == "BLACK" else c))
 
-                layouts.append({'name': name, 'buttons': mapping})
+                layouts.append({'name': name, 'buttons': mapping, 'shapes': layout_shapes(layout)})
 
         except Exception as e:
             logger.error(f"Error loading layouts from '{xml_path}': {e}")
@@ -690,7 +1515,7 @@ class LedEventHandler(PatternMatchingEventHandler):
         mapping = ';'.join(f"{lbl}:{clr}" for lbl, clr in entry['buttons'])
         cmd = f"SetPanelColors={panels},{mapping},default=yes\n"
         try:
-            safe_serial_write(self.ser, cmd, label=f"{entry['name']} layout")
+            safe_serial_write(self.ser, cmd, label=f"{entry['name']} layout", key='layout')
             logger.info(f"    ➡ Sent ({key} layout) [{saved_idx}] '{entry['name']}'")
         except Exception as e:
             logger.error(f"    Erreur envoi layout pour '{key}': {e}")
@@ -721,31 +1546,302 @@ class LedEventHandler(PatternMatchingEventHandler):
         cmd = f"SetPanelColors={panels},{mapping},default=yes\n"
 
         try:
-            safe_serial_write(self.ser, cmd, label=f"{entry['name']} layout")
+            safe_serial_write(self.ser, cmd, label=f"{entry['name']} layout", key='layout')
             logger.info(f"➡ Switched to layout [{self.current_layout_idx}] '{entry['name']}'")
         except Exception as e:
             logger.error(f"Error sending layout: {e}")
 
-    def on_modified(self, event):
-        now = time.time()
-        logger.warning(f"START [OBSERVER] on_modified reçu à {now:.3f}")
-        try:
-            mtime = os.path.getmtime(ES_EVENT_FILE)   # en secondes float
-        except Exception:
-            mtime = None
+    def _render_remap(self, system: str, game: str, remap_folder_game: str) -> Optional[Tuple[str, str]]:
+        """
+        Prépare le .rmp RetroArch du jeu *en mémoire* et renvoie (chemin_cible, contenu),
+        ou None si aucun remap ne peut être généré.
+        Rien n’est écrit sur disque ici : RetroArch ne lit le remap qu’au lancement,
+        c’est _commit_pending_remap() qui l’écrit sur game-start.
+        """
+        # chemin vers remaps/<core_folder>
+        remaps_root = os.path.join(retrobat_root,
+                                   "emulators","retroarch","config","remaps")
+        target_dir = os.path.join(remaps_root, remap_folder_game)
+
+        # nom du fichier de sortie
+        target_rmp = os.path.join(target_dir, f"{game}.rmp")
+
+        # if we have neither game-specific nor system layouts, skip remap
+        if not self.game_layouts and not self.system_layouts:
+            logger.warning(
+                f"No layouts for '{system}/{game}' → skipping remap generation"
+            )
+            return None
+        # Le layout courant (défini par _apply_saved_layout ou fallback)
+        layout_name = (
+            self.game_layouts[self.current_game_idx]['name']
+            if self.game_layouts
+            else self.system_layouts[self.current_layout_idx]['name']
+        )
 
-        # 2) Capturer l'instant où on entre dans on_modified
-        now = time.time()
+        # choisir le template .rmp
+        plugin_dir  = SYSTEMS_DIR
+        plugin_rmp1 = os.path.join(plugin_dir, f"{system}-{layout_name}.rmp")
+        plugin_rmp0 = os.path.join(plugin_dir, f"{system}.rmp")
+        src_rmp  = plugin_rmp1
+        template = load_rmp_template(plugin_rmp1)
+        if template is None:
+            src_rmp  = plugin_rmp0
+            template = load_rmp_template(plugin_rmp0)
+
+        # ——————————————————————————————————————————————————————————
+        # Génération du .rmp :
+        #   1) on cherche un template (system-layout ou system-game-layout)
+        #   2) si trouvé, on copie comme avant
+        #   3) sinon, on génère un .rmp minimal à partir du XML (retropad_id)
+        # ——————————————————————————————————————————————————————————
+
+        if template is not None:
+            # 2) Template trouvé : rendu du template compilé (remplacement de <p>)
+            logger.info(f"  Rendu remap depuis '{os.path.basename(src_rmp)}' → '{target_rmp}'")
+            cfg     = _read_panel_cfg()
+            players = cfg.getint('Panel', 'players_count', fallback=1)
+            return target_rmp, render_rmp_template(template, players)
 
-        if mtime is not None:
-            delay = (now - mtime) * 1000
-            logger.warning(f"[WATCHDOG] file-modified → on_modified delay = {delay:.1f} ms")
         else:
-            logger.warning(f"[WATCHDOG] on_modified without valid mtime")
-        # Parse EmulationStation event
-        ev, system, raw2 = parse_es_event(ES_EVENT_FILE)
-        system = escape_arg_value(system)
-        logger.debug(f"on_modified: ev='{ev}', system='{system}' (in_game={self.in_game})")
+            # 3) Pas de template → fallback : génération dynamique depuis XML
+            cfg = _read_panel_cfg()
+
+            # a) Reconstruire phys_to_label (B1, B2, START, COIN, JOY)
+            phys_to_label = {}
+            total = cfg.getint('Panel', 'buttons_count', fallback=0)
+            for i in range(1, total + 1):
+                opt = f'panel_button_{i}'
+                if cfg.has_option('Panel', opt):
+                    phys = cfg.get('Panel', opt).rstrip(';')
+                    phys_to_label[phys] = f"B{i}"
+            for opt, lab in [
+                ('panel_button_select','COIN'),
+                ('panel_button_start','START'),
+                ('panel_button_joy','JOY')
+            ]:
+                if cfg.has_option('Panel', opt):
+                    phys = cfg.get('Panel', opt).rstrip(';')
+                    phys_to_label[phys] = lab
+
+            panel_id = self.panel_id
+
+            # b) Choix du XML : jeu d’abord, sinon système
+            xml_game     = os.path.join(SYSTEMS_DIR, system, f"{game}.xml")
+            xml_fallback = os.path.join(SYSTEMS_DIR, f"{system}.xml")
+            xml_to_parse = xml_game if os.path.isfile(xml_game) else xml_fallback
+            logger.info(f"\n xml_game = {xml_game}\n xml_fallback = {xml_fallback}\n xml_to_parse = {xml_to_parse}\n")
+
+            if not os.path.isfile(xml_game) and not os.path.isfile(xml_fallback):
+                logger.warning(f"  Pas de XML jeu ni système trouvé pour '{system}/{game}', skip remap")
+                return None
+
+            try:
+                #tree = ET.parse(xml_to_parse)
+                #root = tree.getroot()
+
+                tree_sys = ET.parse(xml_to_parse)
+                root     = tree_sys.getroot()
+                if os.path.isfile(xml_to_parse):
+                    tree_game = ET.parse(xml_to_parse)
+                    root_game = tree_game.getroot()
+                    for layout in root_game.findall('.//layout'):
+                        root.append(layout)
+
+                # Nombre de joueurs définis dans config.ini
+                players = cfg.getint('Panel', 'players_count', fallback=1)
+                remap_lines = []
+                # On ne veut qu’un seul keyboard_mode=1
+                keyboard_mode_used = False
+                # Boucle pour chaque joueur
+                for panel_id in range(1, players + 1):
+                    # 0) vérification d’un fallback layout “system|game” dans config.ini
+                    logger.info(f"#### test")
+                    cfg = _read_panel_cfg()
+                    # 1) Nombre de boutons max pour ce joueur
+                    btn_cfg = cfg.getint(
+                        'Panel', f'player{panel_id}_buttons_count',
+                        fallback=cfg.getint('Panel', 'buttons_count', fallback=0)
+                    )
+                    layout_name = f"{btn_cfg}-Button"
+                    game_key = f"{system}|{game}"
+                    if cfg.has_section('PanelDefaults') and cfg.has_option('PanelDefaults', game_key):
+                        saved_game_layout = cfg.get('PanelDefaults', game_key)
+                        if saved_game_layout:
+                            logger.info(f"  Utilisation du layout sauvegardé pour '{game_key}' → '{saved_game_layout}'")
+                            layout_name = saved_game_layout
+                        else:
+                            logger.debug(f"  Clé '{game_key}' vide – on garde '{layout_name}'")
+                    else:
+                        logger.debug(f"  Pas de layout jeu-spécifique pour '{game_key}'")
+
+                    logger.info(f"#### btn_cfg {btn_cfg}")
+                    # 2) Choix du <layout> pour ce player
+                    #    a) tentative par layout_name
+                    layout_elem = root.find(f".//layout[@name='{layout_name}']") or \
+                                  root.find(f".//layout[@type='{layout_name}']")
+                    #    b) si trouvé mais inadapté (panelButtons > btn_cfg), ignorer et passe en fallback
+                    if layout_elem is not None:
+                        try:
+                            pb = int(layout_elem.get('panelButtons', '0'))
+                            logger.info(f"#### pb {pb}")
+                        except ValueError:
+                            pb = 0
+                        if pb > btn_cfg:
+                            layout_elem = None
+
+                    #    c) fallback : parmi les layouts <= btn_cfg, prendre celui avec panelButtons max
+                    if layout_elem is None:
+                        candidates = []
+                        for le in root.findall('.//layout'):
+                            try:
+                                pb = int(le.get('panelButtons', '0'))
+                                logger.info(f"####>> pb {pb}")
+                            except ValueError:
+                                continue
+                            if pb <= btn_cfg:
+                                candidates.append((pb, le))
+                        if candidates:
+                            layout_elem = max(candidates, key=lambda x: x[0])[1]
+
+                    if layout_elem is None:
+                        raise ValueError(f"Aucun <layout> matching '{layout_name}' pour player{panel_id}")
+                    logger.info(f"#### layout_name {layout_name} panel_id {panel_id}")
+
+                    # Nombre de boutons défini dans ce layout (panelButtons)
+                    try:
+                        xml_max = int(layout_elem.get('panelButtons', '0'))
+                    except ValueError:
+                        xml_max = 0
+
+                    logger.info(f"#### xml_max {xml_max}")
+                    # 3) Génération des lignes de config
+                    device    = layout_elem.get('retropad_device', '1')
+                    dpad_mode = layout_elem.get('retropad_analog_dpad_mode', '0')
+                    raw_keyboard_mode = layout_elem.get('retropad_keyboard_mode', '0')
+                    remap_lines.append(f'input_libretro_device_p{panel_id} = "{device}"\n')
+                    remap_lines.append(f'input_player{panel_id}_analog_dpad_mode = "{dpad_mode}"\n')
+
+                    if raw_keyboard_mode == "1" and not keyboard_mode_used:
+                        btn_type = "key"
+                        keyboard_mode_used = True
+                    else:
+                        btn_type = "btn"
+
+                    # Boucle des boutons: on utilise l'attribut 'id' pour inclure START/COIN
+                    for btn in layout_elem.findall('button'):
+                        btn_id = btn.get('id', '').upper()
+                        phys_str = btn.get('physical', '')
+                        # calcul phys for numeric ids
+                        try:
+                            phys = int(phys_str)
+                        except (ValueError, TypeError):
+                            phys = 0
+                        # inclure START et COIN toujours
+                        if btn_id not in ('START', 'COIN'):
+                            if (phys > btn_cfg) or (xml_max and phys > xml_max):
+                                continue
+                        rid_str = btn.get('retropad_id') or ''
+                        if not rid_str:
+                            continue
+
+                        # déterminer le label selon 'id'
+                        if btn_id == 'START':
+                            label = 'start'
+                        elif btn_id == 'COIN':
+                            label = 'select'
+                        else:
+                            controller = btn.get('controller', '').lower()
+                            if controller == 'pageup':
+                                label = 'l'
+                            elif controller == 'pagedown':
+                                label = 'r'
+                            elif controller == 'select':
+                                label = 'select'
+                            elif controller == 'start':
+                                label = 'start'
+                            elif controller:
+                                label = controller
+                            else:
+                                label = phys_to_label.get(phys_str, f"B{phys_str}")
+
+                        logger.info(f"input_player{panel_id}_{btn_type}_{label} = '{rid_str}'")
+                        remap_lines.append(f'input_player{panel_id}_{btn_type}_{label} = "{rid_str}"\n')
+
+                # 4) Rendu en mémoire ; l’écriture disque attend game-start
+                logger.info(
+                    f"Remap rendu dynamiquement depuis XML '{xml_to_parse}' → '{target_rmp}'"
+                )
+                return target_rmp, ''.join(remap_lines)
+            except Exception as e:
+                logger.error(f"  Échec génération fallback remap depuis XML: {e}")
+                return None
+
+    def _game_remap_folder(self, system: str, game: str, emu_sys, core_sys) -> Optional[str]:
+        """Dossier remaps RetroArch du core du jeu (override jeu, sinon celui du système)."""
+        emu_game, core_game = get_game_emulator(system, game)
+        if not emu_game:
+            emu_game = emu_sys
+        if not core_game:
+            core_game = core_sys
+
+        remap_folder_game = get_core_folder_name(core_game)
+        if remap_folder_game == "Caprice32":
+            remap_folder_game = "cap32"
+        if remap_folder_game == "Dolphin":
+            remap_folder_game = "dolphin-emu"
+        logger.info(
+            f"    Jeu '{game}' → emulator={emu_game}, "
+            f"core={core_game}, remaps_folder='{remap_folder_game}'"
+        )
+        return remap_folder_game
+
+    def _commit_pending_remap(self, system: str, game: str, emu_sys=None, core_sys=None) -> None:
+        """
+        Écrit sur disque le .rmp rendu au game-selected, s’il correspond au jeu lancé,
+        puis dépose l’accusé ES_EVENT_ACK qui débloque le .bat game-start.
+        Sans rendu préparé pour ce jeu (game-selected manqué, même jeu relancé…),
+        le .rmp est rendu ici, avant l’accusé : le jeu ne démarre jamais sur un .rmp périmé.
+        """
+        t0 = time.perf_counter()
+        pending = self.pending_remap
+        self.pending_remap = None
+        if pending is None or pending[:2] != (system, game):
+            logger.info(f"  Aucun remap préparé pour '{system}/{game}', rendu synchrone")
+            pending = None
+            remap_folder_game = self._game_remap_folder(system, game, emu_sys, core_sys)
+            if remap_folder_game:
+                rendered = self._render_remap(system, game, remap_folder_game)
+                if rendered is not None:
+                    pending = (system, game) + tuple(rendered)
+        if pending is not None:
+            _, _, target_rmp, content = pending
+            try:
+                os.makedirs(os.path.dirname(target_rmp), exist_ok=True)
+                tmp = target_rmp + '.tmp'
+                with open(tmp, 'w', encoding='utf-8') as dst:
+                    dst.write(content)
+                os.replace(tmp, target_rmp)
+                logger.info(f"  Remap écrit → '{target_rmp}'")
+            except Exception as e:
+                logger.error(f"  Échec écriture remap '{target_rmp}': {e}")
+        dt = (time.perf_counter() - t0) * 1000
+
+        try:
+            with open(ES_EVENT_ACK, 'w', encoding='utf-8') as fh:
+                fh.write(f"{dt:.1f}\n")
+        except Exception as e:
+            logger.warning(f"Impossible d’écrire l’accusé game-start: {e}")
+
+        if dt > REMAP_COMMIT_TIMEOUT_MS:
+            logger.warning(f"[PROFILE] remap commit took {dt:.1f} ms (> {REMAP_COMMIT_TIMEOUT_MS} ms, launch not held)")
+        else:
+            logger.warning(f"[PROFILE] remap commit took {dt:.1f} ms")
+
+    def on_es_event(self, event: EsEvent):
+        # événement déjà lu, décodé et désechappé une fois par le bus (LPEventBus)
+        ev, system = event.kind, event.system
+        logger.debug(f"on_es_event: ev='{ev}', system='{system}', game='{event.game}' (in_game={self.in_game})")
         # récupérer le nom exact du dossier remaps pour le core système
         emu_sys, core_sys = get_system_emulator(system)
         remap_folder_sys = get_core_folder_name(core_sys)
@@ -759,8 +1855,9 @@ class LedEventHandler(PatternMatchingEventHandler):
             logger.info(f"Branch: system-selected for '{system}' (last was '{self.last_system}')")
 
             # On quitte le mode “jeu”
-            self.current_game = None
-            self.in_game      = False
+            self.current_game  = None
+            self.in_game       = False
+            self.pending_remap = None
 
 
 
@@ -780,16 +1877,15 @@ class LedEventHandler(PatternMatchingEventHandler):
             self._load_system_layouts(plat)
             self._apply_saved_layout(plat, self.system_layouts, 'current_layout_idx', save=False)
 
-            self.lip_events  = []
+            self.lip_dispatch = {}
             now = time.time()
-            logger.warning(f"SYSTEM SELECTED [OBSERVER] on_modified reçu à {now:.3f}")
+            logger.warning(f"SYSTEM SELECTED [OBSERVER] on_es_event reçu à {now:.3f}")
             return
 
         # —————— 2) game-selected ——————
         if ev == 'game-selected' or self.in_game :
             logger.info(f"game-selected for system : '{system}'")
-            raw2 = escape_arg_value(raw2)
-            logger.info(f"  raw2 '{raw2}'")
+            logger.info(f"  raw2 '{event.param2}'")
             plat = get_system_platform(system) or system
             self.last_system = plat
             logger.info(f"game-selected for system : '{system}' - plateform '{plat}'")
@@ -798,15 +1894,8 @@ class LedEventHandler(PatternMatchingEventHandler):
 
             # On n’est pas encore en jeu physique (juste menu “jeu”)
             self.in_game      = False
-            # 1) Résolution du nom du jeu
-            from urllib.parse import unquote
-            formatted = os.path.normpath(unquote(raw2))
-            if os.path.isfile(formatted):
-                game = os.path.splitext(os.path.basename(formatted))[0]
-            elif os.path.isdir(formatted):
-                game = os.path.basename(formatted)
-            else:
-                game = os.path.splitext(os.path.basename(raw2))[0]
+            # 1) Nom du jeu (résolu par le bus : fichier → sans extension, dossier → son nom)
+            game = event.game
 
             if game != self.current_game :
                 logger.info(f"Branch: game-selected for '{system}'")
@@ -824,258 +1913,20 @@ class LedEventHandler(PatternMatchingEventHandler):
                     logger.info(f"    Aucun émulateur système défini pour '{system}'")
 
                 # 4) Override éventuel pour le jeu ; sinon fallback sur système
-                emu_game, core_game = get_game_emulator(system, game)
-                if not emu_game:
-                    emu_game = emu_sys
-                if not core_game:
-                    core_game = core_sys
-
-                remap_folder_game = get_core_folder_name(core_game)
-                if remap_folder_game == "Caprice32":
-                    remap_folder_game = "cap32"
-                if remap_folder_game == "Dolphin":
-                    remap_folder_game = "dolphin-emu"
-                logger.info(
-                    f"    Jeu '{game}' → emulator={emu_game}, "
-                    f"core={core_game}, remaps_folder='{remap_folder_game}'"
-                )
+                remap_folder_game = self._game_remap_folder(system, game, emu_sys, core_sys)
 
                 # 4) Charger les layouts “jeu” via XML
                 game_xml_path = os.path.join(SYSTEMS_DIR, system, f"{game}.xml")
                 self.game_layouts = self._load_layouts_from_xml(game_xml_path)
                 # —————————————————————————————————————————————————————
-                # 7) GÉNÉRATION DU .rmp APRÈS AVOIR APPLIQUÉ LE LAYOUT COURANT
+                # 7) RENDU DU .rmp EN MÉMOIRE (écrit sur disque au game-start)
                 # —————————————————————————————————————————————————————
+                self.pending_remap = None
                 if remap_folder_game:
-                    # chemin vers remaps/<core_folder>
-                    remaps_root = os.path.join(retrobat_root,
-                                               "emulators","retroarch","config","remaps")
-                    target_dir = os.path.join(remaps_root, remap_folder_game)
-                    os.makedirs(target_dir, exist_ok=True)
-
-                    # nom du fichier de sortie
-                    target_rmp = os.path.join(target_dir, f"{game}.rmp")
-
-                    # if we have neither game-specific nor system layouts, skip remap
-                    if not self.game_layouts and not self.system_layouts:
-                        logger.warning(
-                            f"No layouts for '{system}/{game}' → skipping remap generation"
-                        )
-                        now = time.time()
-                        logger.warning(f"GAME SELECTED [OBSERVER] on_modified reçu à {now:.3f}")
-                        return
-                    # Le layout courant (défini par _apply_saved_layout ou fallback)
-                    layout_name = (
-                        self.game_layouts[self.current_game_idx]['name']
-                        if self.game_layouts
-                        else self.system_layouts[self.current_layout_idx]['name']
-                    )
-
-                    # choisir le template .rmp
-                    plugin_dir  = SYSTEMS_DIR
-                    plugin_rmp1 = os.path.join(plugin_dir, f"{system}-{layout_name}.rmp")
-                    plugin_rmp0 = os.path.join(plugin_dir, f"{system}.rmp")
-                    src_rmp = plugin_rmp1 if os.path.isfile(plugin_rmp1) else \
-                              (plugin_rmp0 if os.path.isfile(plugin_rmp0) else None)
-
-                    # ——————————————————————————————————————————————————————————
-                    # Génération du .rmp :
-                    #   1) on cherche un template (system-layout ou system-game-layout)
-                    #   2) si trouvé, on copie comme avant
-                    #   3) sinon, on génère un .rmp minimal à partir du XML (retropad_id)
-                    # ——————————————————————————————————————————————————————————
-
-                    if src_rmp:
-                        # 2) Template trouvé : copie + remplacement de <p>
-                        logger.info(f"  Génération remap depuis '{os.path.basename(src_rmp)}' → '{target_rmp}'")
-                        cfg     = _read_panel_cfg()
-                        players = cfg.getint('Panel', 'players_count', fallback=1)
-                        with open(src_rmp, 'r', encoding='utf-8') as src, \
-                             open(target_rmp, 'w', encoding='utf-8') as dst:
-                            for line in src:
-                                if '<p>' in line:
-                                    for p in range(1, players + 1):
-                                        dst.write(line.replace('<p>', str(p)))
-                                else:
-                                    dst.write(line)
-
-                    else:
-                        # 3) Pas de template → fallback : génération dynamique depuis XML
-                        cfg = _read_panel_cfg()
-
-                        # a) Reconstruire phys_to_label (B1, B2, START, COIN, JOY)
-                        phys_to_label = {}
-                        total = cfg.getint('Panel', 'buttons_count', fallback=0)
-                        for i in range(1, total + 1):
-                            opt = f'panel_button_{i}'
-                            if cfg.has_option('Panel', opt):
-                                phys = cfg.get('Panel', opt).rstrip(';')
-                                phys_to_label[phys] = f"B{i}"
-                        for opt, lab in [
-                            ('panel_button_select','COIN'),
-                            ('panel_button_start','START'),
-                            ('panel_button_joy','JOY')
-                        ]:
-                            if cfg.has_option('Panel', opt):
-                                phys = cfg.get('Panel', opt).rstrip(';')
-                                phys_to_label[phys] = lab
-
-                        panel_id = self.panel_id
-
-                        # b) Choix du XML : jeu d’abord, sinon système
-                        xml_game     = os.path.join(SYSTEMS_DIR, system, f"{game}.xml")
-                        xml_fallback = os.path.join(SYSTEMS_DIR, f"{system}.xml")
-                        xml_to_parse = xml_game if os.path.isfile(xml_game) else xml_fallback
-                        logger.info(f"\n xml_game = {xml_game}\n xml_fallback = {xml_fallback}\n xml_to_parse = {xml_to_parse}\n")
-
-                        if not os.path.isfile(xml_game) and not os.path.isfile(xml_fallback):
-                            logger.warning(f"  Pas de XML jeu ni système trouvé pour '{system}/{game}', skip remap")
-                            now = time.time()
-                            logger.warning(f"GAME SELECTED [OBSERVER] on_modified reçu à {now:.3f}")
-                            return
-
-                        try:
-                            #tree = ET.parse(xml_to_parse)
-                            #root = tree.getroot()
-
-                            tree_sys = ET.parse(xml_to_parse)
-                            root     = tree_sys.getroot()
-                            if os.path.isfile(xml_to_parse):
-                                tree_game = ET.parse(xml_to_parse)
-                                root_game = tree_game.getroot()
-                                for layout in root_game.findall('.//layout'):
-                                    root.append(layout)
-
-                            # Nombre de joueurs définis dans config.ini
-                            players = cfg.getint('Panel', 'players_count', fallback=1)
-                            remap_lines = []
-                            # On ne veut qu’un seul keyboard_mode=1
-                            keyboard_mode_used = False
-                            # Boucle pour chaque joueur
-                            for panel_id in range(1, players + 1):
-                                # 0) vérification d’un fallback layout “system|game” dans config.ini
-                                logger.info(f"#### test")
-                                cfg = _read_panel_cfg()
-                                # 1) Nombre de boutons max pour ce joueur
-                                btn_cfg = cfg.getint(
-                                    'Panel', f'player{panel_id}_buttons_count',
-                                    fallback=cfg.getint('Panel', 'buttons_count', fallback=0)
-                                )
-                                layout_name = f"{btn_cfg}-Button"
-                                game_key = f"{system}|{game}"
-                                if cfg.has_section('PanelDefaults') and cfg.has_option('PanelDefaults', game_key):
-                                    saved_game_layout = cfg.get('PanelDefaults', game_key)
-                                    if saved_game_layout:
-                                        logger.info(f"  Utilisation du layout sauvegardé pour '{game_key}' → '{saved_game_layout}'")
-                                        layout_name = saved_game_layout
-                                    else:
-                                        logger.debug(f"  Clé '{game_key}' vide – on garde '{layout_name}'")
-                                else:
-                                    logger.debug(f"  Pas de layout jeu-spécifique pour '{game_key}'")
-
-                                logger.info(f"#### btn_cfg {btn_cfg}")
-                                # 2) Choix du <layout> pour ce player
-                                #    a) tentative par layout_name
-                                layout_elem = root.find(f".//layout[@name='{layout_name}']") or \
-                                              root.find(f".//layout[@type='{layout_name}']")
-                                #    b) si trouvé mais inadapté (panelButtons > btn_cfg), ignorer et passe en fallback
-                                if layout_elem is not None:
-                                    try:
-                                        pb = int(layout_elem.get('panelButtons', '0'))
-                                        logger.info(f"#### pb {pb}")
-                                    except ValueError:
-                                        pb = 0
-                                    if pb > btn_cfg:
-                                        layout_elem = None
-
-                                #    c) fallback : parmi les layouts <= btn_cfg, prendre celui avec panelButtons max
-                                if layout_elem is None:
-                                    candidates = []
-                                    for le in root.findall('.//layout'):
-                                        try:
-                                            pb = int(le.get('panelButtons', '0'))
-                                            logger.info(f"####>> pb {pb}")
-                                        except ValueError:
-                                            continue
-                                        if pb <= btn_cfg:
-                                            candidates.append((pb, le))
-                                    if candidates:
-                                        layout_elem = max(candidates, key=lambda x: x[0])[1]
-
-                                if layout_elem is None:
-                                    raise ValueError(f"Aucun <layout> matching '{layout_name}' pour player{panel_id}")
-                                logger.info(f"#### layout_name {layout_name} panel_id {panel_id}")
-
-                                # Nombre de boutons défini dans ce layout (panelButtons)
-                                try:
-                                    xml_max = int(layout_elem.get('panelButtons', '0'))
-                                except ValueError:
-                                    xml_max = 0
-
-                                logger.info(f"#### xml_max {xml_max}")
-                                # 3) Génération des lignes de config
-                                device    = layout_elem.get('retropad_device', '1')
-                                dpad_mode = layout_elem.get('retropad_analog_dpad_mode', '0')
-                                raw_keyboard_mode = layout_elem.get('retropad_keyboard_mode', '0')
-                                remap_lines.append(f'input_libretro_device_p{panel_id} = "{device}"\n')
-                                remap_lines.append(f'input_player{panel_id}_analog_dpad_mode = "{dpad_mode}"\n')
-
-                                if raw_keyboard_mode == "1" and not keyboard_mode_used:
-                                    btn_type = "key"
-                                    keyboard_mode_used = True
-                                else:
-                                    btn_type = "btn"
-
-                                # Boucle des boutons: on utilise l'attribut 'id' pour inclure START/COIN
-                                for btn in layout_elem.findall('button'):
-                                    btn_id = btn.get('id', '').upper()
-                                    phys_str = btn.get('physical', '')
-                                    # calcul phys for numeric ids
-                                    try:
-                                        phys = int(phys_str)
-                                    except (ValueError, TypeError):
-                                        phys = 0
-                                    # inclure START et COIN toujours
-                                    if btn_id not in ('START', 'COIN'):
-                                        if (phys > btn_cfg) or (xml_max and phys > xml_max):
-                                            continue
-                                    rid_str = btn.get('retropad_id') or ''
-                                    if not rid_str:
-                                        continue
-
-                                    # déterminer le label selon 'id'
-                                    if btn_id == 'START':
-                                        label = 'start'
-                                    elif btn_id == 'COIN':
-                                        label = 'select'
-                                    else:
-                                        controller = btn.get('controller', '').lower()
-                                        if controller == 'pageup':
-                                            label = 'l'
-                                        elif controller == 'pagedown':
-                                            label = 'r'
-                                        elif controller == 'select':
-                                            label = 'select'
-                                        elif controller == 'start':
-                                            label = 'start'
-                                        elif controller:
-                                            label = controller
-                                        else:
-                                            label = phys_to_label.get(phys_str, f"B{phys_str}")
-
-                                    logger.info(f"input_player{panel_id}_{btn_type}_{label} = '{rid_str}'")
-                                    remap_lines.append(f'input_player{panel_id}_{btn_type}_{label} = "{rid_str}"\n')
-
-                            # 4) Écriture du fichier généré
-                            os.makedirs(os.path.dirname(target_rmp), exist_ok=True)
-                            with open(target_rmp, 'w', encoding='utf-8') as dst:
-                                dst.writelines(remap_lines)
-
-                            logger.info(
-                                f"Remap généré dynamiquement depuis XML '{xml_to_parse}' → '{target_rmp}'"
-                            )
-                        except Exception as e:
-                            logger.error(f"  Échec génération fallback remap depuis XML: {e}")
+                    rendered = self._render_remap(system, game, remap_folder_game)
+                    if rendered is not None:
+                        target_rmp, content = rendered
+                        self.pending_remap = (system, game, target_rmp, content)
 
                 game_key = f"{system}|{game}"
                 # si aucun layout dédié, on récupère les layouts système
@@ -1095,9 +1946,9 @@ class LedEventHandler(PatternMatchingEventHandler):
                 logger.info(f"key_to_use :{key_to_use} game_key:{game_key} self.game_layouts:{self.game_layouts}")
                 self._apply_saved_layout(key_to_use, layouts, 'current_game_idx', save=False)
 
-                self.lip_events = []
+                self.lip_dispatch = {}
                 now = time.time()
-                logger.warning(f"GAME SELECTED [OBSERVER] on_modified reçu à {now:.3f}")
+                logger.warning(f"GAME SELECTED [OBSERVER] on_es_event reçu à {now:.3f}")
                 return
 
         # —————— 3) game-start → enable listening and load .lip macros
@@ -1105,19 +1956,15 @@ class LedEventHandler(PatternMatchingEventHandler):
             logger.info("→ Branch: game-start")
             self.in_game = True
             # always reset previous lip events on new start
-            self.lip_events = []
-            logger.debug("Cleared lip_events before loading new .lip")
-            # resolve game name as above
-            from urllib.parse import unquote
-            formatted = os.path.normpath(unquote(raw2))
-            if os.path.isfile(formatted):
-                game = os.path.splitext(os.path.basename(formatted))[0]
-            elif os.path.isdir(formatted):
-                game = os.path.basename(formatted)
-            else:
-                game = os.path.splitext(os.path.basename(raw2))[0]
+            self.lip_dispatch = {}
+            logger.debug("Cleared lip_dispatch before loading new .lip")
+            # même résolution (désechappée) qu’au game-selected : le remap préparé correspond
+            game = event.game
             logger.info(f"Resolved game name for .lip: '{game}'")
 
+            # le remap rendu au game-selected est écrit avant que le jeu ne démarre
+            self._commit_pending_remap(system, game, emu_sys, core_sys)
+
             if not self.listening:
                 self.listening = True
                 logger.info(f"▶ Game started → now listening to panel inputs for '{game}'")
@@ -1125,9 +1972,9 @@ class LedEventHandler(PatternMatchingEventHandler):
                 logger.debug("Already listening, refreshing .lip")
 
             self._load_lip(system, game)
-            logger.debug(f"lip_events after load: {self.lip_events}")
+            logger.debug(f"lip_dispatch after load: {self.lip_dispatch}")
             now = time.time()
-            logger.warning(f"GAME START [OBSERVER] on_modified reçu à {now:.3f}")
+            logger.warning(f"GAME START [OBSERVER] on_es_event reçu à {now:.3f}")
             return
 
         # —————— 4) implicit game-end on new selection
@@ -1174,14 +2021,24 @@ class LedEventHandler(PatternMatchingEventHandler):
         mapping = ';'.join(f"{lbl}:{clr}" for lbl,clr in btns)
         cmd = f"SetPanelColors={panels},{mapping},default=yes\n"
         try:
-            safe_serial_write(self.ser, cmd, label=f"{key} layout")
+            safe_serial_write(self.ser, cmd, label=f"{key} layout", key='layout')
             logger.info(f"➡ Sent: {cmd.strip()}")
         except Exception as e:
             logger.error(f"Error sending command: {e}")
 
+    def reload_lip(self, *_):
+        """
+        Recompile les macros .lip du jeu en cours pour le protocole négocié maintenant
+        (SerialSupervisor.on_protocol_change) : les commandes sont encodées à la compilation.
+        """
+        if self.listening and self.lip_game is not None:
+            logger.info(f"Reloading .lip for {self.lip_game} (protocol {SERIAL_PROTO})")
+            self._load_lip(*self.lip_game)
+
     def _load_lip(self, system, game):
-        # → 1) toujours repartir d’une liste vide
-        self.lip_events = []
+        # → 1) toujours repartir d’une table vide
+        self.lip_dispatch = {}
+        self.lip_game     = (system, game)
 
         # 2) normaliser le nom « propre » du système
         if os.path.sep in system or (':' in system and system.count(os.path.sep) > 0):
@@ -1192,26 +2049,67 @@ class LedEventHandler(PatternMatchingEventHandler):
         # 3) chercher en premier un .lip jeu‐spécifique
         lip_path = os.path.join(SYSTEMS_DIR, system_name, f"{game}.lip")
         logger.info(f"Looking for .lip at: {lip_path}")
-        if not os.path.exists(lip_path):
+        lip_mtime = _file_mtime(lip_path)
+        if lip_mtime is None:
             # 3a) fallback sur <system>.lip
             fallback = os.path.join(SYSTEMS_DIR, f"{system_name}.lip")
-            if os.path.exists(fallback):
+            lip_mtime = _file_mtime(fallback)
+            if lip_mtime is not None:
                 logger.info(f"Game .lip not found, loading system default: {fallback}")
                 lip_path = fallback
             else:
                 logger.info(f"No .lip file for game or system (tried {lip_path} and {fallback})")
                 return
 
-        # 4) parser le .lip et vérifier le type (N-Button)
+        # 4) layout actif : jeu si on est en game-mode, sinon système
         try:
-            lip_tree = ET.parse(lip_path)
-            lip_root = lip_tree.getroot()
-
-            # on choisit le layout actif : jeu si on est en game-mode, sinon système
             if self.current_game is not None and self.game_layouts:
                 current_layout = self.game_layouts[self.current_game_idx]['name']
             else:
                 current_layout = self.system_layouts[self.current_layout_idx]['name']
+        except (IndexError, KeyError) as e:
+            logger.error(f"Error parsing .lip header: no active layout ({e})")
+            return
+
+        # 5) une table par panel/joueur : CURRENT et le nombre de boutons dépendent du panel
+        cfg = self.cfg
+        xml_path  = os.path.join(SYSTEMS_DIR, f"{system_name}.xml")
+        xml_mtime = _file_mtime(xml_path)
+        players   = cfg.getint('Panel', 'players_count', fallback=1)
+        dispatch  = {}
+        for panel_id in range(1, players + 1):
+            panel_btn_cnt = cfg.getint(
+                'Panel',
+                f'Player{panel_id}_buttons_count',
+                fallback=cfg.getint('Panel','buttons_count',fallback=0)
+            )
+
+            # 6) cache : relancer le même jeu ne reparse ni le .lip ni le XML système
+            key    = (lip_path, current_layout, panel_btn_cnt, panel_id, SERIAL_PROTO)
+            cached = _LIP_CACHE.get(key)
+            if cached is not None and cached[0] == lip_mtime and cached[1] == xml_mtime:
+                dispatch[panel_id] = cached[2]
+                logger.info(f".lip cache hit for '{os.path.basename(lip_path)}' [{current_layout}] "
+                            f"panel {panel_id} ({len(cached[2])} button triggers)")
+                continue
+
+            dispatch[panel_id] = self._compile_lip(lip_path, xml_path, current_layout,
+                                                   panel_btn_cnt, panel_id)
+            _LIP_CACHE[key] = (lip_mtime, xml_mtime, dispatch[panel_id])
+
+        self.lip_dispatch = dispatch
+
+    def _compile_lip(self, lip_path, xml_path, current_layout, panel_btn_cnt, panel_id):
+        """
+        Parse le .lip et le XML système, et renvoie la table compilée
+        (bouton 0-based, trigger) → (commandes encodées, …) ; {} si rien à charger.
+        """
+        system_name = os.path.splitext(os.path.basename(xml_path))[0]
+
+        # 4) parser le .lip et trouver le bloc <events> du layout actif (N-Button)
+        try:
+            lip_tree = ET.parse(lip_path)
+            lip_root = lip_tree.getroot()
 
             # parcours de tous les <events> pour trouver celui dont name == current_layout
             evroot = None
@@ -1227,7 +2125,7 @@ class LedEventHandler(PatternMatchingEventHandler):
 
             if evroot is None:
                 logger.info(f"No .lip events matching layout '{current_layout}'")
-                return
+                return {}
 
             # on a trouvé le bon bloc <events>
             lip_name = evroot.get('name')           # ex. "Arcade-Shark 6B"
@@ -1236,36 +2134,27 @@ class LedEventHandler(PatternMatchingEventHandler):
             logger.info(f"layout {lip_name} {lip_type} {lip_btn_cnt} ")
         except Exception as e:
             logger.error(f"Error parsing .lip header: {e}")
-            return
+            return {}
 
-        # 5) lire le panelButtons configuré dans config.ini
-        cfg = self.cfg
-        panel_btn_cnt = cfg.getint(
-            'Panel',
-            'Player1_buttons_count',
-            fallback=cfg.getint('Panel','buttons_count',fallback=0)
-        )
-
-        # 6) si ça ne correspond pas, on skippe
+        # 5) si le .lip vise plus de boutons que le panel n’en a, on skippe
         if lip_btn_cnt > panel_btn_cnt:
             logger.info(
                 f"Skipping .lip events: .lip is for {lip_btn_cnt}-Button "
                 f"but current panel has {panel_btn_cnt} buttons"
             )
-            return
+            return {}
 
-        # 7) charger le layout correspondant dans systems/<system_name>.xml
-        xml_path = os.path.join(SYSTEMS_DIR, f"{system_name}.xml")
+        # 6) charger le layout correspondant dans systems/<system_name>.xml
         try:
             layout = ET.parse(xml_path).find(f".//layout[@panelButtons='{lip_btn_cnt}']")
             if layout is None:
                 logger.warning(f"No layout[@panelButtons={lip_btn_cnt}] in {system_name}.xml")
-                return
+                return {}
         except Exception as e:
             logger.error(f"Error loading system XML: {e}")
-            return
+            return {}
 
-        # 8) construire label→physical
+        # 7) construire label→physical
         label_to_phys = {'JOY': None}
         for btn in layout.findall('button'):
             phys  = int(btn.get('physical'))
@@ -1273,7 +2162,8 @@ class LedEventHandler(PatternMatchingEventHandler):
             label = idn if idn in ('START','COIN','JOY') else f"B{phys}"
             label_to_phys[label] = phys
 
-        # 9) extraire les <event> et peupler self.lip_events
+        # 8) compiler les <event> en table (bouton, trigger) → commandes pré-encodées
+        dispatch: Dict[Tuple[int, str], List[bytes]] = {}
         count = 0
         for ev in evroot.findall('event'):
             b   = ev.get('button','').upper()               # ex. "B5"
@@ -1283,161 +2173,240 @@ class LedEventHandler(PatternMatchingEventHandler):
                 logger.info(f"Skipping .lip event for unknown label '{b}'")
                 continue
 
-            # chaque <macro> dans cet <event>
+            # chaque <macro> dans cet <event>, dans l’ordre du fichier
+            cmds = dispatch.setdefault((phys_src - 1, trg), [])
             for macro in ev.findall('macro'):
-                mtype = macro.get('type','').lower()
-                if mtype == 'set_panel_colors':
-                    arg = macro.find('.//colors').text.strip()
-                    entry = {
-                        'id':      phys_src-1,
-                        'trigger': trg,
-                        'macro':   'set_panel_colors',
-                        'arg':     arg
-                    }
-                if mtype == 'restore_panel':
-                    arg = macro.find('.//panel').text.strip()
-                    entry = {
-                        'id':      phys_src-1,
-                        'trigger': trg,
-                        'macro':   'restore_panel',
-                        'arg':     arg
-                    }
-                if mtype == 'set_button':
-                    # couleur par bouton
-                    # le texte est du type "CURRENT,B6:BLACK;" ou plusieurs mappings séparés par ';'
-                    raw = macro.find('color').text.strip().rstrip(';')
-                    # on retire le préfixe "CURRENT,"
-                    _, mapping = raw.split(',',1)      # mapping == "B6:BLACK"
-                    target, color = mapping.split(':',1)
-                    entry = {
-                        'id':      phys_src-1,
-                        'trigger': trg,
-                        'macro':   'set_button',
-                        'target':  target,   # ex. "B6"
-                        'color':   color     # ex. "BLACK"
-                    }
-                if mtype == 'blink_button':
-                    # couleur par bouton
-                    # le texte est du type "CURRENT,B6:BLACK;" ou plusieurs mappings séparés par ';'
-                    raw = macro.find('color').text.strip().rstrip(';')
-                    # on retire le préfixe "CURRENT,"
-                    _, mapping = raw.split(',',1)      # mapping == "B6:BLACK"
-                    target, color1, color2, timecolor1, timecolor2 = mapping.split(',',5)
-                    entry = {
-                        'id':      phys_src-1,
-                        'trigger': trg,
-                        'macro':   'blink_button',
-                        'target':  target,   # ex. "B6"
-                        'color1':   color1,     # ex. "BLACK"
-                        'color2':   color2,     # ex. "BLACK"
-                        'timecolor1':   timecolor1,     # ex. "200"
-                        'timecolor2':   timecolor2     # ex. "200"
-                    }
-                #else:
-                    # type de macro inconnu → on skippe
-                    #continue
-
-                self.lip_events.append(entry)
-                logger.info(f"Loaded .lip event: {entry}")
-                count += 1
-
-        logger.info(f"Total .lip events loaded: {count}")
-
-
-def joystick_listener(handler):
+                try:
+                    lines = compile_lip_macro(macro, panel_id)
+                except Exception as e:
+                    logger.warning(f"Skipping malformed .lip macro on {b}/{trg}: {e}")
+                    continue
+                for line in lines:
+                    cmds.append(encode_command(line + '\n', SERIAL_PROTO))
+                    logger.info(f"Loaded .lip macro {b}/{trg}: {line}")
+                    count += 1
+
+        compiled = {key: tuple(cmds) for key, cmds in dispatch.items() if cmds}
+        logger.info(f"Total .lip commands loaded: {count} ({len(compiled)} button triggers)")
+        return compiled
+
+
+# Cache des .lip compilés, conservé d’un lancement à l’autre :
+# (chemin .lip, layout actif, nb boutons panel, panel_id, protocole) → (mtime .lip, mtime XML système, table)
+_LIP_CACHE: Dict[Tuple[str, str, int, int, int], Tuple[float, Optional[float], Dict]] = {}
+
+def _file_mtime(path: str) -> Optional[float]:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+def compile_lip_macro(macro, panel_id: int) -> List[str]:
+    """
+    Traduit une <macro> .lip en commande(s) texte pour le Pico,
+    avec CURRENT déjà remplacé par le n° de panel. Type inconnu → [].
+    """
+    pid   = str(panel_id)
+    mtype = macro.get('type','').lower()
+
+    if mtype == 'set_panel_colors':
+        arg = macro.find('.//colors').text.strip()
+        return [f"SetPanelColors={arg.replace('CURRENT', pid)}"]
+
+    if mtype == 'restore_panel':
+        arg = macro.find('.//panel').text.strip()
+        return [f"RestorePanel={arg.replace('CURRENT', pid)}"]
+
+    if mtype == 'set_button':
+        # "CURRENT,B6:BLACK;" ou plusieurs mappings séparés par ';'
+        raw = macro.find('color').text.strip().rstrip(';')
+        panel, mappings = raw.split(',', 1)
+        panel = panel.strip().replace('CURRENT', pid)
+        out = []
+        for mapping in mappings.split(';'):
+            if ':' not in mapping:
+                continue
+            target, color = mapping.split(':', 1)
+            out.append(f"SetButton={panel},{target.strip()},{color.strip()}")
+        return out
+
+    if mtype == 'blink_button':
+        # "CURRENT,B3,PINK,BLACK,300,300"
+        raw = macro.find('color').text.strip().rstrip(';')
+        panel, mapping = raw.split(',', 1)
+        target, color1, color2, timecolor1, timecolor2 = mapping.split(',', 4)
+        return [
+            f"BlinkButton={panel.strip().replace('CURRENT', pid)},"
+            f"{target},{color1},{color2},{timecolor1},{timecolor2}"
+        ]
+
+    logger.info(f"Unknown .lip macro type '{mtype}', skipped")
+    return []
+
+
+class InputRouter:
+    """
+    Associe chaque joystick (instance_id) au panel de son joueur.
+    Ordre de résolution : GUID puis nom déclarés pour « INPUT P<n> » dans es_settings.cfg,
+    à défaut l’ordre des <inputConfig> joystick d’es_input.cfg, puis le premier panel libre.
+    """
+
+    def __init__(self, players: int):
+        self.players  = max(1, players)
+        self.lock     = threading.Lock()
+        self.assigned: Dict[int, int] = {}                   # iid → panel
+        self.expected: List[Tuple[int, str, str]] = []       # (panel, guid, nom) attendus
+        self._load_expected()
+
+    def _load_expected(self):
+        for p in range(1, self.players + 1):
+            guid = name = ''
+            if _settings_root is not None:
+                for s in _settings_root.findall('string'):
+                    n = s.get('name', '')
+                    if n == f"INPUT P{p}GUID":
+                        guid = s.get('value', '')
+                    elif n == f"INPUT P{p}NAME":
+                        name = s.get('value', '')
+            if guid or name:
+                self.expected.append((p, guid.lower(), name))
+
+        if not self.expected:
+            try:
+                root = ET.parse(ES_INPUT_CFG).getroot()
+                pads = [ic for ic in root.findall('inputConfig') if ic.get('type') == 'joystick']
+                for p, ic in enumerate(pads[:self.players], start=1):
+                    self.expected.append((p, ic.get('deviceGUID', '').lower(), ic.get('deviceName', '')))
+            except Exception as e:
+                logger.debug(f"InputRouter: es_input.cfg not usable ({e})")
+
+        for p, guid, name in self.expected:
+            logger.info(f"InputRouter: panel {p} ← guid='{guid}' name='{name}'")
+
+    def assign(self, iid: int, guid: str = '', name: str = '') -> int:
+        guid = (guid or '').lower()
+        with self.lock:
+            if iid in self.assigned:
+                return self.assigned[iid]
+            used  = set(self.assigned.values())
+            panel = None
+            for p, g, _ in self.expected:
+                if p not in used and g and g == guid:
+                    panel = p
+                    break
+            if panel is None:
+                for p, _, n in self.expected:
+                    if p not in used and n and n == name:
+                        panel = p
+                        break
+            if panel is None:
+                # premier panel libre ; au-delà de players_count, on partage le panel 1
+                panel = next((p for p in range(1, self.players + 1) if p not in used), 1)
+            self.assigned[iid] = panel
+            return panel
+
+    def release(self, iid: int) -> Optional[int]:
+        with self.lock:
+            return self.assigned.pop(iid, None)
+
+    def panel_for(self, iid: int) -> Optional[int]:
+        return self.assigned.get(iid)
+
+
+def joystick_listener(handler, router=None, backend=None):
     import time
-    import pygame
-    from pygame.locals import JOYBUTTONDOWN, JOYBUTTONUP, JOYHATMOTION, JOYAXISMOTION
-
-    # Initialisation
-    pygame.init()
-    pygame.joystick.init()
-    logger.info("▶ joystick_listener thread started")
-
-    # Détection des joysticks
-    joysticks = []
-    count = pygame.joystick.get_count()
-    logger.info(f"Detected {count} joystick(s)")
-    for i in range(count):
-        js = pygame.joystick.Joystick(i)
-        js.init()
-        joysticks.append(js)
-        logger.info(f"  • Initialized Joystick #{i}: {js.get_name()} (instance_id={js.get_instance_id()})")
-
-    # États des boutons
-    states = {
-        js.get_instance_id(): {btn: False for btn in range(js.get_numbuttons())}
-        for js in joysticks
-    }
-    # États des hats
-    hat_states = {js.get_instance_id(): (0, 0) for js in joysticks}
+    from LPInputBackends import create_input_backend
+
+    # Backend d’entrées : pygame, evdev (Linux) ou synthétique (tests)
+    if backend is None:
+        backend = create_input_backend(_read_panel_cfg().get('Input', 'backend', fallback='auto'))
+    backend.open()
+    logger.info(f"▶ joystick_listener thread started (backend={backend.name})")
+
+    if router is None:
+        router = InputRouter(_read_panel_cfg().getint('Panel', 'players_count', fallback=1))
+
+    # Joysticks connus, indexés par instance_id (branchés au démarrage ou à chaud)
+    states     = {}   # iid → bytearray, 1 octet par bouton (taille fixe)
+    hat_states = {}   # iid → (x, y)
+    panels     = {}   # iid → panel / joueur (attribué par le router)
+
+    def attach(iid, info):
+        if iid in states:
+            return
+        states[iid]     = bytearray(info.buttons)
+        hat_states[iid] = (0, 0)
+        panels[iid]     = router.assign(iid, info.guid, info.name)
+        logger.info(f"  • Joystick {info.name} "
+                    f"(instance_id={iid}, buttons={info.buttons}) → panel {panels[iid]}")
+
+    def detach(iid):
+        known = states.pop(iid, None) is not None
+        hat_states.pop(iid, None)
+        panel = panels.pop(iid, None)
+        router.release(iid)
+        if known:
+            logger.info(f"  • Joystick instance_id={iid} removed (panel {panel} freed)")
+
+    def button_state(iid, button):
+        # None si device ou bouton inconnu, sinon True/False
+        st = states.get(iid)
+        if st is None or button >= len(st):
+            return None
+        return bool(st[button])
 
     HOTKEY_ID = 8      # id du bouton "Start" dans es_input.cfg
     AXIS_THRESHOLD = 0.5
+    wait_s = LISTENER_WAIT_MS / 1000.0
 
     while True:
-        for ev in pygame.event.get():
+        # Attente bloquante (plus de boucle active) ; le timeout garde le thread vivant
+        for ev in backend.wait(wait_s):
             # Debug complet
-            logger.debug(f"← pygame event: {ev}")
+            logger.debug(f"← input event: {ev}")
 
-            # — Boutons press/release —
-            if ev.type in (JOYBUTTONDOWN, JOYBUTTONUP):
-                iid     = ev.instance_id
-                pressed = (ev.type == JOYBUTTONDOWN)
-                prev    = states[iid].get(ev.button, None)
-                states[iid][ev.button] = pressed
+            # — Branchement / débranchement à chaud —
+            if ev.kind == 'added':
+                attach(ev.device, ev.value)
+                continue
+            if ev.kind == 'removed':
+                detach(ev.device)
+                continue
 
-                logger.info(f"  • Panel {handler.panel_id} Button {ev.button+1} "
+            # — Boutons press/release —
+            if ev.kind == 'button':
+                iid     = ev.device
+                button  = ev.index
+                pressed = bool(ev.value)
+                prev    = button_state(iid, button)
+                if prev is not None:
+                    states[iid][button] = pressed
+                panel   = panels.get(iid)
+
+                logger.info(f"  • Panel {panel} Button {button+1} "
                             f"{'pressed' if pressed else 'released'}")
 
-                # Si en game-start, traiter .lip
+                # Si en game-start, traiter .lip du panel de ce joueur : une recherche, une écriture
                 if handler.listening and prev is not None and prev != pressed:
-                    for le in handler.lip_events:
-                        logger.debug(f"    → Checking .lip event {le}")
-                        if le['id'] == ev.button and le['trigger'] == ('press' if pressed else 'release'):
-
-                            # --- nouvelle prise en charge set_button ---
-                            if le['macro'] == 'set_button':
-                                cmd = (
-                                    f"SetButton={handler.panel_id},"
-                                    f"{le['target']},{le['color']}"
-                                )
-                                logger.info(f"    ➡ Executing macro: {cmd}")
-                                safe_serial_write(handler.ser, cmd + '\n', label="joystick")
-                                # on ne traite pas les autres macros pour ce même event
-                                continue
-                            if le['macro'] == 'blink_button':
-                                #BlinkButton=1,B3,PINK,BLACK,300,300
-                                cmd = (
-                                    f"BlinkButton={handler.panel_id},"
-                                    f"{le['target']},{le['color1']},{le['color2']},{le['timecolor1']},{le['timecolor2']}"
-                                )
-                                logger.info(f"    ➡ Executing macro: {cmd}")
-                                safe_serial_write(handler.ser, cmd + '\n', label="joystick")
-                                # on ne traite pas les autres macros pour ce même event
-                                continue
-                            # --- macro couleur globale ---
-                            if le['macro'] == 'set_panel_colors':
-                                mapping = le['arg'].replace('CURRENT', str(handler.panel_id))
-                                cmd     = f"SetPanelColors={mapping}"
-                            else:
-                                panel_arg = le['arg'].replace('CURRENT', str(handler.panel_id))
-                                cmd       = f"RestorePanel={panel_arg}"
-
-                            logger.info(f"    ➡ Executing macro: {cmd}")
-                            safe_serial_write(handler.ser, cmd + '\n', label="joystick")
-                            break
+                    table = handler.lip_dispatch.get(panel)
+                    cmds  = table.get((button, 'press' if pressed else 'release')) if table else None
+                    if cmds:
+                        logger.info(f"    ➡ Executing {len(cmds)} .lip command(s)")
+                        safe_serial_write(handler.ser, b''.join(cmds), label="joystick",
+                                          prio=PRIO_MACRO)
 
             # — Hat (D-pad en hat) —
-            elif ev.type == JOYHATMOTION:
-                iid = ev.instance_id
+            elif ev.kind == 'hat':
+                iid = ev.device
                 x, y = ev.value
-                logger.info(f"UU  • Panel {handler.panel_id} Hat moved → {ev.value}")
+                if iid in hat_states:
+                    hat_states[iid] = (x, y)
+                logger.info(f"UU  • Panel {panels.get(iid)} Hat moved → {ev.value}")
                 # Hotkey + left/right hors game-start
-                if not handler.in_game and states[iid].get(HOTKEY_ID, False):
+                if not handler.in_game and button_state(iid, HOTKEY_ID):
                     if not handler.system_layouts:
                         logging.warning("Aucun layout défini : switch ignoré")
-                        return  # ou return, ou break selon la structure de ta boucle
+                        continue
 
                     if x == -1:
                         handler.current_layout_idx = (handler.current_layout_idx - 1) % len(handler.system_layouts)
@@ -1453,18 +2422,18 @@ def joystick_listener(handler):
 
 
             # — Axis (D-pad en axis 0/1) —
-            elif ev.type == JOYAXISMOTION:
-                iid  = ev.instance_id
-                axis = ev.axis
+            elif ev.kind == 'axis':
+                iid  = ev.device
+                axis = ev.index
                 val  = ev.value
                 # On ne gère que l'axe 0 (gauche/droite)
                 if axis == 0 and abs(val) > AXIS_THRESHOLD:
                     direction = 'Left' if val < 0 else 'Right'
-                    logger.info(f"OO  • Panel {handler.panel_id} Axis0 moved → {direction} ({val:.2f})")
-                    logger.info(f"Joystick listening={handler.listening}, hotkey_pressed={states[iid].get(HOTKEY_ID, False)}")
+                    logger.info(f"OO  • Panel {panels.get(iid)} Axis0 moved → {direction} ({val:.2f})")
+                    logger.info(f"Joystick listening={handler.listening}, hotkey_pressed={bool(button_state(iid, HOTKEY_ID))}")
 
                     # ── On veut uniquement gérer Hotkey+Left/Right hors game-start
-                    if not handler.in_game and states[iid].get(HOTKEY_ID, False):
+                    if not handler.in_game and button_state(iid, HOTKEY_ID):
                         # Si on est dans un menu “jeu” (game-selected) :
                         if handler.current_game is not None:
                             # 1) Sélection des layouts et détermination si on doit enregistrer
@@ -1482,7 +2451,7 @@ def joystick_listener(handler):
                                 logger.info(f"Pas de layout jeu → fallback system-layout {handler.last_system} {handler.current_game}")
                             else:
                                 logger.warning("Aucun layout disponible → abort")
-                                return
+                                continue
 
                             # 2) Initialisation de l’index selon PanelDefaults
                             cfg         = _read_panel_cfg()
@@ -1508,7 +2477,7 @@ def joystick_listener(handler):
                             else:
                                 # choisir le layout en fonction du nombre de boutons du panel concerné
                                 cfg      = _read_panel_cfg()
-                                panel_id = handler.panel_id
+                                panel_id = panels.get(iid) or handler.panel_id
                                 # récupère playerN_buttons_count ou, à défaut, buttons_count
                                 btn_cnt  = cfg.getint(
                                     'Panel',
@@ -1539,14 +2508,14 @@ def joystick_listener(handler):
 
                             # 4) Envoi du SetPanelColors
                             cfg         = _read_panel_cfg()
-                            panels      = '|'.join(str(i) for i in range(
+                            panel_list  = '|'.join(str(i) for i in range(
                                 1,
                                 cfg.getint('Panel','players_count',fallback=1) + 1
                             ))
                             entry       = layouts[idx]
                             mapping     = ';'.join(f"{lbl}:{clr}" for lbl, clr in entry['buttons'])
-                            cmd         = f"SetPanelColors={panels},{mapping},default=yes\n"
-                            safe_serial_write(handler.ser, cmd + '\n', label="joystick")
+                            cmd         = f"SetPanelColors={panel_list},{mapping},default=yes\n"
+                            safe_serial_write(handler.ser, cmd + '\n', label="joystick", key='layout')
                             name_or_type = entry.get('name') or entry.get('type')
                             logger.info(f"    ➡ Sent (layout '{name_or_type}')")
 
@@ -1564,7 +2533,7 @@ def joystick_listener(handler):
 
 
                             # 6) Popup puis retour au début de la boucle
-                            show_popup_tk(name_or_type)
+                            show_popup_tk(name_or_type, preview=entry.get('shapes'))
                             continue
 
                         # — Sinon, on retombe sur la logique “système” (pas de jeu actif) —
@@ -1592,30 +2561,17 @@ def joystick_listener(handler):
                             logger.info("    ↷ Hotkey+Axis-Right → next system-layout")
 
                         handler._send_current_layout()
-                        name = handler.system_layouts[handler.current_layout_idx]['name']
-                        show_popup_tk(name)
+                        entry = handler.system_layouts[handler.current_layout_idx]
+                        show_popup_tk(entry['name'], preview=entry.get('shapes'))
 
                         #time.sleep(0.01)
                         continue
-import time
-orig_on_modified = LedEventHandler.on_modified
-def profiled_on_modified(self, event):
-    t0 = time.perf_counter()
-    orig_on_modified(self, event)
-    dt = (time.perf_counter() - t0)*1000
-    logger.warning(f"[PROFILE] on_modified took {dt:.1f} ms")
-LedEventHandler.on_modified = profiled_on_modified
-
 def main():
     cfg = _read_panel_cfg()
 
-    pico = find_pico()
-    if not pico:
+    ser, reader = connect_pico()
+    if ser is None:
         sys.exit(1)
-    ser = serial.Serial(pico, BAUDRATE, timeout=1, write_timeout=0)
-
-    time.sleep(1)
-    logger.info(f"Connected to Pico on {pico} @ {BAUDRATE}")
 
     panel_id = 1
     btn_cnt  = cfg.getint('Panel','Player1_buttons_count',
@@ -1624,37 +2580,49 @@ def main():
     start_ch = cfg.get('Panel','panel_button_start').rstrip(';')
     joy_ch   = cfg.get('Panel','panel_button_joy').rstrip(';')
 
+    # Tout l’envoi passe désormais par un seul thread d’écriture
+    writer = SerialWriter(ser)
+    # Pico débranché / redémarré : reconnexion et resynchronisation automatiques
+    supervisor = SerialSupervisor(writer, ser, reader)
+
     init_cmd = f"INIT=panel={panel_id},count={btn_cnt},select={coin_ch},start={start_ch},joy={joy_ch}\n"
-    try:
-        ser.write(init_cmd.encode('utf-8'))
-        #ser.flush()
-        logger.info(f"➡ Sent INIT: {init_cmd.strip()}")
-    except Exception as e:
-        logger.error(f"Failed to send INIT: {e}")
+    writer.submit(init_cmd, PRIO_LAYOUT, label="INIT")
+    logger.info(f"➡ Sent INIT: {init_cmd.strip()}")
 
     logger.info(f"Config: players={cfg.getint('Panel','players_count',fallback=1)}, Player1_buttons_count={btn_cnt}")
-    led_handler = LedEventHandler(ser, panel_id)
-    observer = Observer(timeout=0.1)  # passe de 1 s à 100 ms
-    observer.schedule(led_handler, os.path.dirname(ES_EVENT_FILE), recursive=False)
-    observer.start()
-    logger.info(f"Observer class   : {type(observer).__name__}")
-    logger.info(f"Emitter class    : {observer._emitter_class.__name__}")
-
-    t = threading.Thread(target=joystick_listener, args=(led_handler,), daemon=True)
+    led_handler = LedEventHandler(writer, panel_id)
+    supervisor.on_protocol_change = led_handler.reload_lip
+
+    # Un seul watcher sur ESEvent.arg, décodé une fois : LEDs/.rmp/.lip et cfg MAME
+    # (LPInputsPush importé ici, après notre basicConfig : le sien ne s’applique pas)
+    import LPInputsPush
+    LPInputsPush.set_paths(retrobat_root, BASE_DIR)
+    LPInputsPush.logger.setLevel(logger.getEffectiveLevel())
+    bus = EventBus(ES_EVENT_FILE)
+    bus.subscribe('led', led_handler.on_es_event)
+    bus.subscribe('mame-cfg', LPInputsPush.GameHandler().on_es_event, kinds=LPInputsPush.MAME_CFG_EVENTS)
+    bus.start()
+
+    # Aperçus OSD des layouts système (ceux des jeux sont rendus à la demande) ; déjà sur disque → simple relecture
+    def _previews():
+        logger.info(f"[Preview] {render_all(SYSTEMS_DIR, recursive=False)}")
+    threading.Thread(target=_previews, name="Previews", daemon=True).start()
+
+    router = InputRouter(cfg.getint('Panel', 'players_count', fallback=1))
+    t = threading.Thread(target=joystick_listener, args=(led_handler, router), daemon=True)
     t.start()
-    threading.Thread(target=monitor_serial_buffer, args=(ser,), daemon=True).start()
-    threading.Thread(target=read_serial_feedback, args=(ser,), daemon=True).start()
 
     logger.info("Led Panel Color Manager running…")
     try:
         while True:
             time.sleep(0.1)
     except KeyboardInterrupt:
-        observer.stop()
-        observer.stop()
-        observer.stop()
-    observer.join()
-    ser.close()
+        pass
+    bus.stop()
+    logger.info(f"Event bus: {bus.summary()}")
+    supervisor.stop()
+    writer.close()
+    supervisor.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,338 @@
+# LPExtractInputs.py — <game>_inputs.cfg du romset : MAME + dump_inputs.lua, plusieurs ROMs en parallèle
+# -----------------------------------------------------------------------------
+# Remplace la boucle séquentielle de extract_and_generate_cfg : MAME est lancé
+# une fois par ROM avec dump_inputs.lua en -autoboot_script, le script écrit
+# dump_inputs.txt (lignes PORT: / FIELD:) dans le dossier courant puis quitte.
+#   - chaque job a son propre dossier de travail (dump_inputs.txt, cfg et nvram
+#     de MAME) : N instances en parallèle ne se marchent pas dessus et le vrai
+#     bios/mame/cfg n’est pas touché par le lancement ;
+#   - délai maximum par ROM : une ROM qui bloque (bios manquant, écran
+#     d’avertissement…) est tuée sans retenir la file ;
+#   - une ROM dont le _inputs.cfg est plus récent que le .zip/.7z est sautée,
+#     une ROM en échec n’est retentée que si son archive change (--retry-failed) ;
+#   - les lignes FIELD: deviennent des <port tag type mask defvalue> (format lu
+#     par LPInputsPush.load_mame_ports).
+# L’émulateur est une simple ligne de commande (--emulator) : un script qui écrit
+# un dump préparé suffit pour tester sans MAME (voir LPBench.py extract).
+# -----------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import shlex
+import shutil
+import logging
+import tempfile
+import subprocess
+import multiprocessing
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import LPInputsPush
+
+logger = logging.getLogger(__name__)
+
+# ——— Paths (RetroBat : plugins/LedPanelManager/, comme LPInputsPush) ———
+PLUGIN_DIR       = os.path.dirname(os.path.abspath(__file__))
+RETROBAT_ROOT    = os.path.abspath(os.path.join(PLUGIN_DIR, '..', '..'))
+ROMS_DIR         = os.path.join(RETROBAT_ROOT, 'roms', 'mame')
+MAME_EXE_NAMES   = ('mame.exe', 'mame64.exe', 'mame')
+DUMP_LUA         = os.path.join(PLUGIN_DIR, 'dump_inputs.lua')
+
+DUMP_NAME        = 'dump_inputs.txt'                      # écrit par dump_inputs.lua dans le dossier courant
+INPUTS_SUFFIX    = '_inputs.cfg'
+ROM_EXTENSIONS   = ('.zip', '.7z')
+EXTRACT_TIMEOUT  = 60.0                                   # s par ROM (démarrage MAME + script)
+FAILURES_NAME    = 'ledpanel_extract_failures.json'       # dans MAME_CFG_DIR
+EXTRACT_LOG_NAME = 'extract_inputs.log'                   # à côté de config.ini
+MAME_ARGS        = ('-video', 'none', '-sound', 'none', '-nothrottle', '-skip_gameinfo', '-window')
+
+
+def default_emulator() -> List[str]:
+    for name in MAME_EXE_NAMES:
+        path = os.path.join(RETROBAT_ROOT, 'emulators', 'mame', name)
+        if os.path.exists(path):
+            return [path]
+    return [os.path.join(RETROBAT_ROOT, 'emulators', 'mame', MAME_EXE_NAMES[0])]
+
+
+def split_command(cmd: str) -> List[str]:
+    """--emulator "C:\\…\\mame.exe" ou "python stub.py" → argv (guillemets Windows retirés)."""
+    return [a.strip('"') for a in shlex.split(cmd, posix=(os.name != 'nt'))]
+
+
+# ——— dump_inputs.txt → <port> ———
+class DumpField(NamedTuple):
+    name: str       # field.name MAME ("P1 Button 1", "1 Player Start", "Coin 1"…)
+    type: str       # field.type tel qu’écrit par le script (non utilisé dans le cfg)
+    port: str       # tag du port (":IN0")
+    mask: int
+    defvalue: int
+
+
+def _int(text) -> Optional[int]:
+    try:
+        return int(text)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_dump(text: str) -> List[DumpField]:
+    """
+    Lignes FIELD:name|type|port|mask[|defvalue]. Sans defvalue (ancien
+    dump_inputs.lua), on prend le mask : les entrées arcade sont actives à 0.
+    Lignes illisibles ignorées (avec un warning).
+    """
+    fields = []
+    for line in text.splitlines():
+        if not line.startswith('FIELD:'):
+            continue
+        body = line[len('FIELD:'):]
+        parts = body.rsplit('|', 4)
+        if len(parts) == 5 and _int(parts[3]) is not None and _int(parts[4]) is not None:
+            name, ftype, port, mask, defvalue = parts
+            defvalue = int(defvalue)
+        else:
+            parts = body.rsplit('|', 3)
+            if len(parts) != 4 or _int(parts[3]) is None:
+                logger.warning(f"Ligne FIELD illisible: {line!r}")
+                continue
+            name, ftype, port, mask = parts
+            defvalue = int(mask)
+        if name.strip() and port:
+            fields.append(DumpField(name.strip(), ftype, port, int(mask), defvalue))
+    return fields
+
+
+def field_type(name: str) -> str:
+    """Type du <port> attendu par LPInputsPush : le nom du field en majuscules, espaces → _ (P1_BUTTON_1)."""
+    return '_'.join(name.upper().split())
+
+
+def build_inputs_cfg(game: str, fields: List[DumpField]) -> ET.ElementTree:
+    root = ET.Element('mameconfig', version='10')
+    inp = ET.SubElement(ET.SubElement(root, 'system', name=game), 'input')
+    for f in fields:
+        ET.SubElement(inp, 'port', tag=f.port, type=field_type(f.name), mask=str(f.mask), defvalue=str(f.defvalue))
+    LPInputsPush.indent(root)
+    return ET.ElementTree(root)
+
+
+def write_inputs_cfg(game: str, fields: List[DumpField], cfg_dir: str) -> str:
+    """Écrit <game>_inputs.cfg d’un coup (fichier temporaire puis remplacement)."""
+    path = os.path.join(cfg_dir, f"{game}{INPUTS_SUFFIX}")
+    tmp = f"{path}.{os.getpid()}.tmp"
+    build_inputs_cfg(game, fields).write(tmp, encoding='utf-8', xml_declaration=True)
+    os.replace(tmp, path)
+    return path
+
+
+# ——— Sélection des ROMs ———
+def find_roms(roms_dir: str, games=None) -> Dict[str, str]:
+    """jeu → archive (la plus récente si le jeu existe en .zip et en .7z)."""
+    roms: Dict[str, str] = {}
+    try:
+        entries = os.listdir(roms_dir)
+    except FileNotFoundError:
+        logger.error(f"Dossier des ROMs introuvable: {roms_dir}")
+        return roms
+    wanted = set(games) if games else None
+    for entry in sorted(entries):
+        game, ext = os.path.splitext(entry)
+        if ext.lower() not in ROM_EXTENSIONS or (wanted is not None and game not in wanted):
+            continue
+        path = os.path.join(roms_dir, entry)
+        if game not in roms or os.path.getmtime(path) > os.path.getmtime(roms[game]):
+            roms[game] = path
+    return roms
+
+
+def _rom_sig(path) -> list:
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def load_failures(cfg_dir: str) -> Dict[str, Dict]:
+    path = os.path.join(cfg_dir, FAILURES_NAME)
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Échecs précédents illisibles ({path}: {e}), toutes les ROMs seront retentées")
+        return {}
+
+
+def save_failures(cfg_dir: str, failures: Dict[str, Dict]):
+    path = os.path.join(cfg_dir, FAILURES_NAME)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(failures, f, indent=0, sort_keys=True)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning(f"Cannot write {path}: {e}")
+
+
+def plan_extraction(roms: Dict[str, str], cfg_dir: str, failures: Dict[str, Dict],
+                    force: bool = False, retry_failed: bool = False) -> Tuple[List[str], Dict[str, str]]:
+    """(jeux à extraire, jeu → raison du saut : 'up-to-date' | 'failed-before')."""
+    todo, skipped = [], {}
+    for game, rom in roms.items():
+        if not force:
+            try:
+                if os.path.getmtime(os.path.join(cfg_dir, f"{game}{INPUTS_SUFFIX}")) >= os.path.getmtime(rom):
+                    skipped[game] = 'up-to-date'
+                    continue
+            except FileNotFoundError:
+                pass
+            failed = failures.get(game)
+            if not retry_failed and failed and failed.get('rom') == _rom_sig(rom):
+                skipped[game] = 'failed-before'
+                continue
+        todo.append(game)
+    return todo, skipped
+
+
+# ——— Un job : MAME dans son propre dossier, délai maximum ———
+def extract_game(game: str, rom: str, emulator: List[str], cfg_dir: str, lua: str,
+                 timeout: float = EXTRACT_TIMEOUT, rompath: Optional[str] = None) -> Dict:
+    """Lance l’émulateur pour une ROM et écrit <game>_inputs.cfg. Renvoie un résultat pour le journal."""
+    result = {'game': game, 'status': 'failed', 'fields': 0, 'error': None}
+    t0 = time.perf_counter()
+    workdir = tempfile.mkdtemp(prefix=f"lp_{game}_")
+    cmd = [*emulator, game, '-rompath', rompath or os.path.dirname(rom), '-autoboot_script', lua,
+           '-cfg_directory', workdir, '-nvram_directory', workdir, *MAME_ARGS]
+    try:
+        proc = subprocess.run(cmd, cwd=workdir, timeout=timeout, stdin=subprocess.DEVNULL,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                              creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0))
+        dump = os.path.join(workdir, DUMP_NAME)
+        if not os.path.exists(dump):
+            err = proc.stderr.decode('utf-8', errors='replace').strip().splitlines()
+            result['error'] = f"no {DUMP_NAME} (exit {proc.returncode}" + (f": {err[-1]})" if err else ")")
+        else:
+            with open(dump, encoding='utf-8', errors='replace') as f:
+                fields = parse_dump(f.read())
+            if not fields:
+                result['status'], result['error'] = 'empty', f"{DUMP_NAME} without FIELD lines"
+            else:
+                write_inputs_cfg(game, fields, cfg_dir)
+                result['status'], result['fields'] = 'extracted', len(fields)
+    except subprocess.TimeoutExpired:
+        result['status'], result['error'] = 'timeout', f"killed after {timeout:g} s"
+    except OSError as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    result['ms'] = round((time.perf_counter() - t0) * 1000)
+    return result
+
+
+# ——— Ordonnanceur : N jobs à la fois (threads : ils ne font qu’attendre MAME) ———
+def extract_all(jobs: Optional[int] = None, timeout: float = EXTRACT_TIMEOUT, games=None,
+                force: bool = False, retry_failed: bool = False, emulator: Optional[List[str]] = None,
+                roms_dir: Optional[str] = None, rompath: Optional[str] = None, lua: Optional[str] = None,
+                log_path: Optional[str] = None) -> Dict:
+    """
+    Extrait les <game>_inputs.cfg manquants ou plus vieux que leur ROM, jobs ROMs à
+    la fois. Écrit un journal (totaux + une ligne par ROM en échec) et renvoie les stats ;
+    stats['extracted_games'] : jeux dont le _inputs.cfg vient d’être écrit.
+    """
+    t0 = time.perf_counter()
+    cfg_dir  = LPInputsPush.MAME_CFG_DIR
+    emulator = emulator or default_emulator()
+    lua      = os.path.abspath(lua or DUMP_LUA)
+    roms     = find_roms(roms_dir or ROMS_DIR, games)
+    os.makedirs(cfg_dir, exist_ok=True)
+    failures = load_failures(cfg_dir)
+    todo, skipped = plan_extraction(roms, cfg_dir, failures, force, retry_failed)
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(todo) or 1))
+    logger.info(f"{len(roms)} ROM(s): {len(todo)} to extract, {len(skipped)} skipped — {jobs} job(s), "
+                f"timeout {timeout:g} s, emulator {' '.join(emulator)}")
+
+    stats = {'roms': len(roms), 'extracted': 0, 'up-to-date': 0, 'failed-before': 0,
+             'failed': 0, 'timeout': 0, 'empty': 0, 'jobs': jobs, 'extracted_games': []}
+    for reason in skipped.values():
+        stats[reason] += 1
+    report = []
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='Extract') as pool:
+        futures = [pool.submit(extract_game, g, roms[g], emulator, cfg_dir, lua, timeout, rompath) for g in todo]
+        try:
+            for done, future in enumerate(futures, 1):
+                res = future.result()
+                game = res['game']
+                stats[res['status']] += 1
+                if res['status'] == 'extracted':
+                    stats['extracted_games'].append(game)
+                    failures.pop(game, None)
+                    logger.debug(f"[{done}/{len(todo)}] {game}: {res['fields']} field(s) in {res['ms']} ms")
+                else:
+                    failures[game] = {'rom': _rom_sig(roms[game]), 'status': res['status'], 'error': res['error']}
+                    report.append(f"{res['status'].upper():8} {game}: {res['error']}")
+                    logger.warning(f"[{done}/{len(todo)}] {game}: {res['status']} — {res['error']}")
+        except KeyboardInterrupt:
+            for future in futures:
+                future.cancel()
+            raise
+        finally:
+            save_failures(cfg_dir, failures)
+    stats['ms'] = round((time.perf_counter() - t0) * 1000)
+
+    summary = (f"{stats['roms']} ROM(s): {stats['extracted']} extracted, {stats['up-to-date']} up to date, "
+               f"{stats['failed-before']} skipped (failed before), {stats['failed']} failed, "
+               f"{stats['timeout']} timed out, {stats['empty']} empty — {stats['ms']} ms, {jobs} job(s)")
+    logger.info(summary)
+    log_path = log_path or os.path.join(os.path.dirname(LPInputsPush.PANEL_CONFIG_INI), EXTRACT_LOG_NAME)
+    try:
+        with open(log_path, 'w', encoding='utf-8') as f:
+            f.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {summary}\n")
+            f.write(f"emulator: {' '.join(emulator)}\nroms: {roms_dir or ROMS_DIR}\ncfg: {cfg_dir}\n\n")
+            f.write('\n'.join(report) + ('\n' if report else ''))
+    except OSError as e:
+        logger.warning(f"Cannot write {log_path}: {e}")
+    stats['log'] = log_path
+    return stats
+
+
+def main():
+    import argparse
+    global ROMS_DIR
+    parser = argparse.ArgumentParser(description="Extraction des <game>_inputs.cfg (MAME + dump_inputs.lua)")
+    parser.add_argument('--jobs', type=int, default=None, help="instances MAME simultanées (défaut : CPU)")
+    parser.add_argument('--timeout', type=float, default=EXTRACT_TIMEOUT, help="délai maximum par ROM (s)")
+    parser.add_argument('--games', default=None, help="liste de jeux séparés par des virgules")
+    parser.add_argument('--force', action='store_true', help="ré-extrait même les _inputs.cfg à jour")
+    parser.add_argument('--retry-failed', action='store_true', help="retente les ROMs en échec au dernier passage")
+    parser.add_argument('--generate', action='store_true',
+                        help="puis génère les <game>.cfg des jeux extraits (LPInputsPush --batch)")
+    parser.add_argument('--emulator', default=None, help="ligne de commande de MAME (ou d’un émulateur de test)")
+    parser.add_argument('--roms-dir', default=ROMS_DIR)
+    parser.add_argument('--rompath', default=None, help="-rompath de MAME (défaut : dossier de la ROM)")
+    parser.add_argument('--lua', default=DUMP_LUA)
+    parser.add_argument('--log', default=None, help=f"résumé (défaut : {EXTRACT_LOG_NAME} à côté de config.ini)")
+    parser.add_argument('--cfg-dir', default=LPInputsPush.MAME_CFG_DIR)
+    parser.add_argument('--config', default=LPInputsPush.PANEL_CONFIG_INI)
+    args = parser.parse_args()
+    ROMS_DIR = args.roms_dir
+    LPInputsPush.MAME_CFG_DIR, LPInputsPush.PANEL_CONFIG_INI = args.cfg_dir, args.config
+
+    games = [g.strip() for g in args.games.split(',') if g.strip()] if args.games else None
+    emulator = split_command(args.emulator) if args.emulator else None
+    stats = extract_all(args.jobs, args.timeout, games, args.force, args.retry_failed, emulator,
+                        args.roms_dir, args.rompath, args.lua, args.log)
+    print(f"{stats['extracted']} extracted, {stats['up-to-date']} up to date, {stats['failed-before']} failed before, "
+          f"{stats['failed']} failed, {stats['timeout']} timed out in {stats['ms']} ms → {stats['log']}")
+    if args.generate and stats['extracted_games']:
+        gen = LPInputsPush.batch_generate(args.jobs, games=stats['extracted_games'])
+        print(f"{gen['written']} cfg written, {gen['unchanged']} unchanged, {gen['no-layout']} without layout → {gen['log']}")
+    sys.exit(1 if stats['failed'] + stats['timeout'] + stats['empty'] else 0)
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()    # --generate : les workers du batch relancent l’exe
+    main()
@@ -0,0 +1,431 @@
+# LPInputBackends.py — sources d’entrées joystick pour joystick_listener
+# -----------------------------------------------------------------------------
+# Chaque backend produit des InputEvent normalisés (mêmes sémantiques que pygame) :
+#   added   : value = DeviceInfo(name, guid, buttons)
+#   removed : value = None
+#   button  : index = n° de bouton (0-based), value = True (press) / False (release)
+#   hat     : index = n° de hat,              value = (x, y) avec y = +1 vers le haut
+#   axis    : index = n° d’axe,               value = float dans [-1.0, 1.0]
+#
+# Backends disponibles :
+#   pygame    : SDL via pygame (Windows, Linux) — n’initialise que display + joystick
+#   evdev     : lecture directe de /dev/input/event* avec selectors (epoll), Linux
+#   synthetic : file d’events injectés à la main (tests, benchmarks)
+# -----------------------------------------------------------------------------
+
+import os
+import sys
+import time
+import queue
+import struct
+import logging
+from typing import Dict, List, NamedTuple, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceInfo(NamedTuple):
+    name: str
+    guid: str
+    buttons: int
+
+
+class InputEvent(NamedTuple):
+    kind: str       # 'added' | 'removed' | 'button' | 'hat' | 'axis'
+    device: int     # instance_id du device
+    index: int      # bouton / hat / axe
+    value: object
+    ts: float       # time.perf_counter() à la réception
+
+
+class InputBackend:
+    """Interface commune : open(), wait(timeout) → [InputEvent, …], close()."""
+
+    name = 'base'
+
+    def open(self) -> None:
+        raise NotImplementedError
+
+    def wait(self, timeout: float) -> List[InputEvent]:
+        """Bloque au plus `timeout` secondes ; renvoie [] si rien n’est arrivé."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+# —————————————————————————————————————————————————————————
+# pygame / SDL
+# —————————————————————————————————————————————————————————
+class PygameBackend(InputBackend):
+    name = 'pygame'
+
+    def __init__(self):
+        self.pygame    = None
+        self.joysticks = {}     # iid → pygame.joystick.Joystick
+        self.pending   = []
+
+    def open(self):
+        import pygame
+        self.pygame = pygame
+        # pygame.event exige le sous-système vidéo ; inutile d’initialiser audio, fonts, etc.
+        pygame.display.init()
+        pygame.joystick.init()
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed([
+            pygame.JOYBUTTONDOWN, pygame.JOYBUTTONUP, pygame.JOYHATMOTION,
+            pygame.JOYAXISMOTION, pygame.JOYDEVICEADDED, pygame.JOYDEVICEREMOVED,
+        ])
+        for i in range(pygame.joystick.get_count()):
+            self._attach(i)
+
+    def _attach(self, device_index):
+        js  = self.pygame.joystick.Joystick(device_index)
+        iid = js.get_instance_id()
+        if iid in self.joysticks:
+            return      # déjà vu (JOYDEVICEADDED rejoué pour les devices présents au démarrage)
+        js.init()
+        self.joysticks[iid] = js
+        guid = js.get_guid() if hasattr(js, 'get_guid') else ''
+        self.pending.append(InputEvent('added', iid, device_index,
+                                       DeviceInfo(js.get_name(), guid, js.get_numbuttons()),
+                                       time.perf_counter()))
+
+    def _translate(self, ev, out):
+        pg = self.pygame
+        now = time.perf_counter()
+        if ev.type == pg.JOYBUTTONDOWN or ev.type == pg.JOYBUTTONUP:
+            out.append(InputEvent('button', ev.instance_id, ev.button, ev.type == pg.JOYBUTTONDOWN, now))
+        elif ev.type == pg.JOYHATMOTION:
+            out.append(InputEvent('hat', ev.instance_id, ev.hat, tuple(ev.value), now))
+        elif ev.type == pg.JOYAXISMOTION:
+            out.append(InputEvent('axis', ev.instance_id, ev.axis, ev.value, now))
+        elif ev.type == pg.JOYDEVICEADDED:
+            self._attach(ev.device_index)
+            out.extend(self.pending)
+            self.pending = []
+        elif ev.type == pg.JOYDEVICEREMOVED:
+            js = self.joysticks.pop(ev.instance_id, None)
+            if js is not None:
+                try:
+                    js.quit()
+                except Exception:
+                    pass
+            out.append(InputEvent('removed', ev.instance_id, 0, None, now))
+
+    def wait(self, timeout):
+        out = self.pending
+        self.pending = []
+        if out:
+            return out
+        pg = self.pygame
+        first = pg.event.wait(int(timeout * 1000))
+        if first.type == pg.NOEVENT:
+            return out
+        for ev in [first] + pg.event.get():
+            self._translate(ev, out)
+        return out
+
+    def close(self):
+        if self.pygame is not None:
+            self.pygame.joystick.quit()
+
+
+# —————————————————————————————————————————————————————————
+# evdev (Linux) : /dev/input/event* + epoll, sans dépendance externe
+# —————————————————————————————————————————————————————————
+EV_KEY, EV_ABS = 0x01, 0x03
+BTN_MISC       = 0x100
+BTN_JOYSTICK   = 0x120
+BTN_DIGI       = 0x140
+KEY_MAX        = 0x2ff
+ABS_HAT0X      = 0x10
+ABS_HAT3Y      = 0x17
+ABS_MAX        = 0x3f
+
+_EVENT_FMT  = 'llHHi'                    # struct input_event (timeval, type, code, value)
+_EVENT_SIZE = struct.calcsize(_EVENT_FMT)
+
+
+def _ioc_read(nr, size):
+    # _IOC(_IOC_READ, 'E', nr, size)
+    return (2 << 30) | (size << 16) | (ord('E') << 8) | nr
+
+
+def _test_bit(bits, n):
+    return bool(bits[n >> 3] & (1 << (n & 7)))
+
+
+class _EvdevDevice:
+    def __init__(self, path, fd, iid, name, guid, buttons, hats, axes):
+        self.path    = path
+        self.fd      = fd
+        self.iid     = iid
+        self.name    = name
+        self.guid    = guid
+        self.buttons = buttons   # code EV_KEY → index bouton
+        self.hats    = hats      # code ABS_HATnX/Y → index hat
+        self.axes    = axes      # code EV_ABS → (index, min, max)
+        self.hat_val = {}        # index hat → [x, y]
+
+
+class EvdevBackend(InputBackend):
+    name = 'evdev'
+
+    RESCAN_INTERVAL = 2.0       # secondes entre deux scans de /dev/input (hot-plug)
+
+    def __init__(self, input_dir='/dev/input'):
+        self.input_dir = input_dir
+        self.devices: Dict[int, _EvdevDevice] = {}   # fd → device
+        self.paths   = set()
+        self.rejected: Dict[str, Tuple[int, int, int]] = {}    # path → (st_rdev, mtime_ns, ctime_ns) au refus
+        self.next_iid = 0
+        self.pending  = []
+        self.selector = None
+        self.last_scan = 0.0
+
+    def open(self):
+        import selectors
+        self.selector = selectors.DefaultSelector()
+        self._scan()
+
+    def _probe(self, path):
+        import fcntl
+        try:
+            fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+        except OSError as e:
+            logger.debug(f"evdev: cannot open {path}: {e}")
+            return None
+        try:
+            keybits = bytearray((KEY_MAX + 8) // 8)
+            fcntl.ioctl(fd, _ioc_read(0x20 + EV_KEY, len(keybits)), keybits)
+            # Seuls les joysticks/gamepads (BTN_JOYSTICK..BTN_GAMEPAD…) nous intéressent
+            if not any(_test_bit(keybits, c) for c in range(BTN_JOYSTICK, BTN_DIGI)):
+                os.close(fd)
+                return None
+
+            # Ordre des boutons identique à SDL : BTN_JOYSTICK..KEY_MAX puis BTN_MISC..BTN_JOYSTICK
+            codes = [c for c in range(BTN_JOYSTICK, KEY_MAX) if _test_bit(keybits, c)]
+            codes += [c for c in range(BTN_MISC, BTN_JOYSTICK) if _test_bit(keybits, c)]
+            buttons = {c: i for i, c in enumerate(codes)}
+
+            absbits = bytearray((ABS_MAX + 8) // 8)
+            fcntl.ioctl(fd, _ioc_read(0x20 + EV_ABS, len(absbits)), absbits)
+            hats, axes = {}, {}
+            for c in range(ABS_MAX + 1):
+                if not _test_bit(absbits, c):
+                    continue
+                if ABS_HAT0X <= c <= ABS_HAT3Y:
+                    hats[c] = (c - ABS_HAT0X) // 2
+                else:
+                    info = bytearray(24)     # struct input_absinfo : 6 x int32
+                    fcntl.ioctl(fd, _ioc_read(0x40 + c, len(info)), info)
+                    _, lo, hi = struct.unpack('iii', bytes(info[:12]))
+                    axes[c] = (len(axes), lo, hi)
+
+            namebuf = bytearray(256)
+            fcntl.ioctl(fd, _ioc_read(0x06, len(namebuf)), namebuf)
+            name = bytes(namebuf).split(b'\0', 1)[0].decode('utf-8', 'ignore')
+
+            # GUID au format SDL : bustype, vendor, product, version (u16 LE entrecoupés de 0)
+            idbuf = bytearray(8)
+            fcntl.ioctl(fd, _ioc_read(0x02, len(idbuf)), idbuf)
+            bus, vendor, product, version = struct.unpack('<HHHH', bytes(idbuf))
+            guid = struct.pack('<8H', bus, 0, vendor, 0, product, 0, version, 0).hex()
+        except OSError as e:
+            logger.debug(f"evdev: cannot query {path}: {e}")
+            os.close(fd)
+            return None
+
+        iid = self.next_iid
+        self.next_iid += 1
+        return _EvdevDevice(path, fd, iid, name, guid, buttons, hats, axes)
+
+    def _scan(self):
+        import selectors
+        self.last_scan = time.monotonic()
+        try:
+            names = sorted(n for n in os.listdir(self.input_dir) if n.startswith('event'))
+        except OSError as e:
+            logger.warning(f"evdev: cannot list {self.input_dir}: {e}")
+            return
+        # Clavier, souris… refusés une fois ne sont re-sondés que si le nœud change
+        # (recréé au rebranchement, droits modifiés par udev)
+        seen = set()
+        for n in names:
+            path = os.path.join(self.input_dir, n)
+            seen.add(path)
+            if path in self.paths:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            sig = (st.st_rdev, st.st_mtime_ns, st.st_ctime_ns)
+            if self.rejected.get(path) == sig:
+                continue
+            dev = self._probe(path)
+            if dev is None:
+                self.rejected[path] = sig
+                continue
+            self.rejected.pop(path, None)
+            self.devices[dev.fd] = dev
+            self.paths.add(path)
+            self.selector.register(dev.fd, selectors.EVENT_READ)
+            logger.info(f"evdev: {path} → '{dev.name}' (instance_id={dev.iid}, buttons={len(dev.buttons)})")
+            self.pending.append(InputEvent('added', dev.iid, 0,
+                                           DeviceInfo(dev.name, dev.guid, len(dev.buttons)),
+                                           time.perf_counter()))
+        for path in [p for p in self.rejected if p not in seen]:
+            del self.rejected[path]
+
+    def _remove(self, dev):
+        try:
+            self.selector.unregister(dev.fd)
+        except (KeyError, ValueError):
+            pass
+        try:
+            os.close(dev.fd)
+        except OSError:
+            pass
+        self.devices.pop(dev.fd, None)
+        self.paths.discard(dev.path)
+        self.pending.append(InputEvent('removed', dev.iid, 0, None, time.perf_counter()))
+
+    def _read(self, dev, out):
+        try:
+            data = os.read(dev.fd, _EVENT_SIZE * 64)
+        except BlockingIOError:
+            return
+        except OSError:
+            # ENODEV : device débranché
+            self._remove(dev)
+            return
+        now = time.perf_counter()
+        for off in range(0, len(data) - _EVENT_SIZE + 1, _EVENT_SIZE):
+            _, _, etype, code, value = struct.unpack_from(_EVENT_FMT, data, off)
+            if etype == EV_KEY:
+                idx = dev.buttons.get(code)
+                if idx is not None and value in (0, 1):      # 2 = auto-repeat
+                    out.append(InputEvent('button', dev.iid, idx, value == 1, now))
+            elif etype == EV_ABS:
+                hat = dev.hats.get(code)
+                if hat is not None:
+                    cur = dev.hat_val.setdefault(hat, [0, 0])
+                    if (code - ABS_HAT0X) % 2 == 0:
+                        cur[0] = max(-1, min(1, value))
+                    else:
+                        cur[1] = -max(-1, min(1, value))      # SDL : haut = +1
+                    out.append(InputEvent('hat', dev.iid, hat, (cur[0], cur[1]), now))
+                    continue
+                axis = dev.axes.get(code)
+                if axis is not None:
+                    idx, lo, hi = axis
+                    val = 0.0 if hi == lo else (2.0 * (value - lo) / (hi - lo)) - 1.0
+                    out.append(InputEvent('axis', dev.iid, idx, val, now))
+
+    def wait(self, timeout):
+        if time.monotonic() - self.last_scan >= self.RESCAN_INTERVAL:
+            self._scan()
+        out = self.pending
+        self.pending = []
+        if out:
+            return out
+        for key, _ in self.selector.select(timeout):
+            dev = self.devices.get(key.fd)
+            if dev is not None:
+                self._read(dev, out)
+        out.extend(self.pending)
+        self.pending = []
+        return out
+
+    def close(self):
+        for dev in list(self.devices.values()):
+            self._remove(dev)
+        self.pending = []
+        if self.selector is not None:
+            self.selector.close()
+
+
+# —————————————————————————————————————————————————————————
+# Synthétique : pour les tests et LPBench
+# —————————————————————————————————————————————————————————
+class SyntheticBackend(InputBackend):
+    name = 'synthetic'
+
+    def __init__(self):
+        self.events   = queue.Queue()
+        self.next_iid = 0
+
+    def open(self):
+        pass
+
+    def add_device(self, name='Synthetic Pad', buttons=16, guid='') -> int:
+        iid = self.next_iid
+        self.next_iid += 1
+        self.events.put(InputEvent('added', iid, 0, DeviceInfo(name, guid, buttons), time.perf_counter()))
+        return iid
+
+    def remove_device(self, iid):
+        self.events.put(InputEvent('removed', iid, 0, None, time.perf_counter()))
+
+    def press(self, iid, button, pressed=True, ts=None):
+        self.events.put(InputEvent('button', iid, button, pressed,
+                                   time.perf_counter() if ts is None else ts))
+
+    def hat(self, iid, value, hat=0, ts=None):
+        self.events.put(InputEvent('hat', iid, hat, tuple(value),
+                                   time.perf_counter() if ts is None else ts))
+
+    def axis(self, iid, axis, value, ts=None):
+        self.events.put(InputEvent('axis', iid, axis, value,
+                                   time.perf_counter() if ts is None else ts))
+
+    def wait(self, timeout):
+        try:
+            out = [self.events.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                out.append(self.events.get_nowait())
+            except queue.Empty:
+                return out
+
+
+def evdev_readable(input_dir: str = '/dev/input') -> bool:
+    """Au moins un /dev/input/event* ouvrable en lecture (sinon evdev ne verra jamais rien)."""
+    try:
+        names = [n for n in os.listdir(input_dir) if n.startswith('event')]
+    except OSError:
+        return False
+    for n in names:
+        try:
+            fd = os.open(os.path.join(input_dir, n), os.O_RDONLY | os.O_NONBLOCK)
+        except OSError:
+            continue
+        os.close(fd)
+        return True
+    return False
+
+
+def create_input_backend(name: str = 'auto') -> InputBackend:
+    """
+    name : 'auto' | 'pygame' | 'evdev' | 'synthetic'.
+    'auto' choisit evdev sous Linux si /dev/input est lisible, pygame sinon.
+    """
+    name = (name or 'auto').strip().lower()
+    if name == 'auto':
+        name = 'pygame'
+        if sys.platform.startswith('linux'):
+            if evdev_readable():
+                name = 'evdev'
+            else:
+                logger.warning("evdev: no readable /dev/input/event* (input group?), falling back to pygame")
+    if name == 'evdev':
+        return EvdevBackend()
+    if name == 'synthetic':
+        return SyntheticBackend()
+    if name != 'pygame':
+        logger.warning(f"Unknown input backend '{name}', falling back to pygame")
+    return PygameBackend()
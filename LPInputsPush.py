@@ -1,11 +1,20 @@
 import os
+import json
 import time
 import shutil
+import hashlib
 import logging
+import threading
 import configparser
+import multiprocessing
+import re
 import xml.etree.ElementTree as ET
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from types import MappingProxyType
+from typing import Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+from LPEventBus import EventBus, EsEvent
 
 # ——— Paths ———
 RETROBAT_ROOT    = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
@@ -20,57 +29,189 @@ logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] %(levelname)s: %(
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-def parse_es_event(path):
-    data = open(path, encoding='utf-8').read().strip()
-    parts = [p for p in data.split('&') if '=' in p]
-    params = dict(p.split('=', 1) for p in parts)
-    emulator = params.get('param1', '').strip('"').lower()
-    rompath  = params.get('param2', '').strip('"')
-    game     = os.path.splitext(os.path.basename(rompath))[0]
-    return emulator, game
+def set_paths(retrobat_root, plugin_dir):
+    """Chemins d’une installation RetroBat donnée (service LPEvents : ses propres BASE_DIR / racine)."""
+    global RETROBAT_ROOT, ES_INPUT_CFG, ES_EVENT_FILE, PANEL_CONFIG_INI, MAME_CFG_DIR, ARCADE_XML_DIR
+    RETROBAT_ROOT    = retrobat_root
+    ES_INPUT_CFG     = os.path.join(retrobat_root, 'emulationstation', '.emulationstation', 'es_input.cfg')
+    ES_EVENT_FILE    = os.path.join(plugin_dir, 'ESEvent.arg')
+    PANEL_CONFIG_INI = os.path.join(plugin_dir, 'config.ini')
+    MAME_CFG_DIR     = os.path.join(retrobat_root, 'bios', 'mame', 'cfg')
+    ARCADE_XML_DIR   = os.path.join(plugin_dir, 'systems', 'mame')
+
+# ——— es_input.cfg : analysé une fois, relu seulement si le fichier change ———
+class EsInput(NamedTuple):
+    id: int
+    type: str       # 'button' | 'axis' | 'hat' | 'key'
+
 
-def load_es_input(path):
+EsInputMap = Mapping[str, EsInput]      # nom ES en majuscules (A, UP, JOYSTICK1LEFT…) → entrée
+
+
+def _parse_es_input(path) -> Tuple[EsInputMap, ...]:
     tree = ET.parse(path)
-    es_maps = []
-    # priorité joystick
-    for inputcfg in tree.findall('.//inputConfig'):
-        if inputcfg.get('type') != 'joystick':
-            continue
+
+    def read(inputcfg):
         mapping = {}
         for inp in inputcfg.findall('input'):
             name = inp.get('name').upper()
             idx = int(inp.get('id')) if inp.get('id').isdigit() else 0
-            kind = inp.get('type')
-            mapping[name] = (idx, kind)
-        es_maps.append(mapping)
+            mapping[name] = EsInput(idx, inp.get('type'))
+        return MappingProxyType(mapping)
+
+    # priorité joystick
+    es_maps = [read(c) for c in tree.findall('.//inputConfig') if c.get('type') == 'joystick']
     # fallback clavier
     if not es_maps:
         for inputcfg in tree.findall('.//inputConfig'):
             if inputcfg.get('type') == 'keyboard':
-                mapping = {}
-                for inp in inputcfg.findall('input'):
-                    name = inp.get('name').upper()
-                    idx = int(inp.get('id')) if inp.get('id').isdigit() else 0
-                    kind = inp.get('type')
-                    mapping[name] = (idx, kind)
-                es_maps.append(mapping)
+                es_maps.append(read(inputcfg))
                 break
-    return es_maps
+    return tuple(es_maps)
+
+
+class EsInputProvider:
+    """
+    Mappings ES par manette (lecture seule, partagés) pour un es_input.cfg.
+    get() ne fait qu’un stat() tant que mtime et taille sont inchangés ;
+    sinon ré-analyse, sous verrou (un seul parse si plusieurs threads arrivent ensemble).
+    """
+
+    def __init__(self, path):
+        self.path  = path
+        self.lock  = threading.Lock()
+        self.sig: Optional[Tuple[int, int]] = None
+        self.maps: Tuple[EsInputMap, ...] = ()
+        self.stats = {'hits': 0, 'parses': 0}
+
+    def get(self) -> Tuple[EsInputMap, ...]:
+        st  = os.stat(self.path)
+        sig = (st.st_mtime_ns, st.st_size)
+        with self.lock:
+            if sig == self.sig:
+                self.stats['hits'] += 1
+                return self.maps
+            t0 = time.perf_counter()
+            self.maps = _parse_es_input(self.path)
+            self.sig  = sig
+            self.stats['parses'] += 1
+            logger.debug(f"es_input: {len(self.maps)} device(s) parsed in "
+                         f"{(time.perf_counter() - t0) * 1000:.1f} ms ({self.stats})")
+            return self.maps
+
+
+_ES_INPUT_PROVIDERS: Dict[str, EsInputProvider] = {}
+_ES_INPUT_LOCK = threading.Lock()
+
+
+def es_input_provider(path) -> EsInputProvider:
+    """Un provider par fichier et par process, partagé par tous les appelants."""
+    key = os.path.abspath(path)
+    with _ES_INPUT_LOCK:
+        provider = _ES_INPUT_PROVIDERS.get(key)
+        if provider is None:
+            provider = _ES_INPUT_PROVIDERS[key] = EsInputProvider(key)
+        return provider
+
+
+def load_es_input(path) -> Tuple[EsInputMap, ...]:
+    return es_input_provider(path).get()
 
 def load_mame_ports(path):
     tree = ET.parse(path)
     return tree.findall('.//port')
 
-def load_layout(game, btn_count):
+# ——— Index des ports et des layouts : construits une fois par fichier, gardés tant qu’il ne change pas ———
+PARSE_CACHE_SIZE = 256      # entrées LRU : 2 par jeu (inputs + XML de layouts)
+
+_PARSE_CACHE: "OrderedDict[Tuple[str, str], Tuple[Tuple[int, int], object]]" = OrderedDict()
+_PARSE_LOCK = threading.Lock()
+
+
+def _cached_parse(kind, path, build):
+    """build(path) mis en cache par (kind, path), invalidé par mtime/taille. FileNotFoundError remonte."""
+    st  = os.stat(path)
+    sig = (st.st_mtime_ns, st.st_size)
+    key = (kind, os.path.abspath(path))
+    with _PARSE_LOCK:
+        hit = _PARSE_CACHE.get(key)
+        if hit is not None and hit[0] == sig:
+            _PARSE_CACHE.move_to_end(key)
+            return hit[1]
+    value = build(path)
+    with _PARSE_LOCK:
+        _PARSE_CACHE[key] = (sig, value)
+        _PARSE_CACHE.move_to_end(key)
+        while len(_PARSE_CACHE) > PARSE_CACHE_SIZE:
+            _PARSE_CACHE.popitem(last=False)
+    return value
+
+
+_PLAYER_TYPE_RE = re.compile(r'P(\d+)_(.+)')
+
+
+class PortIndex:
     """
-    Renvoie l'élément <layout> dont panelButtons == btn_count pour le jeu donné.
+    Ports d’un <game>_inputs.cfg, indexés une fois :
+      - by_type : type en majuscules → <port> (le dernier l’emporte, comme avant) ;
+      - player_buttons : joueur → ports P{n}_BUTTON* et actions texte (BUTTON_TO_ACTION),
+        déjà triés par mask (tri stable : ordre du fichier à mask égal).
     """
-    xml = os.path.join(ARCADE_XML_DIR, f"{game}.xml")
-    tree = ET.parse(xml)
-    for layout in tree.findall('.//layout'):
-        if layout.get('panelButtons') == str(btn_count):
-            return layout
-    raise ValueError(f"No layout for {btn_count} buttons in {game}")
+    __slots__ = ('ports', 'by_type', 'player_buttons')
+
+    def __init__(self, ports):
+        self.ports = tuple(ports)
+        self.by_type = {p.get('type').upper(): p for p in self.ports}
+        buttons: Dict[int, list] = {}
+        for p in self.ports:
+            m = _PLAYER_TYPE_RE.fullmatch(p.get('type', '').upper())
+            if m and (m.group(2).startswith('BUTTON') or m.group(2) in ACTION_TO_BUTTON):
+                buttons.setdefault(int(m.group(1)), []).append(p)
+        self.player_buttons = {n: tuple(sorted(lst, key=lambda p: int(p.get('mask'))))
+                               for n, lst in buttons.items()}
+
+    def buttons(self, player_num) -> deque:
+        """Copie consommable (popleft) des ports boutons du joueur."""
+        return deque(self.player_buttons.get(player_num, ()))
+
+
+def load_port_index(path) -> PortIndex:
+    return _cached_parse('ports', path, lambda p: PortIndex(load_mame_ports(p)))
+
+
+class LayoutIndex(NamedTuple):
+    layout: ET.Element
+    buttons: Tuple[ET.Element, ...]
+    by_function: Dict[str, ET.Element]      # function normalisée → 1er <button> qui la porte
+
+
+def _index_layouts(xml) -> Dict[str, LayoutIndex]:
+    layouts = {}
+    for layout in ET.parse(xml).findall('.//layout'):
+        count = layout.get('panelButtons')
+        if count in layouts:
+            continue
+        buttons = tuple(layout.findall('button'))
+        by_function = {}
+        for b in buttons:
+            by_function.setdefault(b.get('function', '').upper().replace(' ', '_'), b)
+        layouts[count] = LayoutIndex(layout, buttons, by_function)
+    return layouts
+
+
+def _game_layouts(game) -> Dict[str, LayoutIndex]:
+    return _cached_parse('layouts', os.path.join(ARCADE_XML_DIR, f"{game}.xml"), _index_layouts)
+
+
+def load_layout(game, btn_count) -> LayoutIndex:
+    """
+    Renvoie le 1er <layout> dont panelButtons == btn_count pour le jeu donné,
+    avec ses boutons et l’index par function (XML analysé une fois, mis en cache).
+    """
+    layout = _game_layouts(game).get(str(btn_count))
+    if layout is None:
+        raise ValueError(f"No layout for {btn_count} buttons in {game}")
+    return layout
 
 def backup_cfg(game):
     src = os.path.join(MAME_CFG_DIR, f"{game}.cfg")
@@ -92,86 +233,6 @@ def indent(elem, level=0):
         if level and (not elem.tail or not elem.tail.strip()):
             elem.tail = i
 
-def add_direction(parent, port, es_map, player_num, players_count):
-    orig_type = port.get('type', '').upper()
-    mask = port.get('mask')
-    tag = port.get('tag')
-
-    port_el = ET.SubElement(parent, 'port', tag=tag, type=orig_type, mask=mask, defvalue=mask)
-    seq = ET.SubElement(port_el, 'newseq', type='standard')
-
-    parts = orig_type.split('_', 1)
-    if len(parts) != 2 or parts[1] not in ('UP', 'DOWN', 'LEFT', 'RIGHT'):
-        seq.text = ''
-        return
-    direction = parts[1]
-
-    kind = None
-    if direction in es_map and es_map[direction][1] == 'hat':
-        kind = 'hat'
-    else:
-        axis_key = f"JOYSTICK{player_num}{direction}"
-        if axis_key in es_map and es_map[axis_key][1] == 'axis':
-            kind = 'axis'
-
-    if kind == 'hat':
-        seq.text = f"JOYCODE_HAT{player_num}{direction}"
-    elif kind == 'axis':
-        axis_name = 'XAXIS' if direction in ('LEFT', 'RIGHT') else 'YAXIS'
-        if players_count > 1:
-            seq.text = f"JOYCODE_{player_num}_{axis_name}_{direction}_SWITCH"
-        else:
-            seq.text = f"JOYCODE_{axis_name}_{direction}_SWITCH"
-    else:
-        axis_name = 'YAXIS' if direction in ('UP', 'DOWN') else 'XAXIS'
-        if players_count > 1:
-            seq.text = f"JOYCODE_{player_num}_{axis_name}_{direction}_SWITCH"
-        else:
-            seq.text = f"JOYCODE_{axis_name}_{direction}_SWITCH"
-
-TYPE_MAP = {
-    4: 4,
-    3: 3,
-    5: 5,
-    7: 7,
-    1: 1,
-    2: 2,
-    6: 6,
-    8: 8,
-}
-
-def add_button(parent, port, btn, es_map, player_num, type_index, phys):
-    """
-    Injecte un <port> basé sur 'physical' du layout,
-    avec type="P{player_num}_BUTTON{type_index}",
-    et newseq="JOYCODE_{player_num}_BUTTON{phys}".
-    """
-    tag  = port.get('tag')
-    mask = port.get('mask')
-    pfx  = f"P{player_num}"
-
-    # Créer <port type="P{player}_BUTTON{type_index}"> (pas d’underscore avant le numéro)
-    port_el = ET.SubElement(
-        parent, 'port',
-        tag=tag,
-        type=f"{pfx}_BUTTON{type_index}",
-        mask=mask,
-        defvalue=mask
-    )
-
-    # À l’intérieur, injecter <newseq>JOYCODE_{player}_BUTTON{phys}</newseq>
-    seq = ET.SubElement(port_el, 'newseq', type='standard')
-    ctrl = btn.get('controller', '').upper()
-    idx, kind = es_map.get(ctrl, (None, None))
-    if kind == 'button':
-        seq.text = f"JOYCODE_{player_num}_BUTTON{phys}"
-    elif kind == 'key':
-        seq.text = f"KEYCODE_{ctrl}"
-    else:
-        seq.text = ''
-
-
-import re
 # Pour chaque BUTTON<n>, on accepte une ou plusieurs variantes de "function"
 BUTTON_TO_ACTION = {
     "BUTTON1": ["HIGH_PUNCH",    "JAB_PUNCH"],
@@ -182,24 +243,347 @@ BUTTON_TO_ACTION = {
     "BUTTON6": ["BLOCK_2",       "RUN",
                 "ROUNDHOUSE_KICK"],
 }
-# Inversion automatique (on ne l’utilise que si on veut passer ACTION → BUTTON<n> ; sinon, on cherche directement)
+# Inversion automatique (on ne l’utilise que si on veut passer ACTION → BUTTON<n> ; sinon, on cherche directement)
 ACTION_TO_BUTTON = {
     action: btn
     for btn, actions in BUTTON_TO_ACTION.items()
     for action in actions
 }
 
+FIGHT_BUTTONS = frozenset(('A', 'B', 'X', 'Y', 'L1', 'R1', 'L2', 'R2'))
+DIRECTIONS    = ('UP', 'DOWN', 'LEFT', 'RIGHT')
 
-def write_cfg(game, es_maps, ports):
+
+# ——— Familles de jeux : déclarées ici, listes et remaps lus dans [Mapping] ———
+class FamilyRule(NamedTuple):
+    name: str
+    games_key: str          # liste de jeux dans [Mapping]
+    remap_key: str          # table "phys:n,…" dans [Mapping] ; famille inactive si vide
+    buttons: str            # 'fixed'   : P{n}_BUTTON1…6 dans cet ordre, trouvés par alias d’action
+                            # 'indexed' : port P{n}_BUTTON_<index> (puis alias) pour chaque bouton du layout
+                            # 'ordered' : ports boutons du joueur pris dans l’ordre des masks
+    remap: Optional[str]    # où s’applique le remap : 'joycode' | 'type' | 'newseq' (après chaque joueur)
+
+
+GAME_FAMILIES = (           # ordre = priorité si un jeu est dans plusieurs listes
+    FamilyRule('mk',         'mkgames',        'mkgames_remap',        'fixed',   'joycode'),
+    FamilyRule('punch-kick', 'punchkickgames', 'punchkickgames_remap', 'indexed', 'type'),
+    FamilyRule('tri-button', 'tributtons',     'tributtons_remap',     'indexed', 'newseq'),
+)
+DEFAULT_FAMILY = FamilyRule('default', '', '', 'ordered', None)
+
+
+class MappingRules(NamedTuple):
+    families: Dict[str, Tuple[FamilyRule, Dict[int, int]]]    # jeu (minuscules) → (famille, remap)
+    players_count: int
+    buttons_count: Dict[int, int]                             # joueur → boutons du panel
+    sig: bytes
+
+
+_RULES_CACHE: Dict[str, MappingRules] = {}
+
+
+def _parse_remap(text) -> Dict[int, int]:
+    remap = {}
+    for pair in text.split(','):
+        a, b = pair.split(':')
+        remap[int(a)] = int(b)
+    return remap
+
+
+def load_mapping_rules() -> MappingRules:
+    """[Mapping] / [Panel] de config.ini compilés en tables (recompilés si le fichier change)."""
+    sig = _ini_signature(PANEL_CONFIG_INI)
+    rules = _RULES_CACHE.get(PANEL_CONFIG_INI)
+    if rules is not None and rules.sig == sig:
+        return rules
+
+    cfg_ini = configparser.ConfigParser()
+    cfg_ini.read(PANEL_CONFIG_INI)
+    families = {}
+    if cfg_ini.has_section('Mapping'):
+        for family in GAME_FAMILIES:
+            games = [n.strip().lower() for n in cfg_ini.get('Mapping', family.games_key, fallback='').split(',')
+                     if n.strip()]
+            text = cfg_ini.get('Mapping', family.remap_key, fallback='').strip()
+            remap = _parse_remap(text) if text else {}
+            if not remap:
+                continue
+            for game in games:
+                families.setdefault(game, (family, remap))
+
+    players_count = cfg_ini.getint('Panel', 'players_count', fallback=1)
+    default_count = cfg_ini.getint('Panel', 'buttons_count', fallback=6)
+    buttons_count = {n: cfg_ini.getint('Panel', f'Player{n}_buttons_count', fallback=default_count)
+                     for n in range(1, players_count + 1)}
+    rules = MappingRules(families, players_count, buttons_count, sig)
+    _RULES_CACHE[PANEL_CONFIG_INI] = rules
+    return rules
+
+
+# ——— Plan d’un jeu : la liste des <port> à écrire, calculée une fois ———
+class Slot(NamedTuple):
+    player: int
+    attrib: Dict[str, str]  # tag, type, mask, defvalue (dans cet ordre)
+    seq: str                # règle du <newseq> : 'dir' | 'button' | 'joycode' | 'empty'
+    key: str                # direction ou contrôleur ES
+    text: str               # texte JOYCODE déjà calculé
+    passes: Tuple[int, ...] # remaps 'newseq' à appliquer ensuite (joueurs tri-button)
+
+
+def _port_attrib(port, type_name, defvalue) -> Dict[str, str]:
+    return {'tag': port.get('tag'), 'type': type_name, 'mask': port.get('mask'), 'defvalue': defvalue}
+
+
+def _direction_slot(port, player_num, players_count) -> Slot:
+    orig_type = port.get('type', '').upper()
+    parts = orig_type.split('_', 1)
+    attrib = _port_attrib(port, orig_type, port.get('mask'))
+    if len(parts) != 2 or parts[1] not in DIRECTIONS:
+        return Slot(player_num, attrib, 'empty', '', '', ())
+    direction = parts[1]
+    axis_name = 'XAXIS' if direction in ('LEFT', 'RIGHT') else 'YAXIS'
+    if players_count > 1:
+        text = f"JOYCODE_{player_num}_{axis_name}_{direction}_SWITCH"
+    else:
+        text = f"JOYCODE_{axis_name}_{direction}_SWITCH"
+    return Slot(player_num, attrib, 'dir', direction, text, ())
+
+
+def _button_slot(port, btn, player_num, type_index, phys) -> Slot:
+    """<port type="P{n}_BUTTON{type_index}"> dont le newseq vise le bouton physique phys."""
+    return Slot(player_num, _port_attrib(port, f"P{player_num}_BUTTON{type_index}", port.get('mask')), 'button',
+                btn.get('controller', '').upper(), f"JOYCODE_{player_num}_BUTTON{phys}", ())
+
+
+def _start_coin_slot(btn, action, phys, player_num, by_type, fallback) -> Optional[Slot]:
+    """START (avec l’ancien nom START_n en repli, hors MK) ou COIN : type_index = phys."""
+    if action == 'START':
+        keys = (f"{player_num}_PLAYER_START", f"START_{player_num}") if fallback else (f"{player_num}_PLAYER_START",)
+    else:
+        keys = (f"COIN_{player_num}",)
+    for key in keys:
+        if key in by_type:
+            return _button_slot(by_type[key], btn, player_num, phys, phys)
+    if action == 'COIN':
+        logger.error(f"Missing port pour COIN_{player_num}" if fallback else f"Missing port pour {keys[0]} (MK COIN)")
+    elif fallback:
+        logger.error(f"Missing port pour START (clés testées: {player_num}_PLAYER_START et START_{player_num})")
+    else:
+        logger.error(f"Missing port pour {keys[0]} (MK START)")
+    return None
+
+
+def _fixed_buttons(layout, player_num, by_type, remap) -> List[Slot]:
+    """MK : START/COIN tels quels, puis BUTTON1…BUTTON6 dans cet ordre fixe (JOYCODE remappé)."""
+    slots = []
+    for btn in layout.buttons:
+        action = btn.get('function', '').upper().replace(' ', '_')
+        phys = int(btn.get('physical'))
+        if action in ('START', 'COIN'):
+            slot = _start_coin_slot(btn, action, phys, player_num, by_type, fallback=False)
+            if slot is not None:
+                slots.append(slot)
+
+    for button_name, possible_actions in BUTTON_TO_ACTION.items():
+        btn_elem = None
+        for action in possible_actions:
+            b = layout.by_function.get(action)
+            if b is not None and b.get('color', '').lower() != 'black':
+                btn_elem = b
+                break
+        if btn_elem is None:
+            continue
+
+        phys = int(btn_elem.get('physical'))
+        action_found = btn_elem.get('function', '').upper().replace(' ', '_')
+        port_key = f"P{player_num}_{action_found}"
+        if port_key not in by_type:
+            logger.error(f"Missing port pour key {port_key} (phys={phys}, action={action_found})")
+            continue
+        orig_port = by_type[port_key]
+        slots.append(Slot(player_num, _port_attrib(orig_port, f"P{player_num}_{button_name}", orig_port.get('defvalue')),
+                          'joycode', '', f"JOYCODE_{player_num}_BUTTON{remap.get(phys, phys)}", ()))
+    return slots
+
+
+def _layout_buttons(game, layout, player_num, port_index, family, remap) -> List[Slot]:
+    """Punch-kick, tri-button et cas général : un passage sur les boutons du layout."""
+    by_type = port_index.by_type
+    player_ports = port_index.buttons(player_num)
+    slots = []
+    for btn in layout.buttons:
+        if btn.get('color', '').lower() == 'black':
+            continue
+
+        gb = btn.get('gameButton', '').upper()
+        phys = int(btn.get('physical'))
+
+        if gb in FIGHT_BUTTONS:
+            if family.buttons == 'indexed':
+                type_index = remap.get(phys, phys) if family.remap == 'type' else phys
+                # BUTTON_n, puis l'action texte si besoin
+                port = by_type.get(f"P{player_num}_BUTTON_{type_index}")
+                if port is None:
+                    for action in BUTTON_TO_ACTION.get(f"BUTTON{type_index}", ()):
+                        port = by_type.get(f"P{player_num}_{action}")
+                        if port is not None:
+                            break
+                if port is None:
+                    logger.error(
+                        f"Impossible de trouver un port pour phys={phys}, "
+                        f"type_index={type_index} (jeu={game}, joueur={player_num})"
+                    )
+                    continue
+            else:
+                if not player_ports:
+                    logger.error(f"Pas assez de ports joueurs pour phys={phys}, gameButton={gb}")
+                    continue
+                port = player_ports.popleft()
+                parts = port.get('type').split('_')
+                try:
+                    type_index = int(parts[2])
+                except (IndexError, ValueError):
+                    logger.error(f"Format inattendu pour port {port.get('type')}")
+                    continue
+            slots.append(_button_slot(port, btn, player_num, type_index, phys))
+
+        elif gb in ('START', 'COIN'):
+            slot = _start_coin_slot(btn, gb, phys, player_num, by_type, fallback=True)
+            if slot is not None:
+                slots.append(slot)
+
+        else:
+            logger.debug(f"Bouton XML non reconnu: gameButton={gb}, phys={phys}")
+    return slots
+
+
+class GamePlan(NamedTuple):
+    family: str
+    slots: Tuple[Slot, ...]
+    newseq_remap: Dict[int, int]
+
+
+def compile_plan(game, rules: MappingRules, port_index, players_count) -> GamePlan:
+    """Règles de la famille du jeu + layout + ports → liste ordonnée des <port> (indépendante d’es_input)."""
+    family, remap = rules.families.get(game.lower(), (DEFAULT_FAMILY, {}))
+    by_type = port_index.by_type
+    slots: List[Slot] = []
+    for player_num in range(1, players_count + 1):
+        btn_count = rules.buttons_count[player_num]
+        try:
+            layout = load_layout(game, btn_count)
+        except (FileNotFoundError, ValueError):
+            logger.warning(f"No XML layout pour '{game}' ({btn_count} boutons)")
+            continue
+
+        # Directions UP/DOWN/LEFT/RIGHT, toujours
+        for direction in DIRECTIONS:
+            key = f"P{player_num}_{direction}"
+            if key in by_type:
+                slots.append(_direction_slot(by_type[key], player_num, players_count))
+            else:
+                logger.debug(f"No port pour direction {key}")
+
+        if family.buttons == 'fixed':
+            slots.extend(_fixed_buttons(layout, player_num, by_type, remap))
+            continue
+        slots.extend(_layout_buttons(game, layout, player_num, port_index, family, remap))
+
+        # Tri-button : les newseq déjà produits (tous joueurs) sont réajustés par le remap
+        if family.remap == 'newseq':
+            slots = [s._replace(passes=s.passes + (player_num,)) for s in slots]
+    return GamePlan(family.name, tuple(slots), remap if family.remap == 'newseq' else {})
+
+
+PLAN_CACHE_SIZE = 128
+
+_PLAN_CACHE: "OrderedDict[Tuple[str, int], Tuple[tuple, GamePlan]]" = OrderedDict()
+_PLAN_LOCK = threading.Lock()
+
+
+def game_plan(game, rules: MappingRules, port_index, players_count) -> GamePlan:
+    """Plan en cache, tant que les règles, les ports et les layouts du jeu sont les mêmes objets."""
+    try:
+        layouts = _game_layouts(game)
+    except FileNotFoundError:
+        layouts = None
+    deps = (rules, port_index, layouts)
+    key = (game, players_count)
+    with _PLAN_LOCK:
+        hit = _PLAN_CACHE.get(key)
+        if hit is not None and all(a is b for a, b in zip(hit[0], deps)):
+            _PLAN_CACHE.move_to_end(key)
+            return hit[1]
+    plan = compile_plan(game, rules, port_index, players_count)
+    with _PLAN_LOCK:
+        _PLAN_CACHE[key] = (deps, plan)
+        _PLAN_CACHE.move_to_end(key)
+        while len(_PLAN_CACHE) > PLAN_CACHE_SIZE:
+            _PLAN_CACHE.popitem(last=False)
+    return plan
+
+
+# ——— Émission : un seul passage, le même pour toutes les familles ———
+def _es_kind(es_map, key):
+    entry = es_map.get(key)
+    return entry[1] if entry else None
+
+
+SEQ_RULES = {
+    'empty':   lambda slot, es_map: '',
+    'joycode': lambda slot, es_map: slot.text,
+    'dir':     lambda slot, es_map: (f"JOYCODE_HAT{slot.player}{slot.key}"
+                                     if _es_kind(es_map, slot.key) == 'hat' else slot.text),
+    'button':  lambda slot, es_map: {'button': slot.text,
+                                     'key': f"KEYCODE_{slot.key}"}.get(_es_kind(es_map, slot.key), ''),
+}
+
+
+def _remap_newseq(text, player_num, remap):
+    parts = text.split('BUTTON')
+    if len(parts) != 2:
+        return text
+    try:
+        old_phys = int(parts[1])
+    except ValueError:
+        return text
+    if old_phys in remap:
+        return f"JOYCODE_{player_num}_BUTTON{remap[old_phys]}"
+    return text
+
+
+def emit_input(plan: GamePlan, es_maps) -> ET.Element:
+    inp = ET.Element('input')
+    for slot in plan.slots:
+        port_el = ET.SubElement(inp, 'port', slot.attrib)
+        seq = ET.SubElement(port_el, 'newseq', type='standard')
+        text = SEQ_RULES[slot.seq](slot, es_maps[slot.player - 1])
+        for player_num in slot.passes:
+            if text:
+                text = _remap_newseq(text, player_num, plan.newseq_remap)
+        seq.text = text
+    return inp
+
+
+def build_input(game, es_maps, ports) -> ET.Element:
     """
-    Reconstruit la section <input> du fichier <game>.cfg (MAME) en prenant
-    pour source de vérité le layout XML, et en :
-      - Pour MK : toujours créer <port type="P{player}_BUTTON<n>"> dans le
-        même ordre (BUTTON1…BUTTON6) ; seul le JOYCODE changera si mkgames_remap évolue.
-      - Pour les autres jeux : logique inchangée (punch-kick, tributton, etc.).
-      - Les attributs mask/defvalue/tag sont toujours hérités du port d’origine
-        (ex: P1_HIGH_PUNCH, P1_BLOCK, …) lu dans ports_by_type.
+    Construit en mémoire la section <input> du fichier <game>.cfg (MAME) en prenant
+    pour source de vérité le layout XML. La famille du jeu ([Mapping] : MK, punch-kick,
+    tri-button, sinon cas général, cf. GAME_FAMILIES) est compilée avec le layout et
+    les ports en un plan (game_plan, en cache), puis émis en un seul passage.
+    Les attributs mask/defvalue/tag sont toujours hérités du port d’origine.
+    ports : PortIndex (load_port_index) ou liste de <port> (indexée ici).
     """
+    port_index = ports if isinstance(ports, PortIndex) else PortIndex(ports)
+    rules = load_mapping_rules()
+    # Nombre de joueurs à traiter (on prend le min entre cfg et es_maps)
+    players_count = min(rules.players_count, len(es_maps))
+    return emit_input(game_plan(game, rules, port_index, players_count), es_maps)
+
+
+def load_cfg_tree(game) -> ET.ElementTree:
+    """Arbre XML de <game>.cfg ; créé minimalement s’il n’existe pas."""
     cfg_path = os.path.join(MAME_CFG_DIR, f"{game}.cfg")
 
     # — Si le fichier n'existe pas, on le crée minimalement
@@ -217,7 +601,12 @@ def write_cfg(game, es_maps, ports):
             f.write(template)
 
     # On parse/charge l’arbre XML existant
-    tree = ET.parse(cfg_path)
+    return ET.parse(cfg_path)
+
+
+def write_input(game, tree, inp):
+    """Remplace <input> dans l’arbre de <game>.cfg, ré-indente et écrit le fichier."""
+    cfg_path = os.path.join(MAME_CFG_DIR, f"{game}.cfg")
     root = tree.getroot()
     system = root.find('.//system')
 
@@ -226,344 +615,392 @@ def write_cfg(game, es_maps, ports):
     if old_input is not None:
         system.remove(old_input)
 
-    # Créer une nouvelle balise <input> (juste avant <bgfx> si présent, sinon à la fin)
-    inp = ET.Element('input')
+    # Nouvelle balise <input> juste avant <bgfx> si présent, sinon à la fin
     bgfx = system.find('bgfx')
     if bgfx is not None:
         system.insert(list(system).index(bgfx), inp)
     else:
         system.append(inp)
 
-    # — Lecture des mappings depuis PANEL_CONFIG_INI —
-    cfg_ini = configparser.ConfigParser()
-    cfg_ini.read(PANEL_CONFIG_INI)
+    # Ré-indentation du XML avant écriture
+    indent(root)
+    tree.write(cfg_path, encoding="utf-8", xml_declaration=True)
+    logger.info(f"Wrote {cfg_path}")
 
-    pk_games = []
-    pk_remap = {}
-    tb_games = []
-    tb_remap = {}
-    mk_games = []
-    mk_remap = {}
 
-    if cfg_ini.has_section('Mapping'):
-        # punch/kick
-        pk_list = cfg_ini.get('Mapping', 'punchkickgames', fallback='').split(',')
-        pk_games = [n.strip().lower() for n in pk_list if n.strip()]
-        pk_str = cfg_ini.get('Mapping', 'punchkickgames_remap', fallback='').strip()
-        if pk_str:
-            for pair in pk_str.split(','):
-                a, b = pair.split(':')
-                pk_remap[int(a)] = int(b)
-
-        # tri-button
-        tb_list = cfg_ini.get('Mapping', 'tributtons', fallback='').split(',')
-        tb_games = [n.strip().lower() for n in tb_list if n.strip()]
-        tb_str = cfg_ini.get('Mapping', 'tributtons_remap', fallback='').strip()
-        if tb_str:
-            for pair in tb_str.split(','):
-                a, b = pair.split(':')
-                tb_remap[int(a)] = int(b)
-
-        # Mortal Kombat
-        mk_list = cfg_ini.get('Mapping', 'mkgames', fallback='').split(',')
-        mk_games = [n.strip().lower() for n in mk_list if n.strip()]
-        mk_str = cfg_ini.get('Mapping', 'mkgames_remap', fallback='').strip()
-        if mk_str:
-            for pair in mk_str.split(','):
-                a, b = pair.split(':')
-                mk_remap[int(a)] = int(b)
+def write_cfg(game, es_maps, ports):
+    """Reconstruit et écrit la section <input> de <game>.cfg (voir build_input)."""
+    tree = load_cfg_tree(game)
+    write_input(game, tree, build_input(game, es_maps, ports))
 
-    # Nombre de joueurs à traiter (on prend le min entre cfg et es_maps)
-    players_count = min(
-        cfg_ini.getint('Panel', 'players_count', fallback=1),
-        len(es_maps)
-    )
 
-    # Dictionnaire pour retrouver les ports d’origine par type (ex: "P1_HIGH_PUNCH")
-    ports_by_type = {p.get('type').upper(): p for p in ports}
 
-    for player_num in range(1, players_count + 1):
-        es_map = es_maps[player_num - 1]
-
-        # Charger le layout XML du panel (selon le nombre de boutons)
-        btn_count = cfg_ini.getint(
-            'Panel',
-            f'Player{player_num}_buttons_count',
-            fallback=cfg_ini.getint('Panel', 'buttons_count', fallback=6)
-        )
-        try:
-            layout = load_layout(game, btn_count)
-        except (FileNotFoundError, ValueError):
-            logger.warning(f"No XML layout pour '{game}' ({btn_count} boutons)")
-            continue
 
-        # (1) Déterminer si jeu MK, PK ou TB
-        name_lower = game.lower()
-        is_mk = False
-        is_pk = False
-        is_tb = False
-
-        if name_lower in mk_games and mk_remap:
-            remap_type = mk_remap
-            is_mk = True
-        elif name_lower in pk_games and pk_remap:
-            remap_type = pk_remap
-            is_pk = True
-        elif name_lower in tb_games and tb_remap:
-            remap_type = TYPE_MAP  # on appliquera tb_remap en fin
-            is_tb = True
-        else:
-            remap_type = TYPE_MAP
 
-        # (2) On injecte toujours les directions UP/DOWN/LEFT/RIGHT
-        for direction in ('UP', 'DOWN', 'LEFT', 'RIGHT'):
-            key = f"P{player_num}_{direction}"
-            if key in ports_by_type:
-                add_direction(
-                    inp,
-                    ports_by_type[key],
-                    es_map,
-                    player_num,
-                    players_count
-                )
-            else:
-                logger.debug(f"No port pour direction {key}")
+# ——— Génération incrémentale : empreinte de tout ce qui détermine un <game>.cfg ———
+CFG_GENERATOR_VERSION = 1       # à incrémenter si write_cfg change : tout est regénéré
+FINGERPRINTS_NAME     = 'ledpanel_fingerprints.json'    # dans MAME_CFG_DIR
+BATCH_LOG_NAME        = 'generate_cfg.log'              # à côté de config.ini
+BATCH_CHUNKSIZE       = 8
 
-        # (3) Traitement spécial MK
-        if is_mk:
-            # 3.1) D’abord, INSÉRER START et COIN, tels quels
-            for btn in layout.findall('button'):
-                action = btn.get('function', '').upper().replace(' ', '_')
-                phys = int(btn.get('physical'))
-
-                if action == 'START':
-                    port_key = f"{player_num}_PLAYER_START"
-                    if port_key in ports_by_type:
-                        port = ports_by_type[port_key]
-                        # On génère <port type="P{player}_BUTTON{phys}">
-                        # → BUT : le JOYCODE final sera “BUTTON{remap_type[phys]}”
-                        add_button(inp, port, btn, es_map, player_num, phys, phys)
-                    else:
-                        logger.error(f"Missing port pour {port_key} (MK START)")
-                    continue
+_INI_SIG_CACHE: Dict[str, Tuple[Tuple[int, int], bytes]] = {}
 
-                if action == 'COIN':
-                    port_key = f"COIN_{player_num}"
-                    if port_key in ports_by_type:
-                        port = ports_by_type[port_key]
-                        add_button(inp, port, btn, es_map, player_num, phys, phys)
-                    else:
-                        logger.error(f"Missing port pour {port_key} (MK COIN)")
-                    continue
 
-            # 3.2) Maintenant, on génère systématiquement BUTTON1…BUTTON6 dans cet ordre fixe :
-            for button_name, possible_actions in BUTTON_TO_ACTION.items():
-                btn_elem = None
-                for action in possible_actions:
-                    for b in layout.findall('button'):
-                        func = b.get('function', '').upper().replace(' ', '_')
-                        if func == action:
-                            if b.get('color', '').lower() == 'black':
-                                btn_elem = None
-                            else:
-                                btn_elem = b
-                            break
-                    if btn_elem is not None:
-                        break
+def _ini_signature(path) -> bytes:
+    """[Panel] + [Mapping] de config.ini, normalisés (l’ordre des clés n’a pas d’effet sur le cfg)."""
+    try:
+        st = os.stat(path)
+        sig = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return b''
+    cached = _INI_SIG_CACHE.get(path)
+    if cached and cached[0] == sig:
+        return cached[1]
+    ini = configparser.ConfigParser()
+    ini.read(path, encoding='utf-8')
+    sections = [(s, sorted(ini.items(s, raw=True))) for s in ('Panel', 'Mapping') if ini.has_section(s)]
+    blob = repr(sections).encode('utf-8')
+    _INI_SIG_CACHE[path] = (sig, blob)
+    return blob
+
+
+def cfg_fingerprint(game, es_maps) -> str:
+    """
+    sha1 des entrées de write_cfg : <game>_inputs.cfg, systems/mame/<game>.xml,
+    config.ini ([Panel], [Mapping]) et les mappings ES. FileNotFoundError si
+    le fichier inputs n’existe pas (jeu jamais lancé / extrait).
+    """
+    h = hashlib.sha1(f"v{CFG_GENERATOR_VERSION}\0{game}\0".encode('utf-8'))
+    with open(os.path.join(MAME_CFG_DIR, f"{game}_inputs.cfg"), 'rb') as f:
+        h.update(f.read())
+    h.update(b'\0')
+    try:
+        with open(os.path.join(ARCADE_XML_DIR, f"{game}.xml"), 'rb') as f:
+            h.update(f.read())
+    except FileNotFoundError:
+        h.update(b'<no layout>')
+    h.update(b'\0' + _ini_signature(PANEL_CONFIG_INI) + b'\0')
+    h.update(repr([sorted((k, tuple(v)) for k, v in m.items()) for m in es_maps]).encode('utf-8'))
+    return h.hexdigest()
 
-                if btn_elem is None:
-                    continue
 
-                phys = int(btn_elem.get('physical'))
-                action_found = btn_elem.get('function', '').upper().replace(' ', '_')
-                port_key = f"P{player_num}_{action_found}"
-                if port_key not in ports_by_type:
-                    logger.error(f"Missing port pour key {port_key} (phys={phys}, action={action_found})")
-                    continue
+def load_fingerprints() -> Dict[str, Dict]:
+    path = os.path.join(MAME_CFG_DIR, FINGERPRINTS_NAME)
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Empreintes illisibles ({path}: {e}), tout sera regénéré")
+        return {}
+
+
+def save_fingerprints(fingerprints: Dict[str, Dict]):
+    path = os.path.join(MAME_CFG_DIR, FINGERPRINTS_NAME)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(fingerprints, f, indent=0, sort_keys=True)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning(f"Cannot write {path}: {e}")
 
-                orig_port = ports_by_type[port_key]
-                mask_val = orig_port.get('mask')
-                def_val  = orig_port.get('defvalue')
-                tag_val  = orig_port.get('tag')
-
-                new_port_type = f"P{player_num}_{button_name}"
-                new_port = ET.SubElement(
-                    inp,
-                    'port',
-                    tag=tag_val,
-                    type=new_port_type,
-                    mask=mask_val,
-                    defvalue=def_val
-                )
-
-                mapped_index = remap_type.get(phys, phys)
-                seq = ET.SubElement(new_port, 'newseq', type='standard')
-                seq.text = f"JOYCODE_{player_num}_BUTTON{mapped_index}"
-
-            # Fin du traitement MK pour ce joueur
-            continue
 
-        # (4) Traitement “normal” (punch-kick, tributton, etc.)
-        # ── Filtrage des ports du joueur (BUTTON_n + actions texte) ──
-        player_ports = []
-        for p_elem in ports:
-            t = p_elem.get('type', '').upper()
-            if t.startswith(f"P{player_num}_BUTTON"):
-                player_ports.append(p_elem)
-            else:
-                for actions in BUTTON_TO_ACTION.values():
-                    for action in actions:
-                        if t == f"P{player_num}_{action}":
-                            player_ports.append(p_elem)
-                            break
-                    else:
-                        continue
-                    break
-        player_ports.sort(key=lambda p: int(p.get('mask')))
-        # ──────────────────────────────────────────────────────────────
-
-        for btn in layout.findall('button'):
-            if btn.get('color', '').lower() == 'black':
-                continue
+def _file_sig(path) -> Optional[list]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
 
-            gb = btn.get('gameButton', '').upper()
-            phys = int(btn.get('physical'))
-
-            # (4.2) Boutons de combat A/B/X/Y/L1/R1/L2/R2
-            if gb in ('A', 'B', 'X', 'Y', 'L1', 'R1', 'L2', 'R2'):
-                port = None
-                type_index = None
-
-                if (name_lower in pk_games and pk_remap) or (name_lower in tb_games and tb_remap):
-                    type_index = remap_type.get(phys, phys)
-
-                    # ── On cherche BUTTON_n, puis l'action texte si besoin ──
-                    port_key = f"P{player_num}_BUTTON_{type_index}"
-                    port     = ports_by_type.get(port_key)
-
-                    if port is None:
-                        btn_key = f"BUTTON{type_index}"
-                        actions = BUTTON_TO_ACTION.get(btn_key, [])
-                        for action in actions:
-                            port_key2 = f"P{player_num}_{action}"
-                            if port_key2 in ports_by_type:
-                                port = ports_by_type[port_key2]
-                                break
-                    # ───────────────────────────────────────────────────────────
-
-                    if port is None:
-                        logger.error(
-                            f"Impossible de trouver un port pour phys={phys}, "
-                            f"type_index={type_index} (jeu={game}, joueur={player_num})"
-                        )
-                        continue  # on skippe ce bouton car port manquant
-
-                else:
-                    if not player_ports:
-                        logger.error(f"Pas assez de ports joueurs pour phys={phys}, gameButton={gb}")
-                        continue
-                    port = player_ports.pop(0)
-                    parts = port.get('type').split('_')
-                    try:
-                        type_index = int(parts[2])
-                    except (IndexError, ValueError):
-                        logger.error(f"Format inattendu pour port {port.get('type')}")
-                        continue
-
-                # Au point où l'on en est, port et type_index sont définis
-                add_button(inp, port, btn, es_map, player_num, type_index, phys)
-
-            # (4.3) Bouton START (hors MK)
-            elif gb == 'START':
-                # Essayer le nom correct, puis l'ancien
-                port_key = f"{player_num}_PLAYER_START"
-                if port_key not in ports_by_type:
-                    port_key = f"START_{player_num}"
-                if port_key not in ports_by_type:
-                    logger.error(f"Missing port pour START (clés testées: {player_num}_PLAYER_START et START_{player_num})")
-                    continue
-                port = ports_by_type[port_key]
-                type_index = phys
-                add_button(inp, port, btn, es_map, player_num, type_index, phys)
-
-            # (4.4) Bouton COIN (hors MK)
-            elif gb == 'COIN':
-                port_key = f"COIN_{player_num}"
-                if port_key not in ports_by_type:
-                    logger.error(f"Missing port pour COIN_{player_num}")
-                    continue
-                port = ports_by_type[port_key]
-                type_index = phys
-                add_button(inp, port, btn, es_map, player_num, type_index, phys)
 
-            else:
-                logger.debug(f"Bouton XML non reconnu: gameButton={gb}, phys={phys}")
-                continue
+def input_fingerprint(inp) -> str:
+    """sha1 canonique d’un <input> : balises, attributs triés, textes sans blancs (l’indentation n’y entre pas)."""
+    h = hashlib.sha1()
 
-        # (5) Si tributton : réajuster newseq selon tb_remap
-        if is_tb:
-            for port_el in inp.findall('port'):
-                seq = port_el.find('newseq')
-                if seq is None or not seq.text:
-                    continue
-                parts = seq.text.split('BUTTON')
-                if len(parts) != 2:
-                    continue
-                try:
-                    old_phys = int(parts[1])
-                except ValueError:
-                    continue
-                if old_phys in tb_remap:
-                    new_phys = tb_remap[old_phys]
-                    seq.text = f"JOYCODE_{player_num}_BUTTON{new_phys}"
+    def walk(elem):
+        h.update(f"<{elem.tag} {sorted(elem.attrib.items())!r}>{(elem.text or '').strip()}".encode('utf-8'))
+        for child in elem:
+            walk(child)
+        h.update(b'</>')
 
-    # Ré-indentation du XML avant écriture
-    indent(root)
-    tree.write(cfg_path, encoding="utf-8", xml_declaration=True)
-    logger.info(f"Wrote {cfg_path}")
+    walk(inp)
+    return h.hexdigest()
 
 
+# Compteurs du process (service ou worker batch) : ce que les sauts ont évité
+CFG_STATS = {'up-to-date': 0, 'unchanged': 0, 'written': 0, 'backups': 0, 'backups_skipped': 0,
+             'bytes_written': 0, 'bytes_avoided': 0, 'build_ms': 0.0, 'write_ms': 0.0}
 
 
+def generate_game_cfg(game, es_maps, record=None, force: bool = False) -> Tuple[str, Dict]:
+    """
+    Met <game>.cfg à jour, sans rien écrire quand rien ne change. record (manifeste) :
+    {'source': cfg_fingerprint, 'input': input_fingerprint, 'cfg': [mtime_ns, taille] après notre écriture}.
+      - 'up-to-date' : mêmes sources et cfg intact depuis notre écriture → rien n’est relu ;
+      - 'unchanged'  : <input> reconstruit en mémoire identique à celui du fichier → ni backup ni écriture ;
+      - 'written'    : <input> remplacé. Le backup n’est fait que si le cfg ne sort pas de notre
+        dernière écriture (cfg d’origine, ou modifié depuis par MAME / l’utilisateur) :
+        <game>_backup.cfg garde ainsi la dernière version qui n’est pas la nôtre.
+    Renvoie (statut, nouveau record).
+    """
+    record   = record if isinstance(record, dict) else {}    # ancien manifeste : empreinte seule
+    cfg_path = os.path.join(MAME_CFG_DIR, f"{game}.cfg")
+    source   = cfg_fingerprint(game, es_maps)
+    cfg_sig  = _file_sig(cfg_path)
+    ours     = cfg_sig is not None and record.get('cfg') == cfg_sig
+    if not force and ours and record.get('source') == source:
+        CFG_STATS['up-to-date'] += 1
+        CFG_STATS['bytes_avoided'] += 2 * cfg_sig[1]
+        return 'up-to-date', record
+
+    t0 = time.perf_counter()
+    ports  = load_port_index(os.path.join(MAME_CFG_DIR, f"{game}_inputs.cfg"))
+    inp    = build_input(game, es_maps, ports)
+    digest = input_fingerprint(inp)
+    tree   = None
+    if ours:
+        current = record.get('input')
+    elif cfg_sig is not None:
+        tree = ET.parse(cfg_path)
+        old_input = tree.getroot().find('.//system/input')
+        current = input_fingerprint(old_input) if old_input is not None else None
+    else:
+        current = None
+    CFG_STATS['build_ms'] += (time.perf_counter() - t0) * 1000
+    if not force and current == digest:
+        CFG_STATS['unchanged'] += 1
+        CFG_STATS['bytes_avoided'] += 2 * cfg_sig[1]
+        logger.info(f"{game}.cfg : <input> inchangé, ni backup ni écriture")
+        return 'unchanged', {'source': source, 'input': digest, 'cfg': cfg_sig}
+
+    t0 = time.perf_counter()
+    if cfg_sig is not None and not ours:
+        backup_cfg(game)
+        CFG_STATS['backups'] += 1
+        CFG_STATS['bytes_written'] += cfg_sig[1]
+    elif cfg_sig is not None:
+        CFG_STATS['backups_skipped'] += 1
+        CFG_STATS['bytes_avoided'] += cfg_sig[1]
+    write_input(game, tree if tree is not None else load_cfg_tree(game), inp)
+    new_sig = _file_sig(cfg_path)
+    CFG_STATS['written'] += 1
+    CFG_STATS['bytes_written'] += new_sig[1]
+    CFG_STATS['write_ms'] += (time.perf_counter() - t0) * 1000
+    return 'written', {'source': source, 'input': digest, 'cfg': new_sig}
+
+
+# ——— Mode batch : tous les <game>_inputs.cfg du romset, en parallèle sur plusieurs process ———
+class _ListHandler(logging.Handler):
+    """Garde les warnings/erreurs du jeu en cours pour le résumé (un par process worker)."""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(f"{record.levelname}: {record.getMessage()}")
+
+
+_BATCH_CAPTURE: Optional[_ListHandler] = None
+
+
+def _batch_init(paths: Dict[str, str]):
+    """Initializer des workers : mêmes chemins que le parent, logs réduits aux warnings capturés."""
+    global _BATCH_CAPTURE
+    globals().update(paths)
+    logger.setLevel(logging.WARNING)
+    logger.propagate = False
+    _BATCH_CAPTURE = _ListHandler()
+    logger.addHandler(_BATCH_CAPTURE)
+
+
+def _batch_game(task) -> Dict:
+    game, es_maps, record, force = task
+    capture = _BATCH_CAPTURE
+    if capture is not None:
+        capture.messages = []
+    t0 = time.perf_counter()
+    before = dict(CFG_STATS)
+    result = {'game': game, 'status': 'failed', 'record': None, 'error': None}
+    try:
+        result['status'], result['record'] = generate_game_cfg(game, es_maps, record, force)
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['ms'] = round((time.perf_counter() - t0) * 1000, 1)
+    result['io'] = {k: CFG_STATS[k] - before[k] for k in CFG_STATS}
+    result['messages'] = list(capture.messages) if capture is not None else []
+    return result
+
+
+def find_batch_games(games=None) -> Tuple[list, list]:
+    """(jeux avec inputs + layout, jeux avec inputs mais sans systems/mame/<game>.xml)."""
+    suffix = '_inputs.cfg'
+    try:
+        names = sorted(f[:-len(suffix)] for f in os.listdir(MAME_CFG_DIR) if f.endswith(suffix))
+    except FileNotFoundError:
+        names = []
+    if games:
+        wanted = set(games)
+        names = [g for g in names if g in wanted]
+    ready, no_layout = [], []
+    for game in names:
+        (ready if os.path.exists(os.path.join(ARCADE_XML_DIR, f"{game}.xml")) else no_layout).append(game)
+    return ready, no_layout
+
+
+def batch_generate(jobs: Optional[int] = None, force: bool = False, games=None,
+                   log_path: Optional[str] = None) -> Dict:
+    """
+    Génère tous les <game>.cfg en une passe. Incrémental : un jeu dont les sources
+    ou le <input> n’ont pas changé n’est pas réécrit (generate_game_cfg).
+    jobs=1 : tout dans ce process (débogage).
+    Écrit un résumé (totaux + une ligne par jeu en échec/avertissement) dans log_path.
+    """
+    global _BATCH_CAPTURE
+    t0 = time.perf_counter()
+    ready, no_layout = find_batch_games(games)
+    es_maps = [dict(m) for m in load_es_input(ES_INPUT_CFG)]     # MappingProxyType ne se pickle pas
+    fingerprints = load_fingerprints()
+    tasks = [(g, es_maps, fingerprints.get(g), force) for g in ready]
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(tasks) or 1))
+
+    capture, previous = None, _BATCH_CAPTURE
+    if jobs == 1:
+        # même capture que dans les workers : le journal est identique quel que soit --jobs
+        capture = _BATCH_CAPTURE = _ListHandler()
+        logger.addHandler(capture)
+        results = map(_batch_game, tasks)
+        pool = None
+    else:
+        paths = {k: globals()[k] for k in ('ES_INPUT_CFG', 'PANEL_CONFIG_INI', 'MAME_CFG_DIR', 'ARCADE_XML_DIR')}
+        pool = ProcessPoolExecutor(max_workers=jobs, initializer=_batch_init, initargs=(paths,))
+        results = pool.map(_batch_game, tasks, chunksize=BATCH_CHUNKSIZE)
+
+    stats = {'games': len(ready) + len(no_layout), 'written': 0, 'unchanged': 0, 'up-to-date': 0,
+             'no-layout': len(no_layout), 'failed': 0, 'warnings': 0, 'jobs': jobs}
+    io = dict.fromkeys(CFG_STATS, 0)
+    report = []
+    try:
+        for res in results:
+            stats[res['status']] += 1
+            for k, v in res['io'].items():
+                io[k] += v
+            if res['record']:
+                fingerprints[res['game']] = res['record']
+            else:
+                fingerprints.pop(res['game'], None)
+            if res['error']:
+                report.append(f"FAILED   {res['game']}: {res['error']}")
+            elif res['messages'] and res['status'] == 'written':
+                stats['warnings'] += 1
+            for msg in res['messages']:
+                report.append(f"  {res['game']}: {msg}")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if capture is not None:
+            logger.removeHandler(capture)
+            _BATCH_CAPTURE = previous
+        save_fingerprints(fingerprints)
+    report.extend(f"NOLAYOUT {g}" for g in no_layout)
+    stats['ms'] = round((time.perf_counter() - t0) * 1000)
+    stats['io'] = io
+
+    summary = (f"{stats['games']} game(s): {stats['written']} written, {stats['unchanged']} unchanged, "
+               f"{stats['up-to-date']} up to date, {stats['no-layout']} without layout, {stats['failed']} failed, "
+               f"{stats['warnings']} with warnings — {stats['ms']} ms, {jobs} process(es)")
+    io_line = (f"I/O: {io['bytes_written'] // 1024} KiB written, {io['bytes_avoided'] // 1024} KiB avoided, "
+               f"{io['backups']} backup(s), {io['backups_skipped']} kept; "
+               f"build {io['build_ms']:.0f} ms, write {io['write_ms']:.0f} ms (all processes)")
+    logger.info(io_line)
+    logger.info(summary)
+    log_path = log_path or os.path.join(os.path.dirname(PANEL_CONFIG_INI), BATCH_LOG_NAME)
+    try:
+        with open(log_path, 'w', encoding='utf-8') as f:
+            f.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {summary}\n{io_line}\n")
+            f.write(f"cfg: {MAME_CFG_DIR}\nlayouts: {ARCADE_XML_DIR}\n\n")
+            f.write('\n'.join(report) + ('\n' if report else ''))
+    except OSError as e:
+        logger.warning(f"Cannot write {log_path}: {e}")
+    stats['log'] = log_path
+    return stats
+
+
+MAME_CFG_EVENTS = ('game-selected', 'game-start')    # game-start : rattrape une sélection manquée
+
+
+class GameHandler:
+    """Abonné du bus d’événements ES (LPEventBus) : cfg MAME du jeu sélectionné."""
 
-class GameHandler(FileSystemEventHandler):
     def __init__(self):
         self.last_game = None
 
-    def on_modified(self, event):
-        if event.is_directory or os.path.basename(event.src_path) != os.path.basename(ES_EVENT_FILE):
-            return
-        emulator, game = parse_es_event(ES_EVENT_FILE)
-        if emulator != 'mame' or game == self.last_game:
+    def on_es_event(self, event: EsEvent):
+        game = event.game
+        if event.system != 'mame' or not game or game == self.last_game:
             return
 
         logger.info(f"Selected MAME game: {game}")
         try:
+            es_maps = load_es_input(ES_INPUT_CFG)
+            fingerprints = load_fingerprints()
+            t0 = time.perf_counter()
             try:
-                ports = load_mame_ports(os.path.join(MAME_CFG_DIR, f"{game}_inputs.cfg"))
+                status, record = generate_game_cfg(game, es_maps, fingerprints.get(game))
             except FileNotFoundError:
                 logger.error(f"Fichier inputs introuvable pour '{game}', on quitte write_cfg.")
                 return
-            es_maps = load_es_input(ES_INPUT_CFG)
-            backup_cfg(game)
-            write_cfg(game, es_maps, ports)
+            if record != fingerprints.get(game):
+                fingerprints[game] = record
+                save_fingerprints(fingerprints)
+            logger.info(f"{game}.cfg : {status} en {(time.perf_counter() - t0) * 1000:.1f} ms — {CFG_STATS}")
             self.last_game = game
         except Exception:
             logger.exception("Erreur lors de l'injection de layout")
 
 def main():
+    import argparse
+    global ES_INPUT_CFG, PANEL_CONFIG_INI, MAME_CFG_DIR, ARCADE_XML_DIR
+    parser = argparse.ArgumentParser(description="Injection des layouts LedPanel dans les cfg MAME")
+    parser.add_argument('--batch', action='store_true',
+                        help="génère tous les <game>.cfg qui ont un layout, puis quitte")
+    parser.add_argument('--force', action='store_true', help="batch : ignore les empreintes")
+    parser.add_argument('--jobs', type=int, default=None, help="batch : nombre de process (défaut : CPU)")
+    parser.add_argument('--games', default=None, help="batch : liste de jeux séparés par des virgules")
+    parser.add_argument('--log', default=None, help=f"batch : résumé (défaut : {BATCH_LOG_NAME} à côté de config.ini)")
+    parser.add_argument('--cfg-dir', default=MAME_CFG_DIR)
+    parser.add_argument('--layouts-dir', default=ARCADE_XML_DIR)
+    parser.add_argument('--config', default=PANEL_CONFIG_INI)
+    parser.add_argument('--es-input', default=ES_INPUT_CFG)
+    args = parser.parse_args()
+    MAME_CFG_DIR, ARCADE_XML_DIR = args.cfg_dir, args.layouts_dir
+    PANEL_CONFIG_INI, ES_INPUT_CFG = args.config, args.es_input
+
+    if args.batch:
+        games = [g.strip() for g in args.games.split(',') if g.strip()] if args.games else None
+        stats = batch_generate(args.jobs, args.force, games, args.log)
+        print(f"{stats['written']} written, {stats['unchanged']} unchanged, {stats['up-to-date']} up to date, {stats['no-layout']} without layout, "
+              f"{stats['failed']} failed in {stats['ms']} ms → {stats['log']}")
+        return
+
+    # Autonome (sans LPEvents, qui abonne déjà GameHandler à son propre bus)
     if not os.path.exists(ES_EVENT_FILE):
         return
-    observer = Observer()
-    observer.schedule(GameHandler(), os.path.dirname(ES_EVENT_FILE), recursive=False)
-    observer.start()
+    bus = EventBus(ES_EVENT_FILE)
+    bus.subscribe('mame-cfg', GameHandler().on_es_event, kinds=MAME_CFG_EVENTS)
+    bus.start()
     logger.info("Injector running")
     try:
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
-        observer.stop()
-    observer.join()
+        pass
+    bus.stop()
+    logger.info(f"Event bus: {bus.summary()}")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    multiprocessing.freeze_support()    # exe PyInstaller : les workers du batch relancent l’exe
+    main()
@@ -0,0 +1,196 @@
+# LPPreview.py — aperçus PNG des layouts : couleur de chaque bouton à sa position x/y du XML
+# -----------------------------------------------------------------------------
+#   python LPPreview.py [--systems-dir DIR] [--out DIR] [--force] [--systems-only]
+#
+# Un aperçu est identifié par le hash de ce qu’il dessine (couleurs + positions),
+# pas par le nom du layout : deux layouts identiques partagent la même image, et
+# modifier un XML donne une nouvelle clé (l’ancienne image est simplement ignorée).
+# Cache : previews/<clé>.png sur disque + clé → chemin en mémoire.
+# Le rendu ne dépend que de PIL : le mode batch tourne sans affichage (Linux headless).
+# -----------------------------------------------------------------------------
+
+import os
+import sys
+import time
+import hashlib
+import logging
+import threading
+import xml.etree.ElementTree as ET
+from typing import Dict, Optional, Tuple
+
+from PIL import Image, ImageDraw
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR       = os.path.dirname(os.path.abspath(__file__))
+PREVIEW_DIR    = os.path.join(BASE_DIR, 'previews')
+PREVIEW_SIZE   = (192, 96)
+PREVIEW_BG     = '#2961b0'      # même fond que l’OSD (LPEvents.BG_COLOR)
+RENDER_VERSION = 1              # à incrémenter si le dessin change : invalide les PNG existants
+JOY_POS        = (12.0, 50.0)   # le <joystick> n’a pas de x/y : dessiné à gauche
+
+# Couleurs des noms de la palette (LPProtocol.PALETTE) pour l’écran
+PREVIEW_RGB = {
+    'RED': (230, 40, 40),     'YELLOW': (245, 220, 40), 'BLUE': (40, 80, 235),
+    'WHITE': (245, 245, 245), 'LIME': (160, 240, 60),   'GREEN': (40, 190, 70),
+    'LEMON': (235, 240, 110), 'TURQUOISE': (50, 210, 200), 'BLACK': None,
+    'BROWN': (140, 85, 40),   'GOLD': (225, 180, 40),   'ORANGE': (245, 140, 30),
+    'CYAN': (40, 220, 240),   'PURPLE': (150, 50, 200), 'VIOLET': (190, 120, 230),
+    'GREY': (150, 150, 150),  'GRAY': (150, 150, 150),  'PINK': (245, 130, 190),
+    'OFF': None,
+}
+
+Shapes = Tuple[Tuple[str, str, float, float], ...]
+
+_PREVIEW_CACHE: Dict[str, str] = {}     # clé → chemin du PNG
+_PREVIEW_LOCK = threading.Lock()
+
+
+def layout_shapes(layout) -> Shapes:
+    """
+    Ce qu’un aperçu dessine pour un élément <layout> : (id, COULEUR, x, y) du joystick
+    puis de chaque bouton placé sur le panel (physical="0" = directions, ignorées).
+    """
+    shapes = []
+    joy = layout.find('joystick')
+    if joy is not None:
+        shapes.append(('JOY', joy.get('color', 'BLACK').upper(), *JOY_POS))
+    for btn in layout.findall('button'):
+        if btn.get('physical') == '0':
+            continue
+        try:
+            x, y = float(btn.get('x')), float(btn.get('y'))
+        except (TypeError, ValueError):
+            continue
+        shapes.append((btn.get('id', '').upper(), btn.get('color', 'BLACK').upper(), x, y))
+    return tuple(shapes)
+
+
+def preview_key(shapes: Shapes) -> str:
+    blob = repr((RENDER_VERSION, PREVIEW_SIZE, shapes)).encode('utf-8')
+    return hashlib.sha1(blob).hexdigest()[:16]
+
+
+def render_layout(shapes: Shapes) -> Image.Image:
+    """Boutons en disques colorés (éteints : contour seul), START/COIN plus petits, joystick en boule."""
+    w, h   = PREVIEW_SIZE
+    margin = 8
+    img    = Image.new('RGB', PREVIEW_SIZE, PREVIEW_BG)
+    draw   = ImageDraw.Draw(img)
+    for ident, color, x, y in shapes:
+        cx = margin + (w - 2 * margin) * x / 100.0
+        cy = margin + (h - 2 * margin) * y / 100.0
+        r  = h * (0.045 if ident in ('START', 'COIN') else 0.065)
+        rgb = PREVIEW_RGB.get(color, (128, 128, 128))
+        if ident == 'JOY':
+            draw.line((cx, cy, cx, cy + r * 2.2), fill=(20, 20, 20), width=max(2, int(r / 3)))
+            r *= 1.2
+        box = (cx - r, cy - r, cx + r, cy + r)
+        if rgb is None:
+            draw.ellipse(box, fill=(25, 25, 35), outline=(90, 90, 110))
+        else:
+            draw.ellipse(box, fill=rgb, outline=(15, 15, 15))
+    return img
+
+
+def get_preview(shapes: Shapes, out_dir: Optional[str] = None, force: bool = False) -> Optional[str]:
+    """Chemin du PNG de l’aperçu : mémoire, sinon disque, sinon rendu + écriture atomique."""
+    if not shapes:
+        return None
+    out_dir = out_dir or PREVIEW_DIR
+    key  = preview_key(shapes)
+    path = os.path.join(out_dir, key + '.png')
+    if not force:
+        with _PREVIEW_LOCK:
+            cached = _PREVIEW_CACHE.get(key)
+        if cached == path:
+            return path
+        if os.path.exists(path):
+            with _PREVIEW_LOCK:
+                _PREVIEW_CACHE[key] = path
+            return path
+    try:
+        os.makedirs(out_dir, exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        render_layout(shapes).save(tmp, 'PNG', optimize=True)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning(f"Cannot write preview {path}: {e}")
+        return None
+    with _PREVIEW_LOCK:
+        _PREVIEW_CACHE[key] = path
+    return path
+
+
+def render_all(systems_dir: str, out_dir: Optional[str] = None, force: bool = False,
+               recursive: bool = True) -> Dict[str, int]:
+    """
+    Aperçus de tous les layouts de systems/ en un passage : XML système, et ceux
+    des jeux (sous-dossiers) si recursive — sinon ils sont rendus à la demande.
+    """
+    out_dir = out_dir or PREVIEW_DIR
+    t0 = time.perf_counter()
+    stats = {'files': 0, 'layouts': 0, 'unique': 0, 'rendered': 0, 'cached': 0, 'errors': 0}
+    seen = set()
+    for dirpath, dirs, files in os.walk(systems_dir):
+        if not recursive:
+            dirs[:] = []
+        for fname in files:
+            if not fname.lower().endswith('.xml'):
+                continue
+            stats['files'] += 1
+            try:
+                root = ET.parse(os.path.join(dirpath, fname)).getroot()
+            except (ET.ParseError, OSError) as e:
+                stats['errors'] += 1
+                logger.debug(f"preview: skip {fname}: {e}")
+                continue
+            for layout in root.iter('layout'):
+                shapes = layout_shapes(layout)
+                if not shapes:
+                    continue
+                stats['layouts'] += 1
+                key = preview_key(shapes)
+                if key in seen:
+                    continue
+                seen.add(key)
+                stats['unique'] += 1
+                path = os.path.join(out_dir, key + '.png')
+                if not force and os.path.exists(path):
+                    stats['cached'] += 1
+                    with _PREVIEW_LOCK:
+                        _PREVIEW_CACHE[key] = path
+                elif get_preview(shapes, out_dir, force=True):
+                    stats['rendered'] += 1
+                else:
+                    stats['errors'] += 1
+    stats['ms'] = round((time.perf_counter() - t0) * 1000)
+    return stats
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Aperçus PNG des layouts de systems/")
+    parser.add_argument('--systems-dir', default=None,
+                        help="défaut : systems/ du plugin, sinon dist/systems")
+    parser.add_argument('--out', default=PREVIEW_DIR)
+    parser.add_argument('--force', action='store_true', help="tout redessiner")
+    parser.add_argument('--systems-only', action='store_true', help="sans les XML de jeux")
+    args = parser.parse_args()
+
+    systems_dir = args.systems_dir
+    if systems_dir is None:
+        systems_dir = os.path.join(BASE_DIR, 'systems')
+        if not os.path.isdir(systems_dir):
+            systems_dir = os.path.join(BASE_DIR, 'dist', 'systems')
+    if not os.path.isdir(systems_dir):
+        print(f"systems dir not found: {systems_dir}")
+        sys.exit(1)
+    stats = render_all(systems_dir, args.out, args.force, recursive=not args.systems_only)
+    print(f"{stats['layouts']} layouts in {stats['files']} XML → {stats['unique']} distinct previews: "
+          f"{stats['rendered']} rendered, {stats['cached']} cached, {stats['errors']} errors "
+          f"in {stats['ms']} ms → {args.out}")
+
+
+if __name__ == '__main__':
+    main()
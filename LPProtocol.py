@@ -0,0 +1,306 @@
+# LPProtocol.py — protocole série binaire hôte → Pico (rp2040/main.py)
+# -----------------------------------------------------------------------------
+# Trame v1 :  A5 | LEN | OP | PAYLOAD… | CRC8
+# Trame v2 :  A5 | LEN | SEQ | OP | PAYLOAD… | CRC8
+#   LEN  = nb d’octets de (SEQ +) OP + PAYLOAD (1..MAX_FRAME_LEN)
+#   CRC8 = polynôme 0x07, init 0, calculé sur LEN … PAYLOAD
+#
+# v2 : chaque commande porte un n° de séquence (0..255) posé au moment de l’envoi
+# (stamp) ; en texte c’est un préfixe « #N ». Le firmware répond « OK #N » ou
+# « ERR #N … » et ignore (en ré-acquittant) un N qu’il vient de traiter, ce qui
+# rend la retransmission sans risque.
+#
+# Négociation : l’hôte envoie la ligne texte « PING=<version> » ; un firmware
+# récent répond « PONG proto=<n> » et accepte alors aussi les trames, un ancien
+# répond « PONG » et on reste en texte. Le texte reste toujours accepté
+# (debug au terminal, commandes rares : Fade*, Wave, Chase, Rainbow…).
+#
+# Boutons : 1..12 = B1..B12, puis BTN_COIN / BTN_START / BTN_JOY.
+# Couleurs : index dans PALETTE (u16, ou u8 avec FLAG_COLOR_U8 quand tous < 256).
+# Couleurs brutes : 4 valeurs PWM 12 bits (B,G,V,R) tassées sur 6 octets.
+#
+# PALETTE doit rester identique à celle de rp2040/main.py.
+# -----------------------------------------------------------------------------
+
+import struct
+from typing import Dict, List, Optional
+
+PROTO_VERSION = 2
+
+MAGIC         = 0xA5
+MAX_FRAME_LEN = 96
+
+# Opcodes
+OP_INIT             = 0x10
+OP_SET_BUTTON       = 0x20
+OP_SET_BUTTON_RAW   = 0x21
+OP_SET_PANEL        = 0x22
+OP_SET_PANEL_COLORS = 0x23
+OP_RESTORE_PANEL    = 0x24
+OP_BLINK_BUTTON     = 0x25
+OP_STOP_BLINK       = 0x26
+OP_SET_PANEL_RAW    = 0x27
+
+# Flags de OP_SET_PANEL_COLORS
+FLAG_DEFAULT  = 0x01
+FLAG_COLOR_U8 = 0x02
+
+# Index de boutons spéciaux
+BTN_COIN, BTN_START, BTN_JOY = 0xF0, 0xF1, 0xF2
+
+NAMED_COLORS = (
+    'RED', 'YELLOW', 'BLUE', 'WHITE', 'LIME', 'GREEN', 'LEMON', 'TURQUOISE', 'BLACK',
+    'BROWN', 'GOLD', 'ORANGE', 'CYAN', 'PURPLE', 'VIOLET', 'GREY', 'GRAY', 'PINK',
+)
+PALETTE: List[str] = list(NAMED_COLORS) + [f"COL{i}" for i in range(1, 626)]
+PALETTE_INDEX: Dict[str, int] = {name: i for i, name in enumerate(PALETTE)}
+BLACK_INDEX = PALETTE_INDEX['BLACK']
+
+_SPECIAL_BUTTONS = {'COIN': BTN_COIN, 'START': BTN_START, 'JOY': BTN_JOY}
+
+
+def _crc8_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return bytes(table)
+
+_CRC8_TABLE = _crc8_table()
+
+
+def crc8(data: bytes, crc: int = 0) -> int:
+    for b in data:
+        crc = _CRC8_TABLE[crc ^ b]
+    return crc
+
+
+OP_NAMES = {
+    OP_INIT: 'INIT', OP_SET_BUTTON: 'SETBUTTON', OP_SET_BUTTON_RAW: 'SETBUTTONRAW',
+    OP_SET_PANEL: 'SETPANEL', OP_SET_PANEL_COLORS: 'SETPANELCOLORS', OP_RESTORE_PANEL: 'RESTOREPANEL',
+    OP_BLINK_BUTTON: 'BLINKBUTTON', OP_STOP_BLINK: 'STOPBLINK', OP_SET_PANEL_RAW: 'SETPANELRAW',
+}
+
+
+def build_frame(op: int, payload: bytes = b'', seq: Optional[int] = None) -> bytes:
+    """seq=None → trame v1 ; sinon trame v2 (seq réécrit par stamp() à l’envoi)."""
+    if seq is None:
+        body = bytes((len(payload) + 1, op)) + payload
+    else:
+        body = bytes((len(payload) + 2, seq & 0xFF, op)) + payload
+    if body[0] > MAX_FRAME_LEN:
+        raise ValueError(f"frame too long ({body[0]} bytes)")
+    return bytes((MAGIC,)) + body + bytes((crc8(body),))
+
+
+def pack12(values) -> bytes:
+    """4 valeurs 0..4095 → 6 octets (deux valeurs de 12 bits par tranche de 3 octets)."""
+    v = [max(0, min(4095, int(x))) for x in values]
+    return bytes((v[0] >> 4, ((v[0] & 0x0F) << 4) | (v[1] >> 8), v[1] & 0xFF,
+                  v[2] >> 4, ((v[2] & 0x0F) << 4) | (v[3] >> 8), v[3] & 0xFF))
+
+
+def button_index(name: str) -> Optional[int]:
+    name = name.strip().upper()
+    if name in _SPECIAL_BUTTONS:
+        return _SPECIAL_BUTTONS[name]
+    if name.startswith('B') and name[1:].isdigit() and 1 <= int(name[1:]) <= 12:
+        return int(name[1:])
+    return None
+
+
+def _panels_mask(spec: str) -> Optional[int]:
+    # « ALL » vaut panel 1, comme côté firmware
+    if spec.strip().upper() == 'ALL':
+        return 0x01
+    mask = 0
+    for p in spec.split('|'):
+        p = p.strip()
+        if not p.isdigit() or not 1 <= int(p) <= 8:
+            return None
+        mask |= 1 << (int(p) - 1)
+    return mask
+
+
+def _split(line: str):
+    """Découpe une ligne texte comme le firmware : (CMD, args, durée event ou 0, default=yes)."""
+    cmd, _, rest = line.partition('=')
+    args = [p.strip() for p in rest.split(',') if p.strip()]
+    low  = [p.lower() for p in args]
+    dur  = 0
+    if 'event=yes' in low:
+        i = low.index('event=yes')
+        if i == len(args) - 1 or not args[i + 1].isdigit():
+            return None
+        dur = int(args[i + 1])
+        del args[i:i + 2]
+        del low[i:i + 2]
+    default = 'default=yes' in low
+    args = [a for a in args if a.lower() != 'default=yes']
+    return cmd.strip().upper(), args, dur, default
+
+
+def encode_line(line: str, proto: int = 1) -> Optional[bytes]:
+    """Une commande texte → trame binaire, ou None si elle doit rester en texte."""
+    seq = 0 if proto >= 2 else None
+
+    def build_frame_(op, payload=b''):
+        return build_frame(op, payload, seq)
+
+    parsed = _split(line)
+    if parsed is None:
+        return None
+    cmd, args, dur, default = parsed
+    if dur > 0xFFFF:
+        return None
+    try:
+        if cmd == 'SETBUTTON' and len(args) == 3:
+            btn, col = button_index(args[1]), PALETTE_INDEX.get(args[2].upper())
+            if btn is None or col is None:
+                return None
+            return build_frame_(OP_SET_BUTTON, struct.pack('<BBHH', int(args[0]), btn, col, dur))
+
+        if cmd == 'SETPANEL' and len(args) == 2:
+            col = PALETTE_INDEX.get(args[1].upper(), BLACK_INDEX)
+            return build_frame_(OP_SET_PANEL, struct.pack('<BHH', int(args[0]), col, dur))
+
+        if cmd == 'SETPANELCOLORS' and len(args) == 2 and not dur:
+            mask = _panels_mask(args[0])
+            if mask is None:
+                return None
+            items = []
+            for pair in args[1].split(';'):
+                if ':' not in pair:
+                    continue
+                b, c = pair.split(':', 1)
+                btn = button_index(b)
+                if btn is None:
+                    return None
+                # couleur inconnue (ex. « OFF ») → BLACK, comme le firmware
+                items.append((btn, PALETTE_INDEX.get(c.strip().upper(), BLACK_INDEX)))
+            flags = FLAG_DEFAULT if default else 0
+            if all(c < 256 for _, c in items):
+                flags |= FLAG_COLOR_U8
+                body = b''.join(struct.pack('<BB', b, c) for b, c in items)
+            else:
+                body = b''.join(struct.pack('<BH', b, c) for b, c in items)
+            return build_frame_(OP_SET_PANEL_COLORS, bytes((flags, mask, len(items))) + body)
+
+        if cmd == 'RESTOREPANEL' and len(args) == 1:
+            return build_frame_(OP_RESTORE_PANEL, bytes((int(args[0]),)))
+
+        if cmd == 'BLINKBUTTON' and len(args) == 6:
+            btn = button_index(args[1])
+            c1, c2 = PALETTE_INDEX.get(args[2].upper()), PALETTE_INDEX.get(args[3].upper())
+            if btn is None or c1 is None or c2 is None:
+                return None
+            return build_frame_(OP_BLINK_BUTTON, struct.pack('<BBHHHHH', int(args[0]), btn, c1, c2,
+                                                            int(args[4]), int(args[5]), dur))
+
+        if cmd == 'STOPBLINK' and not args:
+            return build_frame_(OP_STOP_BLINK)
+
+        if cmd == 'INIT' and not dur:
+            params = dict(a.split('=', 1) for a in args if '=' in a)
+            params = {k.strip().lower(): int(v) for k, v in params.items()}
+            return build_frame_(OP_INIT, bytes((params['panel'], params['count'], params['select'],
+                                               params['start'], params['joy'])))
+
+        if cmd == 'SETBUTTONRAW' and len(args) in (6, 7):
+            btn = button_index(args[1])
+            if btn is None:
+                return None
+            inv = len(args) == 7 and args[6].lower() in ('true', '1')
+            return build_frame_(OP_SET_BUTTON_RAW,
+                               bytes((int(args[0]), btn)) + pack12(args[2:6]) + bytes((inv,)))
+
+        if cmd == 'SETPANELRAW' and len(args) in (5, 6):
+            inv = args[5].lower() in ('true', '1') if len(args) == 6 else True
+            return build_frame_(OP_SET_PANEL_RAW, bytes((int(args[0]),)) + pack12(args[1:5]) + bytes((inv,)))
+    except (ValueError, KeyError, struct.error, OverflowError):
+        return None
+    return None
+
+
+def encode_command(cmd, proto: int) -> bytes:
+    """
+    Texte (une ou plusieurs lignes) → octets à envoyer pour la version de protocole négociée.
+    proto 0 : texte inchangé ; proto ≥ 1 : chaque ligne encodable devient une trame.
+    """
+    if isinstance(cmd, bytes):
+        cmd = cmd.decode('utf-8')
+    if proto < 1:
+        return cmd.encode('utf-8')
+    out = []
+    for line in cmd.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        frame = encode_line(line, proto)
+        out.append(frame if frame is not None else (line + '\n').encode('utf-8'))
+    return b''.join(out)
+
+
+def parse_pong(line: str) -> Optional[int]:
+    """« PONG proto=1 » → 1 ; « PONG » (ancien firmware) → 0 ; autre → None."""
+    line = line.strip()
+    if not line.upper().startswith('PONG'):
+        return None
+    for part in line.split()[1:]:
+        if part.lower().startswith('proto='):
+            try:
+                return int(part.split('=', 1)[1])
+            except ValueError:
+                return 0
+    return 0
+
+
+def iter_commands(data: bytes):
+    """Redécoupe un flux envoyé en commandes : trames (bytes commençant par MAGIC) ou lignes texte."""
+    i, n = 0, len(data)
+    while i < n:
+        if data[i] == MAGIC and i + 1 < n:
+            end = i + data[i + 1] + 3
+            yield data[i:end]
+            i = end
+        else:
+            end = data.find(b'\n', i)
+            end = n if end < 0 else end + 1
+            yield data[i:end]
+            i = end
+
+
+def stamp(cmd: bytes, seq: int, proto: int) -> bytes:
+    """Pose le n° de séquence sur une commande (trame v2 : octet SEQ + CRC recalculé ; texte : « #N »)."""
+    seq &= 0xFF
+    if cmd[:1] == bytes((MAGIC,)):
+        if proto < 2:
+            return cmd
+        body = bytearray(cmd[1:-1])
+        body[1] = seq
+        return bytes((MAGIC,)) + bytes(body) + bytes((crc8(body),))
+    return b'#%d ' % seq + cmd
+
+
+def command_kind(cmd: bytes, proto: int) -> str:
+    """Type de commande pour les stats : « SETBUTTON », « SETPANELCOLORS »…"""
+    if cmd[:1] == bytes((MAGIC,)) and len(cmd) > 3:
+        op = cmd[3] if proto >= 2 else cmd[2]
+        return OP_NAMES.get(op, f"OP{op:02X}")
+    line = cmd.decode('utf-8', 'ignore').strip()
+    if line.startswith('#'):
+        line = line.partition(' ')[2]
+    return line.partition('=')[0].strip().upper() or '?'
+
+
+def parse_ack(line: str):
+    """« OK #12 » → (12, True) ; « ERR #12 … » → (12, False) ; autre → None."""
+    parts = line.split()
+    if len(parts) >= 2 and parts[0] in ('OK', 'ERR') and parts[1].startswith('#'):
+        try:
+            return int(parts[1][1:]), parts[0] == 'OK'
+        except ValueError:
+            return None
+    return None
@@ -28,5 +28,18 @@ for %%a in (%args0%) do (
 )
 
 set "outputFile=..\..\..\..\plugins\LedPanelManager\ESEvent.arg"
+set "ackFile=..\..\..\..\plugins\LedPanelManager\ESEvent.ack"
+if exist !ackFile! del /q !ackFile!
 :: Écrire dans le fichier game-selected.arg
-echo !params! > !outputFile!
\ No newline at end of file
+echo !params! > !outputFile!
+
+:: Attendre que LPEvents ait écrit le remap (.rmp) avant de laisser partir le jeu,
+:: au plus 10 x 100 ms (REMAP_COMMIT_TIMEOUT_MS dans LPEvents.py)
+set "waitCount=0"
+:waitAck
+if exist !ackFile! goto ackDone
+if !waitCount! geq 10 goto ackDone
+ping -n 1 -w 100 192.0.2.1 >NUL
+set /a waitCount+=1
+goto waitAck
+:ackDone
\ No newline at end of file
@@ -1,7 +1,7 @@
-import serial, time
+import serial, sys, time
 
-# Ouvre le port série
-ser = serial.Serial('COM4', 115200, timeout=0.1)
+# Ouvre le port série (argument : autre port, ex. le pty de virtualpico.py)
+ser = serial.Serial(sys.argv[1] if len(sys.argv) > 1 else 'COM4', 115200, timeout=0.1)
 time.sleep(1)              # laisse le Pico démarrer et imprimer son prompt
 
 print("Tapez vos commandes (PING, SCAN, SetAllPanels=RED), puis Entrée. Ctrl+C pour quitter.")
@@ -58,10 +58,37 @@
 #
 # 16. MovingRainbow
 #    MovingRainbow=1,200,6
+#
+# Protocole binaire (voir LPProtocol.py côté hôte) :
+#    PING=1  → « PONG proto=1 », puis trames A5|LEN|OP|PAYLOAD|CRC8 acceptées
+#              en plus du texte ; PING sans version revient au texte seul.
+#    PING=2  → trames v2 A5|LEN|SEQ|OP|PAYLOAD|CRC8 ; en texte, préfixe « #N ».
+#    Une commande numérotée est acquittée par « OK #N » ou « ERR #N » ; un N
+#    déjà traité récemment (retransmission) est ré-acquitté sans être rejoué.
+#    Pendant le traitement d’une trame ou d’une commande numérotée, les
+#    print « OK: … » sont muets.
 # -----------------------------------------------------------------------------
 
 import sys, select, time, math
 from machine import Pin, SoftI2C
+try:
+    import micropython
+except ImportError:
+    micropython = None
+
+# ----- Sorties console : muettes pendant le traitement d’une commande acquittée -----
+_print     = print
+quiet      = False
+cur_failed = False      # un « Error… » a été émis pendant la commande en cours
+def print(*args, **kw):
+    global cur_failed
+    if quiet:
+        if args:
+            a0 = str(args[0])
+            if a0.startswith('Error') or a0.startswith('Unknown'):
+                cur_failed = True
+        return
+    _print(*args, **kw)
 
 # ----- Maintenance & heartbeat -----
 if Pin(28, Pin.IN, Pin.PULL_UP).value() == 0:
@@ -768,6 +795,11 @@ color_map = {
     'COL625': (4095, 4095, 4095, 4095, True),
 }
 
+# ----- Palette partagée avec l’hôte (LPProtocol.PALETTE) : l’ordre fait foi -----
+PALETTE = ['RED','YELLOW','BLUE','WHITE','LIME','GREEN','LEMON','TURQUOISE','BLACK',
+           'BROWN','GOLD','ORANGE','CYAN','PURPLE','VIOLET','GREY','GRAY','PINK']
+PALETTE += ['COL%d' % i for i in range(1, 626)]
+
 # ----- Button map & slot list -----
 button_map = {
   (1,'B1'):(pca0,0),(1,'B2'):(pca0,1),
@@ -894,7 +926,9 @@ def set_panel_colors(panels,list_str,save_default=False):
         if ':' in pair:
             b,c=pair.split(':',1)
             items[b.strip().upper()]=c.strip().upper()
-    
+    apply_panel_colors(panels,items,save_default)
+
+def apply_panel_colors(panels,items,save_default=False):
     # Remplacement COIN/START/JOY → B{idx}
     if coin_idx is not None and 'COIN' in items:
         items[f"B{coin_idx}"] = items.pop('COIN')
@@ -1027,7 +1061,7 @@ def schedule_rainbow(panels,step,loops,moving=False):
 
 def process_macros():
     now=time.ticks_ms()
-    cols=list(color_map.keys()); ncol=len(cols)
+    cols=PALETTE; ncol=len(cols)
     for m in macro_tasks[:]:
         if now < m['next']: continue
         if m['type']=='wave':
@@ -1083,10 +1117,164 @@ def process_macros():
             else:
                 m['next']=time.ticks_add(now,m['step'])
 
+# ----- Protocole binaire -----
+MAGIC         = 0xA5
+MAX_FRAME_LEN = 96
+PROTO_VERSION = 2
+OP_INIT             = 0x10
+OP_SET_BUTTON       = 0x20
+OP_SET_BUTTON_RAW   = 0x21
+OP_SET_PANEL        = 0x22
+OP_SET_PANEL_COLORS = 0x23
+OP_RESTORE_PANEL    = 0x24
+OP_BLINK_BUTTON     = 0x25
+OP_STOP_BLINK       = 0x26
+OP_SET_PANEL_RAW    = 0x27
+FLAG_DEFAULT  = 0x01
+FLAG_COLOR_U8 = 0x02
+BTN_NAMES = {0xF0:'COIN', 0xF1:'START', 0xF2:'JOY'}
+
+proto    = 0            # 0 = texte seul, 1 = trames acceptées
+stdin_b  = getattr(sys.stdin, 'buffer', sys.stdin)
+line_buf = bytearray()
+
+crc_table = bytearray(256)
+for _i in range(256):
+    _c = _i
+    for _ in range(8):
+        _c = ((_c << 1) ^ 0x07) & 0xFF if _c & 0x80 else (_c << 1) & 0xFF
+    crc_table[_i] = _c
+
+def crc8(data, crc=0):
+    for b in data:
+        crc = crc_table[crc ^ b]
+    return crc
+
+def u16(p, i):
+    return p[i] | (p[i+1] << 8)
+
+def unpack12(p, i):
+    return (p[i] << 4 | p[i+1] >> 4, (p[i+1] & 0x0F) << 8 | p[i+2],
+            p[i+3] << 4 | p[i+4] >> 4, (p[i+4] & 0x0F) << 8 | p[i+5])
+
+def btn_name(i):
+    return BTN_NAMES.get(i) or 'B%d' % i
+
+# Acquittements : n° en cours et derniers n° traités (détection des retransmissions)
+cur_seq     = None
+recent      = {}        # seq → True (OK) / False (ERR)
+recent_list = []
+RECENT_MAX  = 32
+
+def ack(seq, ok):
+    _print(("OK #%d" if ok else "ERR #%d") % seq)
+
+def begin_seq(seq):
+    global cur_seq, cur_failed, quiet
+    cur_seq, cur_failed, quiet = seq, False, True
+
+def finish_seq():
+    global cur_seq, quiet
+    if cur_seq is None:
+        return
+    ok = not cur_failed
+    recent[cur_seq] = ok
+    recent_list.append(cur_seq)
+    if len(recent_list) > RECENT_MAX:
+        recent.pop(recent_list.pop(0), None)
+    ack(cur_seq, ok)
+    cur_seq, quiet = None, False
+
+def set_proto(v):
+    global proto
+    proto = v
+    recent.clear(); del recent_list[:]
+    if micropython:
+        # Ctrl-C (0x03) peut apparaître dans une trame : on ne le traite plus comme interruption
+        micropython.kbd_intr(-1 if v else 3)
+
+def read_input():
+    """
+    Mode binaire : lit ce qui est disponible sur stdin.
+    Renvoie le corps d’une trame valide (bytes, sans LEN ni CRC), une ligne texte complète (str), ou None.
+    """
+    global line_buf
+    while True:
+        b = stdin_b.read(1)
+        if not b:
+            return None
+        c = b[0]
+        if c == MAGIC:
+            # les commandes texte sont en ASCII : un 0xA5 ouvre toujours une trame ;
+            # ce qui traîne dans line_buf (reste d’une trame dont le MAGIC s’est perdu) est jeté
+            if line_buf:
+                _print("ERR sync"); line_buf = bytearray()
+            hdr = stdin_b.read(1)
+            n = hdr[0]
+            if n == 0 or n > MAX_FRAME_LEN:
+                _print("ERR len"); return None
+            body = stdin_b.read(n + 1)
+            if len(body) != n + 1 or crc8(body[:n], crc8(hdr)) != body[n]:
+                _print("ERR crc"); return None
+            return body[:n]
+        if c == 10:
+            raw, line_buf = line_buf, bytearray()
+            try:
+                return raw.decode()
+            except UnicodeError:
+                # octets binaires d’une trame tronquée : ligne ignorée, l’hôte retransmettra
+                _print("ERR utf8"); return None
+        if c != 13:
+            line_buf.append(c)
+        if not poll.poll(0):
+            return None
+
+def handle_frame(op, p):
+    global panel_id, btn_count_global, coin_idx, start_idx, joy_idx
+    if op == OP_SET_BUTTON:
+        panel, btn, col, dur = p[0], btn_name(p[1]), PALETTE[u16(p,2)], u16(p,4)
+        if dur:
+            orig={btn:current_colors[(panel,btn)]}
+            restore_tasks.append({'type':'buttons','panel':panel,'original':orig,'end':time.ticks_add(time.ticks_ms(),dur)})
+        set_button(panel, btn, col)
+    elif op == OP_SET_PANEL_COLORS:
+        flags, mask, n = p[0], p[1], p[2]
+        step = 2 if flags & FLAG_COLOR_U8 else 3
+        items = {}
+        for i in range(3, 3 + n*step, step):
+            col = p[i+1] if step == 2 else u16(p, i+1)
+            items[btn_name(p[i])] = PALETTE[col]
+        panels = [i+1 for i in range(8) if mask >> i & 1]
+        apply_panel_colors(panels, items, flags & FLAG_DEFAULT)
+    elif op == OP_BLINK_BUTTON:
+        dur = u16(p,10)
+        add_blink(p[0], btn_name(p[1]), PALETTE[u16(p,2)], PALETTE[u16(p,4)], u16(p,6), u16(p,8),
+                  duration=dur or None, event=dur > 0)
+    elif op == OP_SET_PANEL:
+        dur = u16(p,3)
+        set_panel(p[0], PALETTE[u16(p,1)], event=dur > 0, duration=dur)
+    elif op == OP_RESTORE_PANEL:
+        restore_panel(p[0])
+    elif op == OP_STOP_BLINK:
+        stop_all_effects()
+    elif op == OP_SET_BUTTON_RAW:
+        b,g,v,r = unpack12(p,2)
+        set_button_raw(p[0], btn_name(p[1]), b, g, v, r, bool(p[8]))
+    elif op == OP_SET_PANEL_RAW:
+        b,g,v,r = unpack12(p,1)
+        set_panel_raw(p[0], b, g, v, r, bool(p[7]))
+    elif op == OP_INIT:
+        panel_id, btn_count_global, coin_idx, start_idx, joy_idx = p[0], p[1], p[2], p[3], p[4]
+    else:
+        _print("ERR op", op)
+
 # ----- Main REPL loop -----
 print("Commands: PING, SCAN, SetButton=, SetPanel=, SetPanelColors=, RestorePanel=, GetPanel=, FadePanel=, FadeButtons=, BlinkButton=, BlinkPanel=, StopBlink, Wave=, Chase=, Rainbow=, MovingRainbow=")
 
 while True:
+    # acquitte la commande numérotée précédente (même si elle est sortie par « continue »)
+    finish_seq()
+
     # heartbeat & async tasks
     if time.ticks_diff(time.ticks_ms(), last_hb) >= 1000:
         led.value(not led.value()); last_hb=time.ticks_ms()
@@ -1098,10 +1286,48 @@ while True:
         time.sleep(0.01)
         continue
 
-    line=sys.stdin.readline().strip()
+    if proto:
+        got = read_input()
+        if got is None:
+            continue
+        if not isinstance(got, str):
+            if proto >= 2:
+                seq, op, payload = got[0], got[1], got[2:]
+                if seq in recent:
+                    ack(seq, recent[seq]); continue
+                begin_seq(seq)
+            else:
+                op, payload = got[0], got[1:]
+                quiet = True
+            # comme en texte : toute commande sauf BlinkButton arrête blinks & macros
+            if op != OP_BLINK_BUTTON:
+                stop_all_effects()
+            try:
+                handle_frame(op, payload)
+            except Exception as e:
+                cur_failed = True
+                if cur_seq is None:
+                    _print("ERR", op, e)
+            if cur_seq is None:
+                quiet = False
+            finish_seq()
+            continue
+        line = got.strip()
+    else:
+        line=sys.stdin.readline().strip()
     if not line:
         continue
 
+    # « #N commande » : commande numérotée, acquittée au prochain tour de boucle
+    if line.startswith('#'):
+        tag, _, line = line.partition(' ')
+        line = line.strip()
+        if tag[1:].isdigit():
+            seq = int(tag[1:]) & 0xFF
+            if seq in recent:
+                ack(seq, recent[seq]); continue
+            begin_seq(seq)
+
     # on nouvelle commande, arrête blinks & macros
     #stop_all_effects()
     # parse cmd pour voir si c’est un BlinkButton
@@ -1155,7 +1381,14 @@ while True:
                 print(f"Error: valeur INIT invalide → {e}")
             continue
         if cmd=='PING':
-            led.value(not led.value()); print("PONG")
+            led.value(not led.value())
+            # PING=<version> : l’hôte sait parler binaire ; PING seul : hôte texte
+            if args and args[0].isdigit() and int(args[0]) >= 1:
+                set_proto(min(int(args[0]), PROTO_VERSION))
+                _print("PONG proto=%d" % proto)
+            else:
+                set_proto(0)
+                _print("PONG")
 
         elif cmd=='SCAN':
             print("Bus0:",i2c0.scan(),"Bus1:",i2c1.scan(),"Bus2:",i2c2.scan())
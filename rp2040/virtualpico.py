@@ -0,0 +1,428 @@
+# virtualpico.py — Pico virtuel : rp2040/main.py exécuté tel quel sous CPython
+# -----------------------------------------------------------------------------
+#   python rp2040/virtualpico.py [--link /tmp/ttyPICO] [--i2c-khz 400] [--pace]
+#
+# Le firmware tourne dans un thread, derrière un pseudo-terminal (Linux/macOS) :
+# LPEvents (port forcé ou [Serial] extra_ports), cmd.py et LPBench s’y connectent
+# comme au vrai Pico, via le chemin affiché (ou le lien --link).
+#
+# Modules MicroPython remplacés à l’import (main.py n’est pas modifié) :
+#   machine     : Pin (entrées en pull-up à 1, sorties mémorisées), SoftI2C → bus simulé
+#   time        : ticks_ms/us, ticks_add/diff (modulo 2^30), sleep/sleep_ms/sleep_us
+#   select      : poll() sur le pty
+#   sys         : stdin (texte + .buffer binaire) sur le pty, exit
+#   micropython : kbd_intr, const
+#
+# PCA9685 simulé (0x40 sur chacun des 3 bus) : registres, journal horodaté de
+# chaque écriture, et durée de chaque transaction I2C modélisée
+# (9 bits par octet + start/stop, à la fréquence demandée ou --i2c-khz).
+# --pace : le firmware attend réellement ce temps I2C (débits comparables au matériel) ;
+#          sinon il est seulement comptabilisé.
+# Le code Python du firmware s’exécute à la vitesse de l’hôte : seul l’I2C est modélisé.
+# -----------------------------------------------------------------------------
+
+import os
+import sys
+import math
+import time
+import types
+import select
+import builtins
+import threading
+from collections import deque
+
+MAIN_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+WRITE_LOG_MAX = 200_000     # écritures de registres conservées (les plus récentes)
+TICKS_PERIOD  = 1 << 30     # ticks_ms / ticks_us reviennent à 0, comme sur RP2040
+
+# Registres PCA9685 utiles au décodage
+PCA_ADDR   = 0x40
+MODE1      = 0x00
+MODE2      = 0x01
+LED0_ON_L  = 0x06
+PRESCALE   = 0xFE
+MODE1_AI   = 0x20
+
+
+class _Halt(BaseException):
+    """Levée dans le firmware par stop() ; BaseException pour traverser ses `except Exception`."""
+
+
+class SimPCA9685:
+    """Registres d’un PCA9685 (état après mise sous tension)."""
+
+    def __init__(self):
+        self.regs = bytearray(256)
+        self.regs[MODE1]    = 0x11      # SLEEP | ALLCALL
+        self.regs[MODE2]    = 0x04      # OUTDRV
+        self.regs[PRESCALE] = 0x1E
+
+    def write(self, reg, data):
+        ai = self.regs[MODE1] & MODE1_AI
+        for i, b in enumerate(data):
+            self.regs[(reg + i) & 0xFF if ai else reg] = b
+
+    def read(self, reg, n):
+        ai = self.regs[MODE1] & MODE1_AI
+        return bytes(self.regs[(reg + i) & 0xFF if ai else reg] for i in range(n))
+
+    def channel(self, ch):
+        """(on, off) 12 bits du canal ch."""
+        r = self.regs
+        base = LED0_ON_L + 4 * ch
+        return (r[base] | (r[base + 1] & 0x0F) << 8, r[base + 2] | (r[base + 3] & 0x0F) << 8)
+
+
+class SimI2C:
+    """Bus I2C simulé : périphériques par adresse, journal et temps de transaction."""
+
+    def __init__(self, pico, index, freq):
+        self.pico    = pico
+        self.index   = index
+        self.freq    = freq
+        self.devices = {PCA_ADDR: SimPCA9685()}
+
+    def _transfer(self, nbytes, restarts=0):
+        # start + stop (+ restart) ≈ 1 bit chacun, 8 bits + ACK par octet
+        bits = nbytes * 9 + 2 + restarts
+        self.pico._account(bits / (self.pico.i2c_hz or self.freq))
+
+    def _device(self, addr):
+        dev = self.devices.get(addr)
+        if dev is None:
+            raise OSError(19, 'ENODEV')     # même erreur que MicroPython
+        return dev
+
+    def writeto_mem(self, addr, reg, buf, addrsize=8):
+        self._transfer(2 + len(buf))
+        dev = self._device(addr)
+        dev.write(reg, bytes(buf))
+        self.pico._log_write(self.index, addr, reg, bytes(buf))
+
+    def readfrom_mem(self, addr, reg, n, addrsize=8):
+        self._transfer(3 + n, restarts=1)
+        return self._device(addr).read(reg, n)
+
+    def scan(self):
+        for _ in range(0x08, 0x78):         # une adresse par transaction
+            self._transfer(1)
+        return sorted(self.devices)
+
+
+class VirtualStdin:
+    """sys.stdin du firmware : texte (readline) et binaire (.buffer.read) sur un même tampon."""
+
+    def __init__(self, pico, fd):
+        self.pico   = pico
+        self.fd     = fd
+        self.buf    = bytearray()
+        self.buffer = self
+
+    def fileno(self):
+        return self.fd
+
+    def _fill(self, timeout):
+        if self.pico.stopping:
+            raise _Halt()
+        r, _, _ = select.select([self.fd], [], [], timeout)
+        if r:
+            try:
+                data = os.read(self.fd, 4096)
+            except OSError:
+                data = b''
+            self.pico.stats['rx_bytes'] += len(data)
+            self.buf += data
+
+    def ready(self, timeout):
+        if not self.buf:
+            self._fill(timeout)
+        return bool(self.buf)
+
+    def read(self, n=1):
+        while len(self.buf) < n:
+            self._fill(0.05)
+        data = bytes(self.buf[:n])
+        del self.buf[:n]
+        return data
+
+    def readline(self):
+        while b'\n' not in self.buf:
+            self._fill(0.05)
+        nl = self.buf.index(b'\n') + 1
+        line = bytes(self.buf[:nl])
+        del self.buf[:nl]
+        return line.decode('utf-8', 'ignore')
+
+
+class VirtualPico:
+    """
+    Exécute main.py dans un thread avec des modules MicroPython simulés, relié à un pty.
+    port   : chemin à ouvrir côté hôte (pyserial) ;
+    ns     : globals du firmware (current_colors, proto…) ;
+    writes : journal (t, bus, addr, reg, données) des écritures I2C.
+    """
+
+    def __init__(self, firmware=MAIN_PY, i2c_khz=None, pace=False, link=None, maintenance=False):
+        self.firmware    = firmware
+        self.i2c_hz      = i2c_khz * 1000 if i2c_khz else None
+        self.pace        = pace
+        self.link        = link
+        self.maintenance = maintenance
+        self.stopping    = False
+        self.error       = None
+        self.buses       = []
+        self.pins        = {}
+        self.ns          = {}
+        self.writes      = deque(maxlen=WRITE_LOG_MAX)
+        self.lock        = threading.Lock()
+        self.debt        = 0.0          # temps I2C pas encore attendu (--pace)
+        self.t0          = time.perf_counter()
+        self.stats       = {'i2c_transactions': 0, 'i2c_writes': 0, 'i2c_time_s': 0.0,
+                            'rx_bytes': 0, 'tx_bytes': 0, 'lines_out': 0}
+        self.port        = None
+        self.thread      = None
+
+    # —— comptabilité I2C ——
+    def _account(self, seconds):
+        with self.lock:
+            self.stats['i2c_transactions'] += 1
+            self.stats['i2c_time_s'] += seconds
+        if self.pace:
+            self.debt += seconds
+            if self.debt >= 0.001:          # time.sleep n’est pas précis en dessous
+                t = time.perf_counter()
+                time.sleep(self.debt)
+                self.debt -= time.perf_counter() - t
+
+    def _log_write(self, bus, addr, reg, data):
+        self.stats['i2c_writes'] += 1
+        self.writes.append((time.perf_counter(), bus, addr, reg, data))
+
+    # —— modules simulés ——
+    def _machine(self):
+        pico = self
+
+        class Pin:
+            IN, OUT, OPEN_DRAIN = 0, 1, 2
+            PULL_UP, PULL_DOWN  = 1, 2
+
+            def __init__(self, id, mode=-1, pull=-1, value=None):
+                self.id, self.mode, self.pull = id, mode, pull
+                pico.pins[id] = self
+                self._value = 0 if value is None else int(bool(value))
+
+            def value(self, v=None):
+                if v is None:
+                    if self.mode == Pin.IN:
+                        if pico.maintenance and self.id == 28:
+                            return 0
+                        return 0 if self.pull == Pin.PULL_DOWN else 1
+                    return self._value
+                self._value = int(bool(v))
+
+            def on(self):
+                self._value = 1
+
+            def off(self):
+                self._value = 0
+
+            def toggle(self):
+                self._value ^= 1
+
+            __call__ = value
+
+        def SoftI2C(scl=None, sda=None, freq=400000, timeout=50000):
+            bus = SimI2C(pico, len(pico.buses), freq)
+            pico.buses.append(bus)
+            return bus
+
+        mod = types.ModuleType('machine')
+        mod.Pin, mod.SoftI2C, mod.I2C = Pin, SoftI2C, SoftI2C
+        mod.freq = lambda *a: 125_000_000
+        return mod
+
+    def _time(self):
+        pico = self
+        mod = types.ModuleType('time')
+
+        def sleep(s):
+            if pico.stopping:
+                raise _Halt()
+            time.sleep(s)
+
+        mod.ticks_ms   = lambda: int(time.perf_counter() * 1000) % TICKS_PERIOD
+        mod.ticks_us   = lambda: int(time.perf_counter() * 1_000_000) % TICKS_PERIOD
+        mod.ticks_add  = lambda t, d: (t + d) % TICKS_PERIOD
+        mod.ticks_diff = lambda a, b: ((a - b + TICKS_PERIOD // 2) % TICKS_PERIOD) - TICKS_PERIOD // 2
+        mod.sleep      = sleep
+        mod.sleep_ms   = lambda ms: sleep(ms / 1000)
+        mod.sleep_us   = lambda us: sleep(us / 1_000_000)
+        mod.time       = time.time
+        return mod
+
+    def _select(self, stdin):
+        class Poll:
+            def register(self, obj, mask=select.POLLIN):
+                pass
+
+            def unregister(self, obj):
+                pass
+
+            def poll(self, timeout=-1):
+                t = None if timeout is None or timeout < 0 else timeout / 1000
+                return [(stdin, select.POLLIN)] if stdin.ready(t) else []
+
+        mod = types.ModuleType('select')
+        mod.poll, mod.POLLIN, mod.POLLOUT = Poll, select.POLLIN, select.POLLOUT
+        return mod
+
+    def _sys(self, stdin):
+        mod = types.ModuleType('sys')
+        mod.stdin    = stdin
+        mod.platform = 'rp2'
+        mod.implementation = types.SimpleNamespace(name='micropython')
+
+        def exit(code=0):
+            raise SystemExit(code)
+        mod.exit = exit
+        return mod
+
+    def _micropython(self):
+        mod = types.ModuleType('micropython')
+        mod.kbd_intr = lambda c: None
+        mod.const    = lambda x: x
+        return mod
+
+    def _print(self, fd):
+        pico = self
+
+        def vprint(*args, sep=' ', end='\n', file=None, flush=False):
+            # sortie USB CDC de MicroPython : \n → \r\n
+            data = (sep.join(str(a) for a in args) + end).replace('\n', '\r\n').encode('utf-8')
+            pico.stats['tx_bytes'] += len(data)
+            pico.stats['lines_out'] += 1
+            try:
+                os.write(fd, data)
+            except OSError:
+                pass
+        return vprint
+
+    # —— cycle de vie ——
+    def start(self):
+        import pty
+        import tty
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)      # pas d’écho ni de traduction côté hôte
+        self.port = os.ttyname(self.slave)
+        if self.link:
+            try:
+                os.unlink(self.link)
+            except OSError:
+                pass
+            os.symlink(self.port, self.link)
+
+        stdin   = VirtualStdin(self, self.master)
+        modules = {
+            'machine':     self._machine(),
+            'time':        self._time(),
+            'utime':       self._time(),
+            'select':      self._select(stdin),
+            'sys':         self._sys(stdin),
+            'micropython': self._micropython(),
+            'math':        math,
+        }
+        real_import = builtins.__import__
+
+        def fw_import(name, globals=None, locals=None, fromlist=(), level=0):
+            if name in modules:
+                return modules[name]
+            return real_import(name, globals, locals, fromlist, level)
+
+        fw_builtins = dict(vars(builtins))
+        fw_builtins['__import__'] = fw_import
+        fw_builtins['print']      = self._print(self.master)
+        self.ns = {'__name__': '__main__', '__file__': self.firmware, '__builtins__': fw_builtins}
+
+        with open(self.firmware, encoding='utf-8') as fh:
+            code = compile(fh.read(), self.firmware, 'exec')
+        self.thread = threading.Thread(target=self._run, args=(code,), name="VirtualPico", daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self, code):
+        try:
+            exec(code, self.ns)
+        except _Halt:
+            pass
+        except SystemExit:
+            pass
+        except BaseException as e:
+            self.error = e
+            import traceback
+            traceback.print_exc()
+
+    def stop(self, timeout=1.0):
+        self.stopping = True
+        if self.thread:
+            self.thread.join(timeout)
+        for fd in (getattr(self, 'master', None), getattr(self, 'slave', None)):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        if self.link:
+            try:
+                os.unlink(self.link)
+            except OSError:
+                pass
+
+    # —— observation ——
+    def channels(self, bus):
+        """16 (on, off) du PCA9685 du bus `bus`."""
+        dev = self.buses[bus].devices[PCA_ADDR]
+        return [dev.channel(ch) for ch in range(16)]
+
+    def writes_since(self, t):
+        return [w for w in list(self.writes) if w[0] >= t]
+
+    def summary(self):
+        s = self.stats
+        up = time.perf_counter() - self.t0
+        return (f"up {up:.1f}s | rx {s['rx_bytes']} B, tx {s['tx_bytes']} B ({s['lines_out']} lines) | "
+                f"I2C {s['i2c_transactions']} transactions, {s['i2c_writes']} register writes, "
+                f"{s['i2c_time_s'] * 1000:.1f} ms bus time"
+                f"{' (paced)' if self.pace else ''}")
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Pico virtuel (rp2040/main.py sur pty)")
+    parser.add_argument('--firmware', default=MAIN_PY)
+    parser.add_argument('--link', default=None, help="lien symbolique stable vers le pty (ex. /tmp/ttyPICO)")
+    parser.add_argument('--i2c-khz', type=float, default=None,
+                        help="horloge I2C effective (défaut : freq demandée par le firmware)")
+    parser.add_argument('--pace', action='store_true', help="attendre réellement le temps I2C modélisé")
+    parser.add_argument('--maintenance', action='store_true', help="GP28 à la masse au démarrage")
+    parser.add_argument('--stats', type=float, default=0, help="bilan toutes les N secondes")
+    args = parser.parse_args()
+
+    pico = VirtualPico(args.firmware, args.i2c_khz, args.pace, args.link, args.maintenance).start()
+    print(f"Virtual Pico on {pico.port}" + (f" (→ {args.link})" if args.link else ""))
+    try:
+        while pico.thread.is_alive():
+            pico.thread.join(args.stats or 0.5)
+            if args.stats:
+                print(pico.summary())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pico.stop()
+        print(pico.summary())
+        if pico.error:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()